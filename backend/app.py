@@ -39,6 +39,10 @@ from config import *
 
 app = Flask(__name__)
 
+# orjson-backed jsonify()/get_json() (stdlib fallback when orjson is missing)
+from utils.fast_json import OrjsonProvider
+app.json = OrjsonProvider(app)
+
 # Initialize rate limiting BEFORE importing routes (routes use limiter decorators)
 from middleware.rate_limit import init_limiter, rate_limit_error_handler
 limiter = init_limiter(app)
@@ -23,6 +23,17 @@ LOG_FILE = "backend_graphql.log"
 # Analytics / LLM configuration
 ANALYTICS_ENABLED = os.getenv("ANALYTICS_ENABLED", "True") == "True"
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
+# Chat message shape sent through the OpenAI client: "openai" (plain strings) or
+# "anthropic" (cache_control breakpoints, for an OpenAI-compatible gateway in
+# front of Claude, selected with the SDK's OPENAI_BASE_URL)
+LLM_MESSAGE_FORMAT = os.getenv("LLM_MESSAGE_FORMAT", "openai")
+# Fine-tuned models trained on the few-shot examples
+# (backend/scripts/export_fewshot_finetune.py). When set, requests to them
+# carry only the system prompt and the user turn.
+LLM_DRAWING_FINETUNED_MODEL = os.getenv("LLM_DRAWING_FINETUNED_MODEL", "")
+LLM_COMPLETION_FINETUNED_MODEL = os.getenv("LLM_COMPLETION_FINETUNED_MODEL", "")
+# How long the local Ollama fallback model stays loaded after a call
+OLLAMA_KEEP_ALIVE = os.getenv("OLLAMA_KEEP_ALIVE", "30m")
 ANALYTICS_COLLECTION_NAME = os.getenv("ANALYTICS_COLLECTION_NAME", "analytics_events")
 ANALYTICS_AGGREGATES_COLLECTION = os.getenv("ANALYTICS_AGGREGATES_COLLECTION", "analytics_aggregates")
 
@@ -46,6 +57,50 @@ if not ROOM_MASTER_KEY_B64:
 REDIS_HOST = os.getenv("REDIS_HOST", "localhost")
 REDIS_PORT = int(os.getenv("REDIS_PORT", "6379"))
 
+# AI assistant response cache (Redis-backed, see services/llm_cache.py)
+LLM_CACHE_ENABLED = os.getenv("LLM_CACHE_ENABLED", "True") == "True"
+LLM_CACHE_TTL_SECS = int(os.getenv("LLM_CACHE_TTL_SECS", "3600"))
+# In-process memo of raw OpenAI replies per identical message list (services/llm_service.py)
+LLM_RESPONSE_CACHE_SIZE = int(os.getenv("LLM_RESPONSE_CACHE_SIZE", "1024"))
+# Optional on-disk tier under that memo (needs diskcache): survives restarts and
+# is shared by every worker pointed at the same directory. Empty disables it.
+LLM_DISK_CACHE_PATH = os.getenv("LLM_DISK_CACHE_PATH", "")
+LLM_DISK_CACHE_SIZE_LIMIT = int(os.getenv("LLM_DISK_CACHE_SIZE_LIMIT", str(2**30)))
+LLM_DISK_CACHE_TTL_SECS = int(os.getenv("LLM_DISK_CACHE_TTL_SECS", str(7*24*3600)))
+# Optional embedding-similarity tier for paraphrased prompts (needs numpy + sentence-transformers)
+LLM_SEMANTIC_CACHE_ENABLED = os.getenv("LLM_SEMANTIC_CACHE_ENABLED", "False") == "True"
+LLM_SEMANTIC_CACHE_THRESHOLD = float(os.getenv("LLM_SEMANTIC_CACHE_THRESHOLD", "0.92"))
+LLM_SEMANTIC_CACHE_PATH = os.getenv("LLM_SEMANTIC_CACHE_PATH", "")
+# Shape completion reuses the result for a near-identical canvas (OpenAI embeddings + numpy)
+LLM_COMPLETION_CACHE_ENABLED = os.getenv("LLM_COMPLETION_CACHE_ENABLED", "False") == "True"
+LLM_COMPLETION_CACHE_THRESHOLD = float(os.getenv("LLM_COMPLETION_CACHE_THRESHOLD", "0.95"))
+LLM_COMPLETION_CACHE_SIZE = int(os.getenv("LLM_COMPLETION_CACHE_SIZE", "512"))
+LLM_COMPLETION_CACHE_TTL_SECS = int(os.getenv("LLM_COMPLETION_CACHE_TTL_SECS", "600"))
+LLM_COMPLETION_EMBEDDING_MODEL = os.getenv("LLM_COMPLETION_EMBEDDING_MODEL", "text-embedding-3-small")
+
+# Upstream model calls from the AI assistant routes run on a bounded pool so a
+# slow generation cannot hold a request thread indefinitely.
+AI_MAX_INFLIGHT = int(os.getenv("AI_MAX_INFLIGHT", "8"))
+AI_REQUEST_TIMEOUT_SECS = float(os.getenv("AI_REQUEST_TIMEOUT_SECS", "60"))
+# How long a request waits for a free upstream slot before getting 429
+AI_QUEUE_WAIT_SECS = float(os.getenv("AI_QUEUE_WAIT_SECS", "2"))
+# Ollama is started alongside a still-pending OpenAI call after this many
+# seconds; the first successful answer wins (negative disables hedging)
+LLM_HEDGE_DELAY_SECS = float(os.getenv("LLM_HEDGE_DELAY_SECS", "1.5"))
+# OpenAI calls in flight per process, and how often the SDK retries a 429/5xx
+# (exponential backoff with jitter, honouring Retry-After) before giving up
+OPENAI_CONCURRENCY = int(os.getenv("OPENAI_CONCURRENCY", "8"))
+OPENAI_MAX_RETRIES = int(os.getenv("OPENAI_MAX_RETRIES", "3"))
+# Pooled HTTP client shared by all OpenAI calls (see services/http_client.py)
+UPSTREAM_HTTP_MAX_CONNECTIONS = int(os.getenv("UPSTREAM_HTTP_MAX_CONNECTIONS", "64"))
+UPSTREAM_HTTP_MAX_KEEPALIVE = int(os.getenv("UPSTREAM_HTTP_MAX_KEEPALIVE", "32"))
+UPSTREAM_HTTP_CONNECT_TIMEOUT_SECS = float(os.getenv("UPSTREAM_HTTP_CONNECT_TIMEOUT_SECS", "5"))
+# Prompts outside these bounds, or matching the comma-separated blocklist, are
+# answered directly without calling a model.
+AI_MIN_PROMPT_CHARS = int(os.getenv("AI_MIN_PROMPT_CHARS", "3"))
+AI_MAX_PROMPT_CHARS = int(os.getenv("AI_MAX_PROMPT_CHARS", "4000"))
+AI_PROMPT_BLOCKLIST = os.getenv("AI_PROMPT_BLOCKLIST", "")
+
 # Rate Limiting Configuration
 RATE_LIMIT_STORAGE_URI = f"redis://{REDIS_HOST}:{REDIS_PORT}"
 RATE_LIMIT_ENABLED = os.getenv("RATE_LIMIT_ENABLED", "True") == "True"
@@ -74,6 +129,9 @@ RATE_LIMIT_SEARCH_MINUTE = int(os.getenv("RATE_LIMIT_SEARCH_MINUTE", "30"))
 # Burst protection
 RATE_LIMIT_BURST_SECOND = int(os.getenv("RATE_LIMIT_BURST_SECOND", "10"))
 
+# AI assistant generation endpoints (each request is a model call)
+RATE_LIMIT_AI_MINUTE = int(os.getenv("RATE_LIMIT_AI_MINUTE", "10"))
+
 # Logging Configuration
 LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()  # DEBUG, INFO, WARNING, ERROR, CRITICAL
 LOG_EXCLUDE_LEVELS = os.getenv("LOG_EXCLUDE_LEVELS", "WARNING")  # Comma-separated: WARNING,DEBUG
@@ -514,3 +514,61 @@ def validate_stroke_payload(value) -> Tuple[bool, str]:
         return False, "Signature and signerPubKey must both be provided or both omitted"
     
     return True, None
+
+
+def validate_non_empty_string(value) -> Tuple[bool, str]:
+    """
+    Validate a required free-text field (e.g. an AI prompt).
+    """
+    if not isinstance(value, str) or not value.strip():
+        return False, "Must be a non-empty string"
+    
+    return True, None
+
+
+def validate_object(value) -> Tuple[bool, str]:
+    """
+    Validate a JSON object (dict) field.
+    """
+    if not isinstance(value, dict):
+        return False, "Must be an object"
+    
+    return True, None
+
+
+def validate_object_list(min_items: int = 0, max_items: int = None):
+    """
+    Factory for validators of JSON arrays whose items are all objects.
+    """
+    def validator(value) -> Tuple[bool, str]:
+        if not isinstance(value, list):
+            return False, "Must be an array"
+        
+        if len(value) < min_items:
+            return False, f"Must contain at least {min_items} item(s)"
+        
+        if max_items is not None and len(value) > max_items:
+            return False, f"Must contain at most {max_items} items"
+        
+        if not all(isinstance(item, dict) for item in value):
+            return False, "Every item must be an object"
+        
+        return True, None
+    
+    return validator
+
+
+def validate_integer_range(min_value: int, max_value: int):
+    """
+    Factory for integer validators with inclusive bounds (booleans rejected).
+    """
+    def validator(value) -> Tuple[bool, str]:
+        if isinstance(value, bool) or not isinstance(value, int):
+            return False, "Must be an integer"
+        
+        if value < min_value or value > max_value:
+            return False, f"Must be between {min_value} and {max_value}"
+        
+        return True, None
+    
+    return validator
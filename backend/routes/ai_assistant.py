@@ -1,39 +1,307 @@
-from flask import Blueprint, request, jsonify
+from flask import Blueprint, Response, request, jsonify, send_file, stream_with_context
 # Import style transfer function as well
 from services.llm_service import (
     prompt_to_drawings,
+    prompt_to_drawings_stream,
     complete_shape_from_canvas,
     beautify_canvas_state,
     style_transfer_canvas,
 )
-from services.llm_service import recognize_objects_in_box
+from services.llm_service import (
+    recognize_objects_in_box,
+    recognize_objects_in_boxes,
+    RECOGNITION_BATCH_MAX,
+)
+from services.llm_cache import LLMCache, SemanticCache, cache_key, canvas_digest, run_or_join
+from services.db import redis_client
+from config import (
+    LLM_CACHE_ENABLED,
+    LLM_CACHE_TTL_SECS,
+    LLM_SEMANTIC_CACHE_ENABLED,
+    LLM_SEMANTIC_CACHE_THRESHOLD,
+    LLM_SEMANTIC_CACHE_PATH,
+    AI_MAX_INFLIGHT,
+    AI_REQUEST_TIMEOUT_SECS,
+    AI_QUEUE_WAIT_SECS,
+    AI_MIN_PROMPT_CHARS,
+    AI_MAX_PROMPT_CHARS,
+    AI_PROMPT_BLOCKLIST,
+    RATE_LIMIT_AI_MINUTE,
+)
+from middleware.rate_limit import limiter
+from middleware.validators import (
+    validate_non_empty_string,
+    validate_object,
+    validate_object_list,
+    validate_integer_range,
+    validate_optional_string,
+)
+from utils import fast_json
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
 # from services.image_generation_service import (
 #     text_to_image as img_text_to_image,
 # )
+import atexit
 import logging
+import re
+import threading
 import base64
 import io
 
 ai_assistant_bp = Blueprint('ai_assistant', __name__)
 logger = logging.getLogger(__name__)
 
+llm_cache = LLMCache(redis_client, ttl=LLM_CACHE_TTL_SECS)
+
+# Paraphrase tier for the prompt-driven routes (/drawing, /style). Beautify and
+# completion carry no prompt, so the exact-match tier already covers them.
+semantic_cache = None
+if LLM_SEMANTIC_CACHE_ENABLED:
+    semantic_cache = SemanticCache(
+        threshold=LLM_SEMANTIC_CACHE_THRESHOLD,
+        index_path=LLM_SEMANTIC_CACHE_PATH or None,
+    )
+    semantic_cache.warm_up()
+    atexit.register(semantic_cache.save)
+
+
+# Bounded pool for upstream model calls; see _run_upstream.
+executor = ThreadPoolExecutor(max_workers=AI_MAX_INFLIGHT, thread_name_prefix="ai-upstream")
+# One slot per running model call (including /drawing/stream); held until the
+# call actually finishes, even if the waiting request already timed out.
+_upstream_slots = threading.BoundedSemaphore(AI_MAX_INFLIGHT)
+
+
+class UpstreamTimeout(Exception):
+    """Raised when an upstream model call exceeds AI_REQUEST_TIMEOUT_SECS."""
+
+
+class UpstreamBusy(Exception):
+    """Raised when no upstream slot frees up within AI_QUEUE_WAIT_SECS."""
+
+
+def _acquire_upstream_slot():
+    if not _upstream_slots.acquire(timeout=AI_QUEUE_WAIT_SECS):
+        raise UpstreamBusy(f"All {AI_MAX_INFLIGHT} model slots are busy; retry shortly.")
+
+
+def _run_upstream(fn, *args):
+    """
+    Run a model call on the shared executor and wait at most
+    AI_REQUEST_TIMEOUT_SECS for it. At most AI_MAX_INFLIGHT calls run at
+    once; callers wait up to AI_QUEUE_WAIT_SECS for a slot and otherwise get
+    UpstreamBusy (429), so overload is shed instead of queueing unboundedly.
+    """
+    _acquire_upstream_slot()
+    try:
+        future = executor.submit(fn, *args)
+    except BaseException:
+        _upstream_slots.release()
+        raise
+    future.add_done_callback(lambda _: _upstream_slots.release())
+    try:
+        return future.result(timeout=AI_REQUEST_TIMEOUT_SECS)
+    except FutureTimeoutError:
+        future.cancel()
+        name = getattr(fn, "__name__", "upstream call")
+        raise UpstreamTimeout(f"{name} did not finish within {AI_REQUEST_TIMEOUT_SECS:g}s")
+
+
+def _call_upstream(key, fn, *args):
+    """_run_upstream, coalesced with an identical request (same cache key) already in flight."""
+    return run_or_join(key, _run_upstream, fn, *args)
+
+
+def _timeout_response(e):
+    logger.warning("AI upstream timeout: %s", e)
+    return jsonify({"error": "upstream_timeout", "detail": str(e)}), 504
+
+
+def _busy_response(e):
+    logger.warning("AI upstream busy: %s", e)
+    response = jsonify({"error": "upstream_busy", "detail": str(e)})
+    response.headers["Retry-After"] = "1"
+    return response, 429
+
+
+_blocked_prompt_re = None
+_blocked_words = [w.strip() for w in AI_PROMPT_BLOCKLIST.split(",") if w.strip()]
+if _blocked_words:
+    _blocked_prompt_re = re.compile(r"\b(?:" + "|".join(map(re.escape, _blocked_words)) + r")\b", re.IGNORECASE)
+
+# Requests answered by should_short_circuit without an upstream call
+direct_responses_total = 0
+_direct_responses_lock = threading.Lock()
+
+
+def should_short_circuit(prompt, canvas_state):
+    """
+    Decide whether a request can be answered without calling a model.
+
+    Returns (True, (body, status)) for requests with a fixed answer: prompts
+    too short to describe anything, prompts over AI_MAX_PROMPT_CHARS (413),
+    blocklisted prompts (400) and, for prompt-less routes such as /beautify,
+    canvases with nothing on them. Otherwise returns (False, None).
+    """
+    global direct_responses_total
+
+    response = None
+    if prompt is not None:
+        if len(prompt) < AI_MIN_PROMPT_CHARS:
+            response = {"objects": []}, 200
+        elif len(prompt) > AI_MAX_PROMPT_CHARS:
+            response = {"error": "payload_too_large", "detail": f"'prompt' exceeds {AI_MAX_PROMPT_CHARS} characters."}, 413
+        elif _blocked_prompt_re is not None and _blocked_prompt_re.search(prompt):
+            response = {"error": "bad_request", "detail": "Prompt was rejected by the content filter."}, 400
+    elif not (canvas_state.get("objects") or canvas_state.get("drawings")):
+        response = {"objects": []}, 200
+
+    if response is None:
+        return False, None
+    with _direct_responses_lock:
+        direct_responses_total += 1
+    return True, response
+
+
+# Request-body schemas, in the validate_request_data format
+# (field -> {"validator": fn returning (ok, message), "required": bool}).
+PROMPT_SCHEMA = {
+    "prompt": {"validator": validate_non_empty_string, "required": True},
+    "canvasState": {"validator": validate_object, "required": False},
+}
+CANVAS_SCHEMA = {
+    "canvasState": {"validator": validate_object, "required": True},
+}
+IMAGE_SCHEMA = {
+    "prompt": {"validator": validate_non_empty_string, "required": True},
+    "width": {"validator": validate_integer_range(16, 2048), "required": False},
+    "height": {"validator": validate_integer_range(16, 2048), "required": False},
+    "style": {"validator": validate_optional_string(max_length=200), "required": False},
+}
+STYLE_SCHEMA = {
+    "canvasState": {"validator": validate_object, "required": True},
+    "stylePrompt": {"validator": validate_non_empty_string, "required": True},
+}
+RECOGNIZE_SCHEMA = {
+    "canvasObjects": {"validator": validate_object_list(), "required": False},
+    "box": {"validator": validate_object, "required": False},
+    "boxes": {"validator": validate_object_list(min_items=1, max_items=RECOGNITION_BATCH_MAX), "required": False},
+    "bounds": {"validator": validate_object, "required": False},
+}
+
+
+def _validate_body(data, schema):
+    """Return a 400 response for the first invalid field in ``data``, or None if it is valid."""
+    for field, config in schema.items():
+        value = data.get(field)
+        if value is None:
+            if config["required"]:
+                return jsonify({"error": "bad_request", "detail": f"Missing '{field}'."}), 400
+            continue
+        is_valid, error_msg = config["validator"](value)
+        if not is_valid:
+            return jsonify({"error": "bad_request", "detail": f"Invalid '{field}': {error_msg}."}), 400
+    return None
+
+
+def _payload():
+    """
+    Parsed JSON body ({} when absent/invalid); Flask caches the parse per request.
+    Parsing goes through app.json, i.e. orjson when it is installed.
+    """
+    return request.get_json(silent=True) or {}
+
+
+def _cache_lookup(route, key_payload):
+    """
+    Return (key, cached_response). The key is always computed (it also keys
+    in-flight coalescing); the response is None when caching is disabled or on a miss.
+    """
+    key = cache_key(route, key_payload)
+    if not LLM_CACHE_ENABLED or request.if_none_match.contains(key):
+        # (the handler answers 304 for a key the client already holds)
+        return key, None
+    return key, llm_cache.get(key)
+
+
+def _not_modified(key):
+    """304 response when the client's If-None-Match already names this request's ETag, else None."""
+    if not request.if_none_match.contains(key):
+        return None
+    response = Response(status=304)
+    response.set_etag(key)
+    response.headers["Cache-Control"] = f"private, max-age={LLM_CACHE_TTL_SECS}"
+    return response
+
+
+def _cacheable_response(result, key):
+    """
+    200 JSON response tagged with the request's cache key as ETag, so the
+    browser (or a CDN) can revalidate it with If-None-Match. Error payloads
+    are returned untagged.
+    """
+    response = jsonify(result)
+    if not (isinstance(result, dict) and "error" in result):
+        response.set_etag(key)
+        response.headers["Cache-Control"] = f"private, max-age={LLM_CACHE_TTL_SECS}"
+    return response, 200
+
+
+def _cache_store(key, result):
+    if LLM_CACHE_ENABLED:
+        llm_cache.set(key, result)
+
+
+def _semantic_lookup(prompt, canvas_state):
+    """Return (canvas_hash, cached_response) from the paraphrase tier."""
+    if semantic_cache is None:
+        return None, None
+    canvas_hash = canvas_digest(canvas_state)
+    return canvas_hash, semantic_cache.get(prompt, canvas_hash)
+
+
+def _is_rollback(result):
+    """Beautify/style flag the caller's original objects with "rolledBack" when every model fails; never cache that."""
+    return isinstance(result, dict) and result.get("rolledBack") is True
+
+
+def _without_rollback_flag(result):
+    # Coalesced requests share one result dict, so copy instead of popping
+    return {k: v for k, v in result.items() if k != "rolledBack"}
+
 
 @ai_assistant_bp.route('/api/ai_assistant/drawing', methods=['POST'])
+@limiter.limit(f"{RATE_LIMIT_AI_MINUTE}/minute")
 def text_to_drawings():
     """
     Body: { "prompt": "<natural language description>", canvasState: {json object} }
     Returns: Parsed drawing JSON (shape/color/size/position/...) or an error payload.
     """
     try:
-        payload = request.get_json(silent=True) or {}
-        prompt = payload.get("prompt")
+        payload = _payload()
+        invalid = _validate_body(payload, PROMPT_SCHEMA)
+        if invalid:
+            return invalid
+        prompt = payload["prompt"]
         canvasState = payload.get("canvasState") or {}
 
-        if not isinstance(prompt, str) or not prompt.strip():
-            return jsonify({"error": "bad_request", "detail": "Missing or invalid 'prompt' (string)."}), 400
+        direct, response = should_short_circuit(prompt.strip(), canvasState)
+        if direct:
+            body, status = response
+            return jsonify(body), status
+
+        key, cached = _cache_lookup("drawing", {"prompt": prompt.strip(), "canvasState": canvas_digest(canvasState)})
+        not_modified = _not_modified(key)
+        if not_modified is not None:
+            return not_modified
+        if cached is not None:
+            return _cacheable_response(cached, key)
+        canvas_hash, cached = _semantic_lookup(prompt.strip(), canvasState)
+        if cached is not None:
+            return _cacheable_response(cached, key)
 
         logger.info("AI drawing requested")
-        result = prompt_to_drawings(prompt.strip(), canvasState)
+        result = _call_upstream(key, prompt_to_drawings, prompt.strip(), canvasState)
 
         print(f"\n\nModel result: {result}\n\n")
 
@@ -42,12 +310,93 @@ def text_to_drawings():
             logger.warning("AI drawing failed: %s", result)
             return jsonify({"error": "upstream_model_error", "detail": result}), 502
 
-        return jsonify(result), 200
+        _cache_store(key, result)
+        if canvas_hash:
+            semantic_cache.add(prompt.strip(), canvas_hash, result)
+        return _cacheable_response(result, key)
+    except UpstreamTimeout as e:
+        return _timeout_response(e)
+    except UpstreamBusy as e:
+        return _busy_response(e)
     except Exception as e:
         logger.exception("Unhandled error in /drawing")
         return jsonify({"error": "server_error", "detail": str(e)}), 500
 
 
+
+def _sse(data, event=None):
+    """Format one Server-Sent Events message."""
+    head = f"event: {event}\n" if event else ""
+    return f"{head}data: {fast_json.dumps(data)}\n\n"
+
+
+@ai_assistant_bp.route('/api/ai_assistant/drawing/stream', methods=['POST'])
+@limiter.limit(f"{RATE_LIMIT_AI_MINUTE}/minute")
+def text_to_drawings_stream():
+    """
+    Streaming variant of /drawing (text/event-stream).
+    Body: same as /drawing.
+    Events: one "data: {object}" message per drawing object as the model produces it,
+            then "event: done" with {"count": n}, or "event: error" with an error payload.
+    """
+    payload = _payload()
+    invalid = _validate_body(payload, PROMPT_SCHEMA)
+    if invalid:
+        return invalid
+    prompt = payload["prompt"].strip()
+    canvasState = payload.get("canvasState") or {}
+
+    direct, response = should_short_circuit(prompt, canvasState)
+    if direct and response[1] != 200:
+        body, status = response
+        return jsonify(body), status
+
+    # Shares the /drawing cache entry: a full response from either route replays here
+    key, cached = _cache_lookup("drawing", {"prompt": prompt, "canvasState": canvas_digest(canvasState)})
+    if direct:
+        cached = response[0]
+    if cached is None:
+        try:
+            _acquire_upstream_slot()
+        except UpstreamBusy as e:
+            return _busy_response(e)
+
+    def generate():
+        if cached is not None:
+            objects = (cached.get("objects") if isinstance(cached, dict) else None) or []
+            for obj in objects:
+                yield _sse(obj)
+            yield _sse({"count": len(objects)}, event="done")
+            return
+
+        logger.info("AI drawing stream requested")
+        objects = []
+        try:
+            for item in prompt_to_drawings_stream(prompt, canvasState):
+                if "error" in item:
+                    logger.warning("AI drawing stream failed: %s", item)
+                    yield _sse({"error": "upstream_model_error", "detail": item}, event="error")
+                    return
+                objects.append(item)
+                yield _sse(item)
+        except Exception as e:
+            logger.exception("Unhandled error in /drawing/stream")
+            yield _sse({"error": "server_error", "detail": str(e)}, event="error")
+            return
+
+        _cache_store(key, {"objects": objects})
+        yield _sse({"count": len(objects)}, event="done")
+
+    stream = Response(
+        stream_with_context(generate()),
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+    if cached is None:
+        # Released when the stream ends or the client disconnects
+        stream.call_on_close(_upstream_slots.release)
+    return stream
+
 @ai_assistant_bp.route('/api/ai_assistant/complete', methods=['POST'])
 def shape_completion():
     """
@@ -55,82 +404,104 @@ def shape_completion():
     Returns: { complete, confidence, object{ color, lineWidth, pathData{...} } } or an error payload.
     """
     try:
-        payload = request.get_json(silent=True) or {}
-        canvas_state = payload.get("canvasState")
-        if not isinstance(canvas_state, dict):
-            return jsonify({"error": "bad_request", "detail": "Missing or invalid 'canvas_state' (object)."}), 400
+        payload = _payload()
+        invalid = _validate_body(payload, CANVAS_SCHEMA)
+        if invalid:
+            return invalid
+        canvas_state = payload["canvasState"]
+
+        key, cached = _cache_lookup("complete", {"canvasState": canvas_digest(canvas_state)})
+        not_modified = _not_modified(key)
+        if not_modified is not None:
+            return not_modified
+        if cached is not None:
+            return _cacheable_response(cached, key)
 
         logger.info("AI shape completion requested")
-        suggestion = complete_shape_from_canvas(canvas_state)
-
-        if not isinstance(canvas_state, dict):
-            return jsonify({
-                "error": "bad_request",
-                "detail": "Missing or invalid 'canvasState' (object)."
-            }), 400
-
-        return jsonify(suggestion), 200
+        suggestion = _call_upstream(key, complete_shape_from_canvas, canvas_state)
+
+        _cache_store(key, suggestion)
+        return _cacheable_response(suggestion, key)
+    except UpstreamTimeout as e:
+        return _timeout_response(e)
+    except UpstreamBusy as e:
+        return _busy_response(e)
     except Exception as e:
         logger.exception("Unhandled error in /complete")
         return jsonify({"error": "server_error", "detail": str(e)}), 500
 
 
 @ai_assistant_bp.route('/api/ai_assistant/image', methods=['POST'])
+@limiter.limit(f"{RATE_LIMIT_AI_MINUTE}/minute")
 def text_to_image():
     """
-    TODO: To be implemented
     Body: { "prompt": "<string>", "width"?: int, "height"?: int, "style"?: str }
+    Query: ?format=binary returns the raw image/png body (use with URL.createObjectURL)
     Returns: { "imageDataUrl": "data:image/png;base64,..." }
     """
     try:
-        payload = request.get_json(silent=True) or {}
-        prompt = payload.get("prompt", "")
+        payload = _payload()
+        invalid = _validate_body(payload, IMAGE_SCHEMA)
+        if invalid:
+            return invalid
+        prompt = payload["prompt"]
         width = payload.get("width") or 512
         height = payload.get("height") or 512
         style = payload.get("style") or "default"
 
-        if not isinstance(prompt, str) or not prompt.strip():
-            return jsonify({
-                "error": "bad_request",
-                "detail": "Missing or invalid 'prompt' (string)."
-            }), 400
+        logger.info("AI text-to-image requested")
 
-            logger.info("AI text-to-image requested")
+        # Try to generate via image_generation_service
+        try:
+            from services.image_generation_service import text_to_image as img_text_to_image
+            img_bytes, mime = _run_upstream(img_text_to_image, prompt.strip(), width, height, style)
+        except (UpstreamTimeout, UpstreamBusy):
+            raise
+        except Exception as e:
+            logger.exception("Image generation failed: %s", e)
+            return jsonify({"error": "image_generation_failed", "detail": str(e)}), 502
 
-            # Try to generate via image_generation_service
-            try:
-                from services.image_generation_service import text_to_image as img_text_to_image
-                pil_image = img_text_to_image(prompt.strip(), width=width, height=height, style=style)
-            except Exception as e:
-                logger.exception("Image generation failed: %s", e)
-                return jsonify({"error": "image_generation_failed", "detail": str(e)}), 502
+        if request.args.get("format") == "binary":
+            # send_file closes the buffer once the response is streamed
+            return send_file(io.BytesIO(img_bytes), mimetype=mime, as_attachment=False, download_name="ai.png")
 
-            buf = io.BytesIO()
-            pil_image.save(buf, format="PNG")
-            buf.seek(0)
-            encoded = base64.b64encode(buf.read()).decode("utf-8")
-            data_url = f"data:image/png;base64,{encoded}"
+        encoded = base64.b64encode(img_bytes).decode("ascii")
+        data_url = f"data:{mime};base64," + encoded
 
-            return jsonify({"imageDataUrl": data_url}), 200
+        return jsonify({"imageDataUrl": data_url}), 200
 
+    except UpstreamTimeout as e:
+        return _timeout_response(e)
+    except UpstreamBusy as e:
+        return _busy_response(e)
     except Exception as e:
         logger.exception("Unhandled error in /image")
         return jsonify({"error": "server_error", "detail": str(e)}), 500
 
 
 @ai_assistant_bp.route("/api/ai_assistant/beautify", methods=["POST"])
+@limiter.limit(f"{RATE_LIMIT_AI_MINUTE}/minute")
 def beautify_sketch():
     try:
-        payload = request.get_json(silent=True) or {}
-        canvas_state = payload.get("canvasState")
-
-        if not isinstance(canvas_state, dict):
-            return jsonify({
-                "error": "bad_request",
-                "detail": "Missing or invalid 'canvasState' (object)."
-            }), 400
-
-        result = beautify_canvas_state(canvas_state)
+        payload = _payload()
+        invalid = _validate_body(payload, CANVAS_SCHEMA)
+        if invalid:
+            return invalid
+        canvas_state = payload["canvasState"]
+
+        direct, response = should_short_circuit(None, canvas_state)
+        if direct:
+            body, status = response
+            return jsonify(body), status
+
+        key, cached = _cache_lookup("beautify", {"canvasState": canvas_digest(canvas_state)})
+        not_modified = _not_modified(key)
+        if not_modified is not None:
+            return not_modified
+        if cached is not None:
+            return _cacheable_response(cached, key)
+
+        result = _call_upstream(key, beautify_canvas_state, canvas_state)
         # print("\n\ncanvas_state!!!", canvas_state, "\n\n")
         # print("\n\nResult!!!", result, "\n\n")
 
@@ -141,31 +512,47 @@ def beautify_sketch():
                 "detail": "Beautify model returned invalid payload."
             }), 502
 
-        return jsonify(result), 200
+        if _is_rollback(result):
+            return jsonify(_without_rollback_flag(result)), 200
+        _cache_store(key, result)
+        return _cacheable_response(result, key)
 
+    except UpstreamTimeout as e:
+        return _timeout_response(e)
+    except UpstreamBusy as e:
+        return _busy_response(e)
     except Exception as e:
         logger.exception("Unhandled error in /beautify")
         return jsonify({"error": "server_error", "detail": str(e)}), 500
 
 
 @ai_assistant_bp.route('/api/ai_assistant/style', methods=['POST'])
+@limiter.limit(f"{RATE_LIMIT_AI_MINUTE}/minute")
 def style_transfer():
     """
     Body: { "canvasState": {...}, "stylePrompt": "<string describing style e.g. 'Van Gogh oil painting'" }
     Returns: { "objects": [...] } or error
     """
     try:
-        payload = request.get_json(silent=True) or {}
-        canvas_state = payload.get('canvasState')
-        style_prompt = payload.get('stylePrompt')
-
-        if not isinstance(canvas_state, dict):
-            return jsonify({"error": "bad_request", "detail": "Missing or invalid 'canvasState' (object)."}), 400
-        if not isinstance(style_prompt, str) or not style_prompt.strip():
-            return jsonify({"error": "bad_request", "detail": "Missing or invalid 'stylePrompt' (string)."}), 400
+        payload = _payload()
+        invalid = _validate_body(payload, STYLE_SCHEMA)
+        if invalid:
+            return invalid
+        canvas_state = payload['canvasState']
+        style_prompt = payload['stylePrompt']
+
+        key, cached = _cache_lookup("style", {"canvasState": canvas_digest(canvas_state), "stylePrompt": style_prompt.strip()})
+        not_modified = _not_modified(key)
+        if not_modified is not None:
+            return not_modified
+        if cached is not None:
+            return _cacheable_response(cached, key)
+        canvas_hash, cached = _semantic_lookup(style_prompt.strip(), canvas_state)
+        if cached is not None:
+            return _cacheable_response(cached, key)
 
         logger.info('AI style transfer requested')
-        result = style_transfer_canvas(canvas_state, style_prompt.strip())
+        result = _call_upstream(key, style_transfer_canvas, canvas_state, style_prompt.strip())
 
         # If the model returned an error payload, log it and return a safe
         # fallback: the original canvas objects so the client can continue.
@@ -175,7 +562,16 @@ def style_transfer():
             return jsonify({"objects": original_objects}), 200
 
         # Normal successful response
-        return jsonify(result), 200
+        if _is_rollback(result):
+            return jsonify(_without_rollback_flag(result)), 200
+        _cache_store(key, result)
+        if canvas_hash:
+            semantic_cache.add(style_prompt.strip(), canvas_hash, result)
+        return _cacheable_response(result, key)
+    except UpstreamTimeout as e:
+        return _timeout_response(e)
+    except UpstreamBusy as e:
+        return _busy_response(e)
     except Exception as e:
         logger.exception('Unhandled error in /style')
         return jsonify({"error": "server_error", "detail": str(e)}), 500
@@ -185,24 +581,60 @@ def style_transfer():
 def recognize():
     """
     Body: { "canvasObjects": [...], "box": { x,y,width,height }, "bounds": { width, height } }
-    Returns: { label, confidence, explanation } or error
+          or, to label several regions in one model call,
+          { "canvasObjects": [...], "boxes": [ { x,y,width,height }, ... ], "bounds": {...} }
+    Returns: { label, confidence, explanation } (a list of them for "boxes") or error
     """
     try:
-        payload = request.get_json(silent=True) or {}
+        payload = _payload()
         canvas_objects = payload.get('canvasObjects') or payload.get('objects') or []
         box = payload.get('box') or {}
+        boxes = payload.get('boxes')
         bounds = payload.get('bounds') or {}
 
-        if not isinstance(canvas_objects, list):
-            return jsonify({"error": "bad_request", "detail": "'canvasObjects' must be a list."}), 400
-
-        result = recognize_objects_in_box(canvas_objects, box, bounds)
+        invalid = _validate_body(
+            {"canvasObjects": canvas_objects, "box": box, "boxes": boxes, "bounds": bounds},
+            RECOGNIZE_SCHEMA,
+        )
+        if invalid:
+            return invalid
+
+        key_payload = {"canvasObjects": canvas_digest({"objects": canvas_objects, "bounds": bounds})}
+        if boxes is not None:
+            key_payload["boxes"] = boxes
+        else:
+            key_payload["box"] = box
+        key, cached = _cache_lookup("recognize", key_payload)
+        not_modified = _not_modified(key)
+        if not_modified is not None:
+            return not_modified
+        if cached is not None:
+            return _cacheable_response(cached, key)
+
+        if boxes is not None:
+            result = _call_upstream(key, recognize_objects_in_boxes, canvas_objects, boxes, bounds)
+        else:
+            result = _call_upstream(key, recognize_objects_in_box, canvas_objects, box, bounds)
 
         if isinstance(result, dict) and 'error' in result:
             logger.warning('Recognition upstream error: %s', result)
             return jsonify({"error": "upstream_model_error", "detail": result}), 502
 
-        return jsonify(result), 200
+        _cache_store(key, result)
+        return _cacheable_response(result, key)
+    except UpstreamTimeout as e:
+        return _timeout_response(e)
+    except UpstreamBusy as e:
+        return _busy_response(e)
     except Exception as e:
         logger.exception('Unhandled error in /recognize')
-        return jsonify({"error": "server_error", "detail": str(e)}), 500
\ No newline at end of file
+        return jsonify({"error": "server_error", "detail": str(e)}), 500
+
+
+@ai_assistant_bp.route('/api/ai_assistant/cache/stats', methods=['GET'])
+def cache_stats():
+    """Debug endpoint: hit/miss counters for the AI response cache."""
+    stats = {"enabled": LLM_CACHE_ENABLED, **llm_cache.stats(), "direct_responses_total": direct_responses_total}
+    if semantic_cache is not None:
+        stats["semantic"] = semantic_cache.stats()
+    return jsonify(stats), 200
\ No newline at end of file
@@ -0,0 +1,105 @@
+#!/usr/bin/env python3
+"""
+Export the text-to-drawing and shape-completion few-shot examples as OpenAI
+fine-tuning files, and optionally start the fine-tuning jobs.
+
+A model fine-tuned on these examples no longer needs them in every request.
+Set LLM_DRAWING_FINETUNED_MODEL / LLM_COMPLETION_FINETUNED_MODEL to the
+resulting model ids and the service sends only the system prompt and the
+user turn.
+
+Usage: run from repo root:
+  python3 backend/scripts/export_fewshot_finetune.py                      # writes draw.jsonl, complete.jsonl
+  python3 backend/scripts/export_fewshot_finetune.py --out-dir finetune/
+  python3 backend/scripts/export_fewshot_finetune.py \
+      --extra-draw more_draw.jsonl --extra-complete more_complete.jsonl --submit
+
+OpenAI requires at least 10 training examples per job, and the built-in
+few-shots are only 3 per task; add your own with --extra-* (same JSONL
+format: one {"messages": [...]} object per line). --submit refuses to upload
+a file below the minimum.
+"""
+import argparse
+import json
+import os
+import sys
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from services.llm_service import (
+    DRAWING_FEWSHOTS,
+    SHAPE_COMPLETION_FEWSHOTS,
+    SHAPE_COMPLETION_SYSTEM,
+    SYSTEM_PROMPT,
+)
+
+MIN_EXAMPLES = 10
+
+
+def training_examples(system_prompt, fewshots):
+    return [
+        {"messages": [
+            {"role": "system", "content": system_prompt},
+            {"role": "user", "content": user},
+            {"role": "assistant", "content": assistant},
+        ]}
+        for user, assistant in fewshots
+    ]
+
+
+def read_extra(path):
+    if not path:
+        return []
+    with open(path) as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def write_jsonl(path, examples):
+    with open(path, "w") as f:
+        for example in examples:
+            f.write(json.dumps(example, separators=(",", ":")) + "\n")
+
+
+def submit(path, base_model):
+    from services.llm_service import _get_openai_client
+
+    client = _get_openai_client()
+    with open(path, "rb") as f:
+        uploaded = client.files.create(file=f, purpose="fine-tune")
+    job = client.fine_tuning.jobs.create(training_file=uploaded.id, model=base_model)
+    return job.id
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Export few-shot examples as fine-tuning JSONL files.')
+    parser.add_argument('--out-dir', default='.', help='Directory for draw.jsonl and complete.jsonl')
+    parser.add_argument('--extra-draw', help='Additional text-to-drawing examples (JSONL)')
+    parser.add_argument('--extra-complete', help='Additional shape-completion examples (JSONL)')
+    parser.add_argument('--base-model', default='gpt-4o-mini-2024-07-18', help='Model to fine-tune')
+    parser.add_argument('--submit', action='store_true', help='Upload the files and start fine-tuning jobs')
+    args = parser.parse_args()
+
+    tasks = [
+        ("draw", training_examples(SYSTEM_PROMPT, DRAWING_FEWSHOTS) + read_extra(args.extra_draw),
+         "LLM_DRAWING_FINETUNED_MODEL"),
+        ("complete", training_examples(SHAPE_COMPLETION_SYSTEM, SHAPE_COMPLETION_FEWSHOTS) + read_extra(args.extra_complete),
+         "LLM_COMPLETION_FINETUNED_MODEL"),
+    ]
+
+    os.makedirs(args.out_dir, exist_ok=True)
+    for name, examples, env_var in tasks:
+        path = os.path.join(args.out_dir, f"{name}.jsonl")
+        write_jsonl(path, examples)
+        print(f"Wrote {len(examples)} examples to {path}")
+
+        if not args.submit:
+            continue
+        if len(examples) < MIN_EXAMPLES:
+            print(f"  Skipping {name}: fine-tuning needs at least {MIN_EXAMPLES} examples.")
+            continue
+        job_id = submit(path, args.base_model)
+        print(f"  Started fine-tuning job {job_id}; set {env_var} to the resulting model id.")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,54 @@
+# services/http_client.py
+
+"""
+Shared HTTP connection pool for upstream model APIs.
+
+Every OpenAI client in the backend is built on this one httpx.Client, so
+concurrent generations reuse warm keep-alive connections instead of paying a
+TCP + TLS handshake per call. HTTP/2 is enabled when the optional ``h2``
+package is installed, letting concurrent requests multiplex on one
+connection; otherwise the pool falls back to HTTP/1.1 keep-alive.
+"""
+
+import logging
+import threading
+
+import httpx
+
+from config import (
+    AI_REQUEST_TIMEOUT_SECS,
+    UPSTREAM_HTTP_CONNECT_TIMEOUT_SECS,
+    UPSTREAM_HTTP_MAX_CONNECTIONS,
+    UPSTREAM_HTTP_MAX_KEEPALIVE,
+)
+
+try:
+    import h2  # noqa: F401  (enables httpx's HTTP/2 support)
+    HTTP2_AVAILABLE = True
+except ImportError:
+    HTTP2_AVAILABLE = False
+
+logger = logging.getLogger(__name__)
+
+_http_client = None
+_http_client_lock = threading.Lock()
+
+
+def get_http_client() -> httpx.Client:
+    """Return the process-wide pooled httpx.Client, creating it on first use."""
+    global _http_client
+    if _http_client is None:
+        with _http_client_lock:
+            if _http_client is None:
+                _http_client = httpx.Client(
+                    http2=HTTP2_AVAILABLE,
+                    limits=httpx.Limits(
+                        max_keepalive_connections=UPSTREAM_HTTP_MAX_KEEPALIVE,
+                        max_connections=UPSTREAM_HTTP_MAX_CONNECTIONS,
+                    ),
+                    # Read timeout matches the route-level deadline: a long
+                    # non-streamed completion sends nothing until it is done.
+                    timeout=httpx.Timeout(AI_REQUEST_TIMEOUT_SECS, connect=UPSTREAM_HTTP_CONNECT_TIMEOUT_SECS),
+                )
+                logger.info("Upstream HTTP pool created (http2=%s)", HTTP2_AVAILABLE)
+    return _http_client
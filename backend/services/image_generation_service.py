@@ -1,61 +1,145 @@
 
+import base64
+import io
+import threading
+
 from config import OPENAI_API_KEY
+from services.http_client import get_http_client
+
+try:
+	from openai import OpenAI
+except ImportError:
+	OpenAI = None
+
+try:
+	from PIL import Image, ImageDraw, ImageFont
+except ImportError:
+	Image = ImageDraw = ImageFont = None
+
+_client = None
+_client_lock = threading.Lock()
+_font = None
+
+# Rendered placeholder PNGs keyed by (width, height); sizes come from the
+# request, so the cache is bounded.
+PLACEHOLDER_CACHE_MAX = 32
+_placeholder_cache = {}
+_placeholder_lock = threading.Lock()
+
+
+def _get_client():
+	"""Return the shared OpenAI client (built once), or None if OpenAI is not configured."""
+	global _client
+	if OpenAI is None or not OPENAI_API_KEY:
+		return None
+	if _client is None:
+		with _client_lock:
+			if _client is None:
+				_client = OpenAI(api_key=OPENAI_API_KEY, http_client=get_http_client())
+	return _client
+
+
+def _get_font():
+	global _font
+	if _font is None:
+		_font = ImageFont.load_default()
+	return _font
+
+
+PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+
+
+def _png_size(data: bytes):
+	"""(width, height) read from a PNG's IHDR header, or None if ``data`` is not a PNG."""
+	if len(data) < 24 or not data.startswith(PNG_SIGNATURE) or data[12:16] != b"IHDR":
+		return None
+	return int.from_bytes(data[16:20], "big"), int.from_bytes(data[20:24], "big")
+
+
+def _encode_png(img) -> bytes:
+	# compress_level=1: the PNG is transient and re-compressed by HTTP gzip anyway
+	with io.BytesIO() as buf:
+		img.save(buf, format="PNG", optimize=False, compress_level=1)
+		return buf.getvalue()
+
+
+def _response_b64(resp):
+	"""Extract the first image's base64 payload from an Images API response (SDK object or dict)."""
+	data = resp.get("data") if isinstance(resp, dict) else getattr(resp, "data", None)
+	if not data or not isinstance(data, list):
+		return None
+	item = data[0]
+	return item.get("b64_json") if isinstance(item, dict) else getattr(item, "b64_json", None)
 
 
 def text_to_image(prompt: str, width: int = 512, height: int = 512, style: str = "default"):
 	"""
-	Generate an image for the given prompt. Returns a PIL.Image object on success.
+	Generate an image for the given prompt. Returns an ``(image_bytes, mime_type)``
+	tuple, e.g. ``(b"\x89PNG...", "image/png")``.
 	This function attempts to use the OpenAI Images API if available; otherwise,
 	it falls back to generating a very small placeholder image so the endpoint
 	returns something useful for UI development.
+	PNG bytes from the API are passed through untouched; Pillow is only used
+	when the image has to be resized or converted.
 	"""
 	# Try OpenAI Images (if package available)
-	try:
-		from openai import OpenAI
-		from PIL import Image
-		import base64
-		import io
-
-		client = OpenAI(api_key=OPENAI_API_KEY)
-
-		# Attempt to use images.generate if available on the client
+	client = _get_client()
+	if client is not None:
 		try:
 			resp = client.images.generate(
 				model="gpt-image-1",
 				prompt=prompt,
 				size=f"{width}x{height}"
 			)
-			# The response may contain base64 data depending on the SDK version
-			b64 = None
-			if isinstance(resp, dict) and resp.get("data") and isinstance(resp["data"], list):
-				item = resp["data"][0]
-				if isinstance(item, dict) and item.get("b64_json"):
-					b64 = item.get("b64_json")
-			if b64:
-				img_bytes = base64.b64decode(b64)
-				return Image.open(io.BytesIO(img_bytes))
 		except Exception:
-			# Fall back to other approaches below
-			pass
+			# Network/API failure - fall back to the placeholder below
+			resp = None
 
-	except Exception:
-		# openai or PIL not available - fall through to placeholder
-		pass
+		b64 = _response_b64(resp) if resp is not None else None
+		if b64:
+			img_bytes = base64.b64decode(b64)
+			size = _png_size(img_bytes)
+			if size == (width, height) or (size and Image is None):
+				return img_bytes, "image/png"
+			if Image is not None:
+				img = Image.open(io.BytesIO(img_bytes))
+				if img.size != (width, height):
+					img = img.resize((width, height))
+				return _encode_png(img), "image/png"
 
 	# Placeholder fallback: create a simple blank image (Pillow may be missing)
+	if Image is None:
+		raise RuntimeError("No image generation backend available: Pillow is not installed")
+	return _placeholder_png(width, height), "image/png"
+
+
+def _placeholder_png(width: int, height: int) -> bytes:
+	"""PNG bytes of the placeholder image, rendered once per size."""
+	key = (width, height)
+	cached = _placeholder_cache.get(key)
+	if cached is not None:
+		return cached
+
+	img = Image.new("RGBA", (width, height), (255, 255, 255, 255))
+	draw = ImageDraw.Draw(img)
+	# Draw a small placeholder label in the center if fonts available
 	try:
-		from PIL import Image, ImageDraw, ImageFont
-		img = Image.new("RGBA", (width, height), (255, 255, 255, 255))
-		draw = ImageDraw.Draw(img)
-		# Draw a small placeholder label in the center if fonts available
+		f = _get_font()
+		text = "AI\nImage"
 		try:
-			f = ImageFont.load_default()
-			text = "AI\nImage"
+			left, top, right, bottom = draw.multiline_textbbox((0, 0), text, font=f)
+			w, h = right - left, bottom - top
+		except AttributeError:
+			# Pillow < 8 has no textbbox (and multiline_textsize is gone in >= 10)
 			w, h = draw.multiline_textsize(text, font=f)
-			draw.multiline_text(((width - w) / 2, (height - h) / 2), text, fill=(120, 120, 120), font=f, align="center")
-		except Exception:
-			pass
-		return img
-	except Exception as e:
-		raise RuntimeError("No image generation backend available: " + str(e))
+		draw.multiline_text(((width - w) / 2, (height - h) / 2), text, fill=(120, 120, 120), font=f, align="center")
+	except Exception:
+		pass
+	png = _encode_png(img)
 
+	with _placeholder_lock:
+		if len(_placeholder_cache) >= PLACEHOLDER_CACHE_MAX:
+			# Evict the oldest size (dicts keep insertion order)
+			_placeholder_cache.pop(next(iter(_placeholder_cache)))
+		_placeholder_cache[key] = png
+	return png
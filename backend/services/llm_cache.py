@@ -0,0 +1,454 @@
+"""
+LLM Response Cache
+
+The AI assistant routes forward every request to an upstream model, which is
+by far the slowest (seconds) and most expensive thing the backend does.
+Identical requests are common - the same canvas is often re-submitted while a
+user iterates on a prompt - so successful model responses are cached and
+replayed instead of calling the model again.
+
+Architecture:
+- Cache keys are a SHA-256 of the route name plus the canonical JSON payload
+- Canvas states are canonicalized first (see canonicalize_canvas) so that ids,
+  timestamps, object order and float noise do not defeat exact matching
+- Values are the JSON-encoded model response, stored with a TTL
+- Error payloads are never cached
+- Backend failures (e.g. Redis down) degrade to a cache miss
+
+TTLCache is a small in-process LRU used by llm_service to memoize raw model
+replies for identical message lists, so it works without Redis too.
+
+A second, optional tier (SemanticCache) catches paraphrased prompts
+("draw a red circle" vs "make a red circle") by comparing prompt embeddings.
+It needs numpy plus an embedding model and is skipped when either is missing.
+
+Concurrent identical requests that all miss the cache are coalesced by
+run_or_join: the first caller runs the model, the rest wait for its result.
+"""
+
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+from typing import Any, Callable, Dict, Optional
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+logger = logging.getLogger(__name__)
+
+CACHE_KEY_PREFIX = "rescanvas:llm_cache"
+DEFAULT_TTL_SECONDS = 3600
+
+
+def cache_key(route: str, payload: Any) -> str:
+    """
+    Build a deterministic cache key for a route and its request payload.
+
+    Args:
+        route: Logical route name (e.g. "drawing"), so identical payloads sent
+               to different routes never share an entry.
+        payload: JSON-serializable request payload.
+
+    Returns:
+        Hex SHA-256 digest of the canonical JSON encoding.
+    """
+    canonical = json.dumps([route, payload], sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+
+# Object fields the models never need: identity, ownership and client-side
+# render state. compact_canvas (services/llm_service.py) strips them from
+# prompts and canonicalize_canvas from cache keys, so a key covers exactly
+# the fields the model is shown (brushStyle, stampData, ...).
+CANVAS_DROP_FIELDS = frozenset({
+    "id", "drawingId", "timestamp", "ts", "user", "owner", "order", "roomId",
+    "isPending", "_renderCache", "_metadataCache",
+})
+
+
+def _normalize(value: Any) -> Any:
+    """Round floats to 2 decimals and drop None-valued keys, recursively."""
+    if isinstance(value, float):
+        value = round(value, 2)
+        return int(value) if value.is_integer() else value
+    if isinstance(value, dict):
+        return {k: _normalize(v) for k, v in value.items() if v is not None}
+    if isinstance(value, list):
+        return [_normalize(v) for v in value]
+    return value
+
+
+def canonicalize_canvas(state: Any) -> bytes:
+    """
+    Canonical byte encoding of a canvas state for cache keys.
+
+    Objects under "objects"/"drawings" lose CANVAS_DROP_FIELDS and are
+    sorted, so two canvases that render the same produce the same bytes.
+    """
+    if not isinstance(state, dict):
+        state = {}
+
+    canonical = {}
+    for key, value in state.items():
+        if key in ("objects", "drawings") and isinstance(value, list):
+            objects = [
+                _normalize({k: v for k, v in o.items() if k not in CANVAS_DROP_FIELDS})
+                for o in value if isinstance(o, dict)
+            ]
+            objects.sort(key=lambda o: json.dumps(o, sort_keys=True))
+            canonical[key] = objects
+        elif value is not None:
+            canonical[key] = _normalize(value)
+
+    return json.dumps(canonical, sort_keys=True, separators=(",", ":")).encode("utf-8")
+
+
+def canvas_digest(state: Any) -> str:
+    """SHA-256 hex digest of canonicalize_canvas(state)."""
+    return hashlib.sha256(canonicalize_canvas(state)).hexdigest()
+
+
+# In-flight upstream calls keyed by cache key (see run_or_join)
+_inflight: Dict[str, Future] = {}
+_inflight_lock = threading.Lock()
+
+
+def run_or_join(key: str, fn: Callable[..., Any], *args: Any) -> Any:
+    """
+    Run ``fn(*args)`` unless a call for the same key is already in flight, in
+    which case wait for that call and return its result instead.
+
+    The first caller for a key does the work on its own thread; later callers
+    block on its Future and receive the same result or exception. The entry
+    is removed as soon as the call finishes, so this only coalesces requests
+    that overlap in time - persistence is the cache's job.
+    """
+    with _inflight_lock:
+        future = _inflight.get(key)
+        leader = future is None
+        if leader:
+            future = Future()
+            _inflight[key] = future
+
+    if not leader:
+        return future.result()
+
+    try:
+        result = fn(*args)
+    except BaseException as e:
+        future.set_exception(e)
+        raise
+    else:
+        future.set_result(result)
+        return result
+    finally:
+        with _inflight_lock:
+            _inflight.pop(key, None)
+
+
+class TTLCache:
+    """Thread-safe in-process LRU whose entries also expire after ``ttl`` seconds."""
+
+    def __init__(self, maxsize: int = 1024, ttl: float = DEFAULT_TTL_SECONDS):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()  # key -> (expires_at, value)
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[Any]:
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return None
+            expires_at, value = entry
+            if expires_at <= time.monotonic():
+                del self._data[key]
+                return None
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key: str, value: Any) -> None:
+        with self._lock:
+            self._data[key] = (time.monotonic() + self.ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+
+class LLMCache:
+    """Exact-match response cache backed by a Redis-compatible client."""
+
+    def __init__(self, backend, ttl: int = DEFAULT_TTL_SECONDS):
+        self.backend = backend
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._stats = {"hits": 0, "misses": 0, "stores": 0, "errors": 0}
+
+    def _record(self, name: str) -> None:
+        with self._lock:
+            self._stats[name] += 1
+
+    def get(self, key: str) -> Optional[Any]:
+        """Return the cached response for ``key`` or None on a miss."""
+        try:
+            raw = self.backend.get(f"{CACHE_KEY_PREFIX}:{key}")
+        except Exception as e:
+            logger.warning(f"LLM cache lookup failed: {e}")
+            self._record("errors")
+            raw = None
+
+        if raw is None:
+            self._record("misses")
+            return None
+
+        try:
+            value = json.loads(raw)
+        except (TypeError, ValueError):
+            self._record("errors")
+            self._record("misses")
+            return None
+
+        self._record("hits")
+        return value
+
+    def set(self, key: str, value: Any) -> bool:
+        """
+        Store a successful model response.
+
+        Error payloads ({"error": ...}) are skipped so a transient upstream
+        failure is never replayed to later callers.
+        """
+        if isinstance(value, dict) and "error" in value:
+            return False
+        try:
+            self.backend.setex(f"{CACHE_KEY_PREFIX}:{key}", self.ttl, json.dumps(value))
+        except Exception as e:
+            logger.warning(f"LLM cache store failed: {e}")
+            self._record("errors")
+            return False
+        self._record("stores")
+        return True
+
+    def stats(self) -> Dict[str, Any]:
+        """Return a snapshot of hit/miss counters."""
+        with self._lock:
+            snapshot = dict(self._stats)
+        lookups = snapshot["hits"] + snapshot["misses"]
+        snapshot["hit_rate"] = (snapshot["hits"] / lookups) if lookups else 0.0
+        snapshot["ttl"] = self.ttl
+        return snapshot
+
+
+def _sentence_transformer_embedder(model_name: str) -> Optional[Callable[[str], Any]]:
+    """Return an embed(text) function backed by sentence-transformers, or None if unavailable."""
+    try:
+        from sentence_transformers import SentenceTransformer
+    except ImportError:
+        logger.info("sentence-transformers not installed - semantic LLM cache disabled")
+        return None
+
+    model = SentenceTransformer(model_name)
+    return lambda text: model.encode(text, normalize_embeddings=True)
+
+
+class SemanticCache:
+    """
+    Embedding-similarity cache for prompt-driven routes.
+
+    Entries are (embedding, canvas_hash, response). A lookup returns the
+    response of the most similar prompt whose canvas hash matches exactly, so
+    a paraphrased prompt can reuse a result but never across canvases.
+    Embeddings are L2-normalized, so the inner product is cosine similarity;
+    the search is an exhaustive matmul over a preallocated ring buffer.
+    With ``ttl`` set, entries older than ``ttl`` seconds are never returned.
+    """
+
+    def __init__(
+        self,
+        embed: Optional[Callable[[str], Any]] = None,
+        threshold: float = 0.92,
+        max_entries: int = 2048,
+        index_path: Optional[str] = None,
+        model_name: str = "all-MiniLM-L6-v2",
+        ttl: Optional[float] = None,
+    ):
+        self.threshold = threshold
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.index_path = index_path
+        self.model_name = model_name
+        self._embed = embed
+        self._embed_loaded = embed is not None
+        self._lock = threading.Lock()
+        self._vectors = None
+        self._canvas_hashes = []
+        self._responses = []
+        self._added_at = []
+        self._next = 0
+        self._stats = {"hits": 0, "misses": 0, "stores": 0}
+
+        if index_path:
+            self.load()
+
+    @property
+    def available(self) -> bool:
+        return np is not None and self._get_embedder() is not None
+
+    def _get_embedder(self):
+        if not self._embed_loaded:
+            # Concurrent first requests wait for the one load instead of
+            # seeing the cache as unavailable while it runs
+            with self._lock:
+                if not self._embed_loaded:
+                    try:
+                        embed = _sentence_transformer_embedder(self.model_name)
+                    except Exception as e:
+                        logger.warning(f"Could not load embedding model {self.model_name}: {e}")
+                        embed = None
+                    self._embed = embed
+                    self._embed_loaded = True
+        return self._embed
+
+    def warm_up(self) -> bool:
+        """Load the embedding model now (at startup) rather than on the first request; returns ``available``."""
+        return self.available
+
+    def _encode(self, text: str):
+        vec = np.asarray(self._get_embedder()(text), dtype=np.float32).reshape(-1)
+        norm = float(np.linalg.norm(vec))
+        return vec / norm if norm else vec
+
+    def encode(self, text: str):
+        """
+        Normalized embedding of ``text`` for get_vector/add_vector, or None
+        when the cache is unavailable or embedding fails. Lets a caller that
+        looks up and then stores the same text embed it only once.
+        """
+        if not self.available:
+            return None
+        try:
+            return self._encode(text)
+        except Exception as e:
+            logger.warning(f"Semantic cache embedding failed: {e}")
+            return None
+
+    def get(self, prompt: str, canvas_hash: str) -> Optional[Any]:
+        """Return the cached response for a semantically equivalent prompt on the same canvas."""
+        query = self.encode(prompt)
+        return None if query is None else self.get_vector(query, canvas_hash)
+
+    def get_vector(self, query: Any, canvas_hash: str) -> Optional[Any]:
+        """get() for a vector from encode()."""
+        with self._lock:
+            count = len(self._responses)
+            if count == 0 or self._vectors.shape[1] != query.shape[0]:
+                self._stats["misses"] += 1
+                return None
+
+            scores = self._vectors[:count] @ query
+            same_canvas = np.fromiter((h == canvas_hash for h in self._canvas_hashes), dtype=bool, count=count)
+            scores[~same_canvas] = -1.0
+            if self.ttl is not None:
+                fresh = np.asarray(self._added_at, dtype=np.float64) > time.time() - self.ttl
+                scores[~fresh] = -1.0
+            best = int(np.argmax(scores))
+            if scores[best] <= self.threshold:
+                self._stats["misses"] += 1
+                return None
+
+            self._stats["hits"] += 1
+            return self._responses[best]
+
+    def add(self, prompt: str, canvas_hash: str, response: Any) -> bool:
+        """Index a successful response; the oldest entry is overwritten once full."""
+        if isinstance(response, dict) and "error" in response:
+            return False
+        vec = self.encode(prompt)
+        return vec is not None and self.add_vector(vec, canvas_hash, response)
+
+    def add_vector(self, vec: Any, canvas_hash: str, response: Any) -> bool:
+        """add() for a vector from encode()."""
+        if isinstance(response, dict) and "error" in response:
+            return False
+
+        with self._lock:
+            if self._vectors is None or self._vectors.shape[1] != vec.shape[0]:
+                self._vectors = np.zeros((self.max_entries, vec.shape[0]), dtype=np.float32)
+                self._canvas_hashes, self._responses, self._added_at, self._next = [], [], [], 0
+
+            slot = self._next
+            now = time.time()
+            self._vectors[slot] = vec
+            if slot < len(self._responses):
+                self._canvas_hashes[slot] = canvas_hash
+                self._responses[slot] = response
+                self._added_at[slot] = now
+            else:
+                self._canvas_hashes.append(canvas_hash)
+                self._responses.append(response)
+                self._added_at.append(now)
+            self._next = (slot + 1) % self.max_entries
+            self._stats["stores"] += 1
+        return True
+
+    def save(self) -> None:
+        """Persist the index to ``index_path`` (called on shutdown)."""
+        if not self.index_path or np is None:
+            return
+        with self._lock:
+            count = len(self._responses)
+            if count == 0:
+                return
+            try:
+                np.save(f"{self.index_path}.npy", self._vectors[:count])
+                with open(f"{self.index_path}.json", "w") as f:
+                    json.dump({
+                        "canvas_hashes": self._canvas_hashes,
+                        "responses": self._responses,
+                        "added_at": self._added_at,
+                        "next": self._next,
+                    }, f)
+            except Exception as e:
+                logger.warning(f"Could not persist semantic cache: {e}")
+
+    def load(self) -> None:
+        """Restore a previously saved index, if one exists."""
+        if np is None or not os.path.exists(f"{self.index_path}.npy"):
+            return
+        try:
+            vectors = np.load(f"{self.index_path}.npy")
+            with open(f"{self.index_path}.json") as f:
+                meta = json.load(f)
+        except Exception as e:
+            logger.warning(f"Could not load semantic cache: {e}")
+            return
+
+        count = min(len(meta["responses"]), self.max_entries)
+        with self._lock:
+            self._vectors = np.zeros((self.max_entries, vectors.shape[1]), dtype=np.float32)
+            self._vectors[:count] = vectors[:count]
+            self._canvas_hashes = meta["canvas_hashes"][:count]
+            self._responses = meta["responses"][:count]
+            self._added_at = meta.get("added_at", [time.time()] * count)[:count]
+            self._next = meta.get("next", count) % self.max_entries
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            snapshot = dict(self._stats)
+            snapshot["entries"] = len(self._responses)
+        snapshot["threshold"] = self.threshold
+        return snapshot
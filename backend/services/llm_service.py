@@ -1,6 +1,427 @@
 # pip install openai ollama
+import functools
+import hashlib
+import itertools
 import json
+import logging
+import math
+import re
+import threading
+import time
 import typing
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from concurrent.futures import TimeoutError as FutureTimeoutError
+
+from config import (
+    AI_MAX_INFLIGHT,
+    LLM_CACHE_ENABLED,
+    LLM_CACHE_TTL_SECS,
+    LLM_COMPLETION_CACHE_ENABLED,
+    LLM_COMPLETION_CACHE_SIZE,
+    LLM_COMPLETION_CACHE_THRESHOLD,
+    LLM_COMPLETION_CACHE_TTL_SECS,
+    LLM_COMPLETION_EMBEDDING_MODEL,
+    LLM_COMPLETION_FINETUNED_MODEL,
+    LLM_DISK_CACHE_PATH,
+    LLM_DISK_CACHE_SIZE_LIMIT,
+    LLM_DISK_CACHE_TTL_SECS,
+    LLM_DRAWING_FINETUNED_MODEL,
+    LLM_HEDGE_DELAY_SECS,
+    LLM_MESSAGE_FORMAT,
+    LLM_RESPONSE_CACHE_SIZE,
+    OLLAMA_KEEP_ALIVE,
+    OPENAI_API_KEY,
+    OPENAI_CONCURRENCY,
+    OPENAI_MAX_RETRIES,
+)
+from services.http_client import get_http_client
+from services.llm_cache import CANVAS_DROP_FIELDS, SemanticCache, TTLCache, cache_key, canvas_digest
+from utils import fast_json
+
+try:
+    from openai import OpenAI
+except ImportError:
+    OpenAI = None
+
+try:
+    import ollama
+except ImportError:
+    ollama = None
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+try:
+    import diskcache
+except ImportError:
+    diskcache = None
+
+logger = logging.getLogger(__name__)
+
+_openai_client = None
+_openai_client_lock = threading.Lock()
+# Caps concurrent chat calls so a burst queues here instead of turning into a
+# storm of 429s; the SDK retries the ones that still get rate limited.
+_openai_slots = threading.BoundedSemaphore(OPENAI_CONCURRENCY)
+
+
+def _get_openai_client():
+    """
+    Return the shared OpenAI client, built on first use. Reusing one client
+    keeps its pooled HTTP connections warm across requests. 408/409/429/5xx
+    and connection errors are retried up to OPENAI_MAX_RETRIES times.
+    Raises RuntimeError if the openai package or OPENAI_API_KEY is missing.
+    """
+    global _openai_client
+    if _openai_client is None:
+        if OpenAI is None or not OPENAI_API_KEY:
+            raise RuntimeError("OPENAI_API_KEY is not set in environment")
+        with _openai_client_lock:
+            if _openai_client is None:
+                _openai_client = OpenAI(
+                    api_key=OPENAI_API_KEY, http_client=get_http_client(), max_retries=OPENAI_MAX_RETRIES
+                )
+    return _openai_client
+
+
+# === Response memo ============================================================
+# Raw reply text per identical chat request. Only near-deterministic requests
+# (temperature <= 0.1) are memoized, so a replay matches what the model
+# would most likely have said anyway.
+_response_cache = TTLCache(maxsize=LLM_RESPONSE_CACHE_SIZE, ttl=LLM_CACHE_TTL_SECS)
+
+# Optional second tier on disk (LLM_DISK_CACHE_PATH), consulted when the
+# in-process memo misses. It outlives restarts, so the first requests after a
+# deploy are still answered from cache. Disk errors degrade to a miss.
+_disk_cache = None
+_disk_cache_failed = False
+_disk_cache_lock = threading.Lock()
+
+
+def _get_disk_cache():
+    """The shared diskcache.Cache, or None when unconfigured or unavailable."""
+    global _disk_cache, _disk_cache_failed
+    if diskcache is None or not LLM_DISK_CACHE_PATH or _disk_cache_failed:
+        return None
+    if _disk_cache is None:
+        with _disk_cache_lock:
+            if _disk_cache is None and not _disk_cache_failed:
+                try:
+                    _disk_cache = diskcache.Cache(LLM_DISK_CACHE_PATH, size_limit=LLM_DISK_CACHE_SIZE_LIMIT)
+                except Exception as e:
+                    logger.warning(f"LLM disk cache unavailable at {LLM_DISK_CACHE_PATH}: {e}")
+                    _disk_cache_failed = True
+    return _disk_cache
+
+
+def _disk_cache_get(key: str) -> typing.Optional[str]:
+    disk = _get_disk_cache()
+    if disk is None:
+        return None
+    try:
+        return disk.get(key)
+    except Exception as e:
+        logger.warning(f"LLM disk cache lookup failed: {e}")
+        return None
+
+
+def _disk_cache_set(key: str, content: str) -> None:
+    disk = _get_disk_cache()
+    if disk is None:
+        return
+    try:
+        disk.set(key, content, expire=LLM_DISK_CACHE_TTL_SECS)
+    except Exception as e:
+        logger.warning(f"LLM disk cache store failed: {e}")
+
+
+def clear_cache() -> None:
+    """Drop all memoized model replies (used by tests)."""
+    _response_cache.clear()
+    _recognition_cache.clear()
+    disk = _get_disk_cache()
+    if disk is not None:
+        disk.clear()
+
+
+def _prompt_cache_key(feature: str, system_prompt: str) -> str:
+    """
+    Stable OpenAI ``prompt_cache_key`` for a feature. Requests sharing it are
+    routed to the same cache shard, so the static system prompt + few-shot
+    prefix is reused; it changes whenever the system prompt does.
+    """
+    return f"{feature}-{hashlib.md5(system_prompt.encode('utf-8')).hexdigest()[:12]}"
+
+
+def _build_messages(
+    system_prompt: str,
+    fewshots: typing.Sequence[typing.Tuple[str, str]],
+    user_content: str,
+    provider: str = "openai",
+) -> list[dict]:
+    """
+    Assemble [system, (user, assistant)*, user] chat messages.
+
+    "openai" (also used for Ollama) sends plain string contents; OpenAI caches
+    the byte-identical prefix automatically. "anthropic" wraps the system
+    prompt and the last few-shot reply in text blocks marked with
+    cache_control, making the system prompt and the whole few-shot span two
+    explicit cache breakpoints.
+    """
+    def block(text: str) -> typing.Any:
+        if provider != "anthropic":
+            return text
+        return [{"type": "text", "text": text, "cache_control": {"type": "ephemeral"}}]
+
+    messages = [{"role": "system", "content": block(system_prompt)}]
+    for i, (user, assistant) in enumerate(fewshots):
+        last = i == len(fewshots) - 1
+        messages.append({"role": "user", "content": user})
+        messages.append({"role": "assistant", "content": block(assistant) if last else assistant})
+    messages.append({"role": "user", "content": user_content})
+    return messages
+
+
+def _prompt_cache_extra(key: str, provider: str) -> dict:
+    """extra_body carrying OpenAI's prompt_cache_key; other providers mark breakpoints in the messages."""
+    return {"prompt_cache_key": key} if provider == "openai" else {}
+
+
+def _create_json_completion(client, **request: typing.Any) -> dict:
+    """
+    client.chat.completions.create(**request) followed by json.loads, memoized
+    on the model name plus a SHA-256 of the full request (model, messages,
+    sampling params). The in-process memo is checked first, then the disk tier;
+    a disk hit is promoted into the memo.
+    """
+    cacheable = LLM_CACHE_ENABLED and request.get("temperature", 1.0) <= 0.1
+    if cacheable:
+        digest = hashlib.sha256(json.dumps(request, sort_keys=True).encode("utf-8")).hexdigest()
+        key = f"{request.get('model')}:{digest}"
+        content = _response_cache.get(key)
+        if content is None:
+            content = _disk_cache_get(key)
+            if content is not None:
+                _response_cache.set(key, content)
+        if content is not None:
+            return fast_json.loads(content)
+
+    with _openai_slots:
+        resp = client.chat.completions.create(**request)
+    content = resp.choices[0].message.content
+    parsed = fast_json.loads(content)
+    if cacheable:
+        _response_cache.set(key, content)
+        _disk_cache_set(key, content)
+    return parsed
+
+
+def _ollama_chat(messages: list[dict], num_predict: int = 1024, stream: bool = False) -> typing.Any:
+    """
+    ollama.chat for the local fallback model. format="json" constrains
+    decoding to valid JSON, and keep_alive keeps the weights loaded so a
+    fallback does not pay a cold model load. num_predict=-1 means no cap.
+    """
+    if ollama is None:
+        raise RuntimeError("ollama package is not installed")
+    return ollama.chat(
+        model="llama3:8b",
+        messages=messages,
+        format="json",
+        options={"temperature": 0.1, "num_predict": num_predict},
+        keep_alive=OLLAMA_KEEP_ALIVE,
+        stream=stream,
+    )
+
+
+# === Provider hedging =========================================================
+# OpenAI is preferred, but waiting for it to fail before starting Ollama puts
+# both latencies end to end. A primary call still pending after
+# LLM_HEDGE_DELAY_SECS gets a speculative fallback call next to it, and the
+# first successful answer is returned. Threads cannot be cancelled; the loser
+# finishes in the background and its result is dropped.
+_hedge_pool = ThreadPoolExecutor(max_workers=2 * AI_MAX_INFLIGHT, thread_name_prefix="llm-hedge")
+
+
+def _failed(result: typing.Any, valid: typing.Optional[typing.Callable[[typing.Any], bool]] = None) -> bool:
+    if isinstance(result, dict) and "error" in result:
+        return True
+    return valid is not None and not valid(result)
+
+
+def _is_drawing_reply(result: typing.Any) -> bool:
+    """{"objects": [...]} where every object is a dict with a pathData dict."""
+    objects = result.get("objects") if isinstance(result, dict) else None
+    return isinstance(objects, list) and all(
+        isinstance(o, dict) and isinstance(o.get("pathData"), dict) for o in objects
+    )
+
+
+def _is_completion_reply(result: typing.Any) -> bool:
+    """A completion suggesting an "object" with a pathData dict, or explicitly declining ("complete": false)."""
+    if not isinstance(result, dict):
+        return False
+    obj = result.get("object")
+    return (isinstance(obj, dict) and isinstance(obj.get("pathData"), dict)) or result.get("complete") is False
+
+
+def _hedged(primary: typing.Callable[..., typing.Any], fallback: typing.Callable[..., typing.Any], *args: typing.Any,
+            valid: typing.Optional[typing.Callable[[typing.Any], bool]] = None) -> typing.Any:
+    """
+    Return primary(*args) unless it fails, racing fallback(*args) once the
+    primary is slow. Both callables return their result, or a dict with
+    "error" on failure; a result ``valid`` rejects (e.g. a malformed local
+    reply) counts as failed too, so the race keeps waiting for the other
+    call. If both fail the fallback's result is returned.
+    """
+    if LLM_HEDGE_DELAY_SECS < 0:
+        result = primary(*args)
+        return result if not _failed(result, valid) else fallback(*args)
+
+    first = _hedge_pool.submit(primary, *args)
+    try:
+        result = first.result(timeout=LLM_HEDGE_DELAY_SECS)
+    except FutureTimeoutError:
+        pass
+    else:
+        return result if not _failed(result, valid) else fallback(*args)
+
+    second = _hedge_pool.submit(fallback, *args)
+    pending = {first, second}
+    errors = {}
+    while pending:
+        done, pending = wait(pending, return_when=FIRST_COMPLETED)
+        for future in sorted(done, key=lambda f: f is not first):
+            result = future.result()
+            if not _failed(result, valid):
+                return result
+            errors[future] = result
+    return errors[second]
+
+
+# === Canvas compaction ========================================================
+# Objects lose CANVAS_DROP_FIELDS (services/llm_cache.py, shared with the cache
+# keys); "id" is kept when the model must echo it back (beautify/style).
+
+
+# Stroke simplification (compact_canvas(simplify=True)): point lists longer
+# than SIMPLIFY_MIN_POINTS are reduced with Ramer-Douglas-Peucker at
+# SIMPLIFY_EPSILON pixels, then evenly subsampled to at most
+# SIMPLIFY_MAX_POINTS. Only for prompts that read the canvas, never for
+# routes that echo objects back.
+SIMPLIFY_EPSILON = 1.5
+SIMPLIFY_MIN_POINTS = 32
+SIMPLIFY_MAX_POINTS = 64
+
+
+def _segment_distances(xs: typing.Any, ys: typing.Any, a: int, b: int) -> typing.List[float]:
+    """Distances of points a+1..b-1 from the line through points a and b."""
+    dx, dy = xs[b] - xs[a], ys[b] - ys[a]
+    norm = (dx * dx + dy * dy) ** 0.5
+    if np is not None:
+        px, py = xs[a + 1:b] - xs[a], ys[a + 1:b] - ys[a]
+        if norm == 0:
+            return np.hypot(px, py)
+        return np.abs(dx * py - dy * px) / norm
+    dists = []
+    for i in range(a + 1, b):
+        px, py = xs[i] - xs[a], ys[i] - ys[a]
+        dists.append((px * px + py * py) ** 0.5 if norm == 0 else abs(dx * py - dy * px) / norm)
+    return dists
+
+
+def _simplify_points(points: list) -> list:
+    """Ramer-Douglas-Peucker plus an even-stride cap; endpoints are always kept."""
+    n = len(points)
+    if n <= SIMPLIFY_MIN_POINTS:
+        return points
+
+    xs = [p["x"] for p in points]
+    ys = [p["y"] for p in points]
+    if np is not None:
+        xs, ys = np.asarray(xs, dtype=np.float64), np.asarray(ys, dtype=np.float64)
+
+    keep = [False] * n
+    keep[0] = keep[-1] = True
+    stack = [(0, n - 1)]
+    while stack:
+        a, b = stack.pop()
+        if b - a < 2:
+            continue
+        dists = _segment_distances(xs, ys, a, b)
+        i = int(np.argmax(dists)) if np is not None else max(range(len(dists)), key=dists.__getitem__)
+        if dists[i] > SIMPLIFY_EPSILON:
+            keep[a + 1 + i] = True
+            stack.append((a, a + 1 + i))
+            stack.append((a + 1 + i, b))
+
+    kept = [p for p, k in zip(points, keep) if k]
+    if len(kept) > SIMPLIFY_MAX_POINTS:
+        step = (len(kept) - 1) / (SIMPLIFY_MAX_POINTS - 1)
+        kept = [kept[round(i * step)] for i in range(SIMPLIFY_MAX_POINTS)]
+    return kept
+
+
+def _is_point(value: typing.Any) -> bool:
+    return isinstance(value, dict) and isinstance(value.get("x"), (int, float)) and isinstance(value.get("y"), (int, float))
+
+
+def _compact_path(value: typing.Any, simplify: bool = False) -> typing.Any:
+    """Round coordinates to whole pixels and collapse consecutive duplicate points, recursively."""
+    if isinstance(value, float):
+        return int(round(value))
+    if isinstance(value, dict):
+        return {k: _compact_path(v, simplify) for k, v in value.items() if v is not None}
+    if isinstance(value, list):
+        items = [_compact_path(v, simplify) for v in value]
+        if items and all(_is_point(v) for v in items):
+            # Rounding often turns sub-pixel jitter into repeated points
+            items = [k for k, _ in itertools.groupby(items)]
+            if simplify:
+                items = _simplify_points(items)
+        return items
+    return value
+
+
+def _compact_object(obj: dict, drop: frozenset, simplify: bool = False) -> dict:
+    return {
+        k: _compact_path(v, simplify) if k == "pathData" else v
+        for k, v in obj.items()
+        if k not in drop and v is not None
+    }
+
+
+def compact_canvas(state: typing.Any, keep_ids: bool = False, simplify: bool = False) -> typing.Any:
+    """
+    Minimal copy of a canvas state for prompting a model.
+
+    Objects under "drawings"/"objects" lose CANVAS_DROP_FIELDS (except "id"
+    when ``keep_ids``) and None values; pathData coordinates are rounded to
+    whole pixels and consecutive duplicate points are dropped. With
+    ``simplify`` long strokes are also thinned (see _simplify_points). The
+    input is not modified. Fewer input tokens means lower cost and faster
+    first token.
+    """
+    if not isinstance(state, dict):
+        return state
+
+    drop = CANVAS_DROP_FIELDS - {"id"} if keep_ids else CANVAS_DROP_FIELDS
+    compact = dict(state)
+    for key in ("drawings", "objects"):
+        if isinstance(state.get(key), list):
+            compact[key] = [
+                _compact_object(obj, drop, simplify) if isinstance(obj, dict) else obj
+                for obj in state[key]
+            ]
+
+    if logger.isEnabledFor(logging.DEBUG):
+        before = len(json.dumps(state, separators=(",", ":"), default=str))
+        after = len(json.dumps(compact, separators=(",", ":"), default=str))
+        logger.debug("compact_canvas: %d -> %d chars", before, after)
+    return compact
+
 
 # === text to drawings =========================================================
 # System prompt
@@ -278,8 +699,80 @@ FEWSHOT_ASSISTANT_JSON_3 = {
 }
 
 
+# Few-shot replies serialized once; they are constant and part of the cached prompt prefix
+_FEWSHOT_ASSISTANT_STR_1 = fast_json.dumps(FEWSHOT_ASSISTANT_JSON_1)
+_FEWSHOT_ASSISTANT_STR_2 = fast_json.dumps(FEWSHOT_ASSISTANT_JSON_2)
+_FEWSHOT_ASSISTANT_STR_3 = fast_json.dumps(FEWSHOT_ASSISTANT_JSON_3)
+
+
+# Structured-output schemas (strict mode): the sampler can only produce
+# replies of this shape, so a missing or misspelled key cannot reach the
+# renderer. Strict mode needs every property listed in "required", so each
+# pathData encoding is its own anyOf branch instead of optional fields.
+_POINT_SCHEMA = {
+    "type": "object",
+    "properties": {"x": {"type": "number"}, "y": {"type": "number"}},
+    "required": ["x", "y"],
+    "additionalProperties": False,
+}
+
+
+def _path_variant(tool: str, types: typing.List[str], **geometry: dict) -> dict:
+    return {
+        "type": "object",
+        "properties": {
+            "tool": {"type": "string", "enum": [tool]},
+            "type": {"type": "string", "enum": types},
+            **geometry,
+        },
+        "required": ["tool", "type", *geometry],
+        "additionalProperties": False,
+    }
+
+
+_POINTS_SCHEMA = {"type": "array", "items": _POINT_SCHEMA}
+
+DRAWING_OBJECT_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "color": {"type": "string", "pattern": "^#[0-9A-Fa-f]{6}$"},
+        "lineWidth": {"type": "number"},
+        "pathData": {"anyOf": [
+            _path_variant("freehand", ["stroke"], points=_POINTS_SCHEMA),
+            _path_variant("shape", ["line", "rectangle", "circle"], start=_POINT_SCHEMA, end=_POINT_SCHEMA),
+            _path_variant("shape", ["polygon"], points=_POINTS_SCHEMA),
+            _path_variant("shape", ["text"], start=_POINT_SCHEMA, text={"type": "string"}),
+        ]},
+    },
+    "required": ["color", "lineWidth", "pathData"],
+    "additionalProperties": False,
+}
+
+DRAW_SCHEMA = {
+    "type": "object",
+    "properties": {"objects": {"type": "array", "items": DRAWING_OBJECT_SCHEMA}},
+    "required": ["objects"],
+    "additionalProperties": False,
+}
+
+DRAW_RESPONSE_FORMAT = {
+    "type": "json_schema",
+    "json_schema": {"name": "draw", "schema": DRAW_SCHEMA, "strict": True},
+}
+
+DRAWING_FEWSHOTS = (
+    (FEWSHOT_USER_1, _FEWSHOT_ASSISTANT_STR_1),
+    (FEWSHOT_USER_2, _FEWSHOT_ASSISTANT_STR_2),
+    (FEWSHOT_USER_3, _FEWSHOT_ASSISTANT_STR_3),
+)
+
+# The message prefix (system prompt + few-shots) must stay byte-identical
+# across calls for OpenAI prompt caching; only the final user turn varies.
+DRAWING_PROMPT_CACHE_KEY = _prompt_cache_key("draw", SYSTEM_PROMPT)
+
+
 def _get_text_to_drawings_initial_message(
-    prompt: str, canvasState: dict[str, typing.Any]
+    prompt: str, canvasState: dict[str, typing.Any], provider: str = "openai", fewshot: bool = True
 ) -> list[dict]:
     """
     Build the minimal, few-shot seeded chat message list for the
@@ -290,12 +783,14 @@ def _get_text_to_drawings_initial_message(
                 blue circle").
         canvasState (dict[str, Any]):
             A Python dictionary representing the current state of the canvas.
+        provider: Message shape, see _build_messages.
+        fewshot: False for a fine-tuned model that already learned the examples.
 
     Returns:
         A list of role/content dicts suitable for OpenAI/Ollama chat APIs:
         [system, user(few-shot), assistant(few-shot), user(actual prompt)].
     """
-    canvas_json = json.dumps(canvasState, separators=(",", ":"))
+    canvas_json = fast_json.dumps(canvasState)
 
     # Combine into a single message for the model
     user_prompt = (
@@ -304,16 +799,19 @@ def _get_text_to_drawings_initial_message(
         f"needed to draw this scene: {prompt}"
     )
 
-    return [
-        {"role": "system", "content": SYSTEM_PROMPT},
-        {"role": "user", "content": FEWSHOT_USER_1},
-        {"role": "assistant", "content": json.dumps(FEWSHOT_ASSISTANT_JSON_1)},
-        {"role": "user", "content": FEWSHOT_USER_2},
-        {"role": "assistant", "content": json.dumps(FEWSHOT_ASSISTANT_JSON_2)},
-        {"role": "user", "content": FEWSHOT_USER_3},
-        {"role": "assistant", "content": json.dumps(FEWSHOT_ASSISTANT_JSON_3)},
-        {"role": "user", "content": user_prompt},
-    ]
+    return _build_messages(SYSTEM_PROMPT, DRAWING_FEWSHOTS if fewshot else (), user_prompt, provider)
+
+
+# Output budget for drawing generation. OpenAI reserves max_tokens against the
+# tokens-per-minute quota up front, so short prompts ask for much less than the cap.
+DRAWING_MAX_TOKENS = 5000
+
+
+def _estimate_output_tokens(prompt: str, canvasState: dict[str, typing.Any]) -> int:
+    """Rough max_tokens for a drawing reply: grows with prompt length and canvas size."""
+    drawings = canvasState.get("drawings") if isinstance(canvasState, dict) else None
+    estimate = 800 + 60 * len(prompt.split()) + 10 * len(drawings or [])
+    return min(DRAWING_MAX_TOKENS, estimate)
 
 
 def openai_prompt_to_json(prompt: str, canvasState: dict[str, typing.Any]) -> dict:
@@ -327,24 +825,28 @@ def openai_prompt_to_json(prompt: str, canvasState: dict[str, typing.Any]) -> di
     Returns:
         Dict containing parsed drawing attributes or an error payload.
     """
+    if OpenAI is None or not OPENAI_API_KEY:
+        return {"error": "openai_not_configured", "detail": "OPENAI_API_KEY is not set in environment"}
     try:
-        from config import OPENAI_API_KEY
-        from openai import OpenAI
-
-        if not OPENAI_API_KEY:
-            return {"error": "openai_not_configured", "detail": "OPENAI_API_KEY is not set in environment"}
-
-        client = OpenAI(api_key=OPENAI_API_KEY)
-
-        resp = client.chat.completions.create(
-            model="gpt-4o-mini",
-            response_format={"type": "json_object"},  # forces valid JSON
+        client = _get_openai_client()
+        request = dict(
+            model=LLM_DRAWING_FINETUNED_MODEL or "gpt-4o-mini",
+            response_format=DRAW_RESPONSE_FORMAT,
             temperature=0.1,
-            messages=_get_text_to_drawings_initial_message(prompt, canvasState),
-            max_tokens=5000,
+            messages=_get_text_to_drawings_initial_message(
+                prompt, canvasState, LLM_MESSAGE_FORMAT, fewshot=not LLM_DRAWING_FINETUNED_MODEL
+            ),
+            extra_body=_prompt_cache_extra(DRAWING_PROMPT_CACHE_KEY, LLM_MESSAGE_FORMAT),
         )
-        content = resp.choices[0].message.content
-        return json.loads(content)
+        max_tokens = _estimate_output_tokens(prompt, canvasState)
+
+        try:
+            return _create_json_completion(client, max_tokens=max_tokens, **request)
+        except ValueError:
+            # Reply was cut off by the budget (truncated JSON); retry with the full cap
+            if max_tokens >= DRAWING_MAX_TOKENS:
+                raise
+            return _create_json_completion(client, max_tokens=DRAWING_MAX_TOKENS, **request)
     except Exception as e:
         return {"error": "openai_failed", "detail": str(e)}
 
@@ -361,22 +863,147 @@ def ollama_prompt_to_json(prompt: str, canvasState: dict[str, typing.Any]) -> di
         Dict containing parsed drawing attributes or an error payload.
     """
     try:
-        import ollama
-
-        response = ollama.chat(
-            model="llama3:8b",
-            messages=_get_text_to_drawings_initial_message(prompt, canvasState),
+        response = _ollama_chat(
+            _get_text_to_drawings_initial_message(prompt, canvasState),
+            num_predict=DRAWING_MAX_TOKENS,
         )
 
-        return json.loads(response["message"]["content"])
+        return fast_json.loads(response["message"]["content"])
     except Exception as e:
         return {"error": "ollama_failed", "detail": str(e)}
 
 
+# === Local fast path ==========================================================
+# "draw a small blue circle at the top-right" needs no model: a prompt that is
+# exactly one colored primitive with optional size and position is answered
+# from a template. Anything else (or no canvas bounds) goes to the model.
+LOCAL_DRAW_COLORS = {
+    "red": "#FF0000", "blue": "#0000FF", "green": "#008000", "yellow": "#FFFF00",
+    "orange": "#FFA500", "purple": "#800080", "pink": "#FFC0CB", "brown": "#8B4513",
+    "black": "#000000", "white": "#FFFFFF", "gray": "#808080", "grey": "#808080",
+}
+# Same scale as SYSTEM_PROMPT; for circles this is the radius
+LOCAL_DRAW_SIZES = {"tiny": 20, "small": 40, "medium": 80, "large": 140, "big": 140, "huge": 220}
+# Anchor as fractions of (width, height)
+LOCAL_DRAW_POSITIONS = {
+    "center": (0.5, 0.5), "top": (0.5, 0.0), "bottom": (0.5, 1.0), "left": (0.0, 0.5), "right": (1.0, 0.5),
+    "top-left": (0.0, 0.0), "top-right": (1.0, 0.0), "bottom-left": (0.0, 1.0), "bottom-right": (1.0, 1.0),
+}
+
+_size_re = "|".join(LOCAL_DRAW_SIZES)
+_LOCAL_DRAW_RE = re.compile(
+    rf"(?:please\s+)?(?:draw|add|make|create|put|place)\s+(?:an?\s+|one\s+)?"
+    rf"(?:(?P<size>{_size_re})\s+)?(?P<color>{'|'.join(LOCAL_DRAW_COLORS)})\s+(?:(?P<size2>{_size_re})\s+)?"
+    r"(?P<shape>circle|square|rectangle|line|triangle)"
+    r"(?:\s+(?:(?:in|at|on|to)\s+)?(?:the\s+)?"
+    r"(?P<pos>(?:(?:top|upper|bottom|lower)[- ]?(?:left|right))|top|upper|bottom|lower|left|right|center|centre|middle)"
+    r"(?:\s+(?:corner|side|edge))?(?:\s+(?:of\s+the\s+)?(?:canvas|page|screen))?)?"
+    r"\s*[.!]?",
+    re.IGNORECASE,
+)
+
+
+def _normalize_position(pos: typing.Optional[str]) -> str:
+    if not pos:
+        return "center"
+    pos = pos.lower().replace("upper", "top").replace("lower", "bottom").replace(" ", "-")
+    pos = re.sub(r"^(top|bottom)(left|right)$", r"\1-\2", pos)
+    return "center" if pos in ("centre", "middle") else pos
+
+
+def _try_local_draw(prompt: str, canvasState: dict[str, typing.Any]) -> typing.Optional[dict]:
+    """Template answer for a single-primitive prompt, or None when the model is needed."""
+    match = _LOCAL_DRAW_RE.fullmatch(prompt.strip())
+    bounds = canvasState.get("bounds") if isinstance(canvasState, dict) else None
+    if match is None or not isinstance(bounds, dict):
+        return None
+    width, height = bounds.get("width"), bounds.get("height")
+    if not isinstance(width, (int, float)) or not isinstance(height, (int, float)) or width <= 0 or height <= 0:
+        return None
+
+    shape = match["shape"].lower()
+    size = LOCAL_DRAW_SIZES[(match["size"] or match["size2"] or "medium").lower()]
+    half_w = size * 1.5 if shape == "rectangle" else size
+    half_h = size
+    # Anchor at the named spot, pulled in so the whole shape stays on the canvas
+    fx, fy = LOCAL_DRAW_POSITIONS[_normalize_position(match["pos"])]
+    cx = round(min(max(fx * width, half_w), width - half_w)) if width > 2 * half_w else round(width / 2)
+    cy = round(min(max(fy * height, half_h), height - half_h)) if height > 2 * half_h else round(height / 2)
+
+    if shape == "circle":
+        path = {"tool": "shape", "type": "circle", "start": {"x": cx, "y": cy}, "end": {"x": cx + size, "y": cy}}
+    elif shape == "line":
+        path = {"tool": "shape", "type": "line", "start": {"x": cx - size, "y": cy}, "end": {"x": cx + size, "y": cy}}
+    elif shape == "triangle":
+        path = {"tool": "shape", "type": "polygon", "points": [
+            {"x": cx, "y": cy - size}, {"x": cx + size, "y": cy + size}, {"x": cx - size, "y": cy + size},
+        ]}
+    else:
+        path = {"tool": "shape", "type": "rectangle",
+                "start": {"x": round(cx - half_w), "y": cy - half_h}, "end": {"x": round(cx + half_w), "y": cy + half_h}}
+
+    color = LOCAL_DRAW_COLORS[match["color"].lower()]
+    return {"objects": [{"color": color, "lineWidth": 2, "pathData": path}]}
+
+
+# === Output validation ========================================================
+def _collect_points(value: typing.Any, out: list) -> None:
+    """Append every {x, y} dict found in a pathData value to ``out``."""
+    if isinstance(value, dict):
+        if _is_point(value):
+            out.append(value)
+        else:
+            for v in value.values():
+                _collect_points(v, out)
+    elif isinstance(value, list):
+        for v in value:
+            _collect_points(v, out)
+
+
+def _validate_and_clip(parsed: typing.Any, bounds: typing.Any) -> typing.Any:
+    """
+    Clamp every pathData point of ``parsed["objects"]`` into
+    [0, width] x [0, height] in place; NaN becomes 0. All points are
+    gathered into one array and clipped in a single numpy pass (plain
+    Python without numpy). Error payloads and missing bounds pass through.
+    """
+    objects = parsed.get("objects") if isinstance(parsed, dict) else None
+    if not isinstance(objects, list) or not isinstance(bounds, dict):
+        return parsed
+    width, height = bounds.get("width"), bounds.get("height")
+    if not isinstance(width, (int, float)) or not isinstance(height, (int, float)):
+        return parsed
+
+    points = []
+    for obj in objects:
+        if isinstance(obj, dict):
+            _collect_points(obj.get("pathData"), points)
+    if not points:
+        return parsed
+
+    if np is not None:
+        coords = np.array([(p["x"], p["y"]) for p in points], dtype=np.float64)
+        clipped = np.clip(np.nan_to_num(coords, nan=0.0), 0, [width, height])
+        # Write back only the points that moved so in-range ints stay ints
+        for i in np.flatnonzero((clipped != coords).any(axis=1)).tolist():
+            points[i]["x"], points[i]["y"] = clipped[i].tolist()
+        return parsed
+
+    for p in points:
+        for key, limit in (("x", width), ("y", height)):
+            v = p[key]
+            if math.isnan(v):
+                p[key] = 0.0
+            elif not 0 <= v <= limit:
+                p[key] = float(min(max(v, 0), limit))
+    return parsed
+
+
 def prompt_to_drawings(prompt: str, canvasState: dict[str, typing.Any]) -> dict:
     """
     Route a drawing prompt to OpenAI first, then fall back to Ollama
-    if the cloud model fails. Guarantees a dictionary response.
+    if the cloud model fails or is slow (see _hedged). Guarantees a
+    dictionary response; coordinates are clipped to the canvas bounds.
 
     Args:
         prompt: The user's text prompt describing the drawing.
@@ -384,17 +1011,139 @@ def prompt_to_drawings(prompt: str, canvasState: dict[str, typing.Any]) -> dict:
     Returns:
         Dict containing parsed drawing attributes or an error payload.
     """
-    model_output = openai_prompt_to_json(prompt, canvasState)
+    local = _try_local_draw(prompt, canvasState)
+    if local is not None:
+        return local
 
-    # If user setup openai API's properly and no errors
-    # occured, return the model's output
-    if "error" not in model_output:
-        return model_output
+    canvasState = compact_canvas(canvasState, simplify=True)
+    result = _hedged(openai_prompt_to_json, ollama_prompt_to_json, prompt, canvasState, valid=_is_drawing_reply)
+    return _validate_and_clip(result, canvasState.get("bounds"))
+
+
+
+def _iter_stream_objects(chunks: typing.Iterable[str]) -> typing.Iterator[dict]:
+    """
+    Incrementally parse a streamed {"objects": [ {...}, {...} ]} response and
+    yield each array element as soon as its closing brace arrives.
+
+    A brace-counting state machine tracks nesting (ignoring braces inside
+    string literals), so only elements of arrays directly under the top-level
+    object are emitted; fragments that fail to parse are skipped.
+    """
+    buf = []        # characters of the element being collected
+    stack = []      # open brackets, e.g. ["{", "[", "{"]
+    in_string = False
+    escaped = False
+
+    for chunk in chunks:
+        for ch in chunk:
+            collecting = len(stack) >= 3
+            if collecting:
+                buf.append(ch)
+
+            if in_string:
+                if escaped:
+                    escaped = False
+                elif ch == "\\":
+                    escaped = True
+                elif ch == '"':
+                    in_string = False
+                continue
+
+            if ch == '"':
+                in_string = True
+            elif ch in "{[":
+                if ch == "{" and stack == ["{", "["]:
+                    buf = [ch]
+                stack.append(ch)
+            elif ch in "}]":
+                if stack:
+                    stack.pop()
+                if ch == "}" and stack == ["{", "["]:
+                    try:
+                        obj = fast_json.loads("".join(buf))
+                    except ValueError:
+                        obj = None
+                    if isinstance(obj, dict):
+                        yield obj
+                    buf = []
+
+
+def _openai_drawing_chunks(prompt: str, canvasState: dict[str, typing.Any]) -> typing.Iterator[str]:
+    client = _get_openai_client()
+    with _openai_slots:
+        stream = client.chat.completions.create(
+            model=LLM_DRAWING_FINETUNED_MODEL or "gpt-4o-mini",
+            response_format=DRAW_RESPONSE_FORMAT,
+            temperature=0.1,
+            messages=_get_text_to_drawings_initial_message(
+                prompt, canvasState, LLM_MESSAGE_FORMAT, fewshot=not LLM_DRAWING_FINETUNED_MODEL
+            ),
+            # Full cap: objects already sent cannot be retried if the budget cuts the reply short
+            max_tokens=DRAWING_MAX_TOKENS,
+            stream=True,
+            extra_body=_prompt_cache_extra(DRAWING_PROMPT_CACHE_KEY, LLM_MESSAGE_FORMAT),
+        )
+        for chunk in stream:
+            if chunk.choices and chunk.choices[0].delta.content:
+                yield chunk.choices[0].delta.content
+
+
+def _ollama_drawing_chunks(prompt: str, canvasState: dict[str, typing.Any]) -> typing.Iterator[str]:
+    stream = _ollama_chat(
+        _get_text_to_drawings_initial_message(prompt, canvasState),
+        num_predict=DRAWING_MAX_TOKENS,
+        stream=True,
+    )
+    for chunk in stream:
+        content = chunk["message"]["content"]
+        if content:
+            yield content
 
-    # Fallback
-    fallback_model_output = ollama_prompt_to_json(prompt, canvasState)
-    return fallback_model_output
 
+def prompt_to_drawings_stream(prompt: str, canvasState: dict[str, typing.Any]) -> typing.Iterator[dict]:
+    """
+    Streaming variant of prompt_to_drawings: yields drawing objects one at a
+    time as the model generates them, so the caller can render progressively.
+
+    OpenAI is tried first and Ollama is used if it fails before producing any
+    object. On failure a single error payload ({"error": ..., "detail": ...})
+    is yielded as the last item.
+
+    Args:
+        prompt: The user's text prompt describing the drawing.
+
+    Yields:
+        Drawing objects (same shape as the items of prompt_to_drawings()["objects"]),
+        or a final error payload.
+    """
+    local = _try_local_draw(prompt, canvasState)
+    if local is not None:
+        yield from local["objects"]
+        return
+
+    canvasState = compact_canvas(canvasState, simplify=True)
+    errors = {}
+    for name, source in (("openai", _openai_drawing_chunks), ("ollama", _ollama_drawing_chunks)):
+        emitted = 0
+        try:
+            for obj in _iter_stream_objects(source(prompt, canvasState)):
+                emitted += 1
+                _validate_and_clip({"objects": [obj]}, canvasState.get("bounds"))
+                yield obj
+        except Exception as e:
+            errors[name] = str(e)
+            if emitted:
+                # Objects already went to the client; don't mix in a second model's output
+                yield {"error": f"{name}_stream_failed", "detail": str(e)}
+                return
+            continue
+
+        if emitted:
+            return
+        errors[name] = "no objects in model response"
+
+    yield {"error": "stream_failed", "detail": errors}
 
 # === Shape Completion =========================================================
 SHAPE_COMPLETION_SYSTEM = """
@@ -647,8 +1396,37 @@ SHAPE_COMPLETION_FEWSHOT_ASSISTANT_JSON_3 = {
     },
 }
 
+_SHAPE_COMPLETION_FEWSHOT_ASSISTANT_STR_1 = fast_json.dumps(SHAPE_COMPLETION_FEWSHOT_ASSISTANT_JSON_1)
+_SHAPE_COMPLETION_FEWSHOT_ASSISTANT_STR_2 = fast_json.dumps(SHAPE_COMPLETION_FEWSHOT_ASSISTANT_JSON_2)
+_SHAPE_COMPLETION_FEWSHOT_ASSISTANT_STR_3 = fast_json.dumps(SHAPE_COMPLETION_FEWSHOT_ASSISTANT_JSON_3)
+
+COMPLETION_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "complete": {"type": "boolean"},
+        "confidence": {"type": "number"},
+        "object": DRAWING_OBJECT_SCHEMA,
+    },
+    "required": ["complete", "confidence", "object"],
+    "additionalProperties": False,
+}
+
+COMPLETION_RESPONSE_FORMAT = {
+    "type": "json_schema",
+    "json_schema": {"name": "shape_completion", "schema": COMPLETION_SCHEMA, "strict": True},
+}
+
+SHAPE_COMPLETION_FEWSHOTS = (
+    (SHAPE_COMPLETION_FEWSHOT_USER_1, _SHAPE_COMPLETION_FEWSHOT_ASSISTANT_STR_1),
+    (SHAPE_COMPLETION_FEWSHOT_USER_2, _SHAPE_COMPLETION_FEWSHOT_ASSISTANT_STR_2),
+    (SHAPE_COMPLETION_FEWSHOT_USER_3, _SHAPE_COMPLETION_FEWSHOT_ASSISTANT_STR_3),
+)
+
+SHAPE_COMPLETION_PROMPT_CACHE_KEY = _prompt_cache_key("complete", SHAPE_COMPLETION_SYSTEM)
+
+
 def _get_shape_completion_initial_message(
-    canvas_state: dict[str, typing.Any]
+    canvas_state: dict[str, typing.Any], provider: str = "openai", fewshot: bool = True
 ) -> list[dict]:
     """
     Build the few-shot seeded chat messages for shape completion.
@@ -658,24 +1436,30 @@ def _get_shape_completion_initial_message(
             The current canvas state. Expected keys:
               - "drawings": list of existing drawings (color, lineWidth, pathData, etc.)
               - "bounds": { "width": number, "height": number }
+        provider: Message shape, see _build_messages.
+        fewshot: False for a fine-tuned model that already learned the examples.
 
     Returns:
         list[dict]: Chat messages for OpenAI/Ollama APIs:
             [system, user(few-shot), assistant(few-shot), user(few-shot), assistant(few-shot), user(actual)]
     """
-    canvas_json = json.dumps(canvas_state, separators=(",", ":"))
+    canvas_json = fast_json.dumps(canvas_state)
     user_msg = f"CanvasState:\n{canvas_json}"
 
-    return [
-        {"role": "system", "content": SHAPE_COMPLETION_SYSTEM},
-        {"role": "user", "content": SHAPE_COMPLETION_FEWSHOT_USER_1},
-        {"role": "assistant", "content": json.dumps(SHAPE_COMPLETION_FEWSHOT_ASSISTANT_JSON_1)},
-        {"role": "user", "content": SHAPE_COMPLETION_FEWSHOT_USER_2},
-        {"role": "assistant", "content": json.dumps(SHAPE_COMPLETION_FEWSHOT_ASSISTANT_JSON_2)},
-        {"role": "user", "content": SHAPE_COMPLETION_FEWSHOT_USER_3},
-        {"role": "assistant", "content": json.dumps(SHAPE_COMPLETION_FEWSHOT_ASSISTANT_JSON_3)},
-        {"role": "user", "content": user_msg},
-    ]
+    return _build_messages(SHAPE_COMPLETION_SYSTEM, SHAPE_COMPLETION_FEWSHOTS if fewshot else (), user_msg, provider)
+
+
+def _completion_request(canvas_state: dict) -> dict:
+    """Chat request body for shape completion (shared by the sync and batch paths)."""
+    return dict(
+        model=LLM_COMPLETION_FINETUNED_MODEL or "gpt-4.1-mini",
+        response_format=COMPLETION_RESPONSE_FORMAT,
+        temperature=0.1,
+        messages=_get_shape_completion_initial_message(
+            canvas_state, LLM_MESSAGE_FORMAT, fewshot=not LLM_COMPLETION_FINETUNED_MODEL
+        ),
+        max_tokens=220,
+    )
 
 
 def openai_complete_shape(canvas_state: dict) -> dict:
@@ -688,20 +1472,16 @@ def openai_complete_shape(canvas_state: dict) -> dict:
     Returns:
         dict: { complete, confidence, object{ color, lineWidth, pathData{...} } } or error payload.
     """
+    if OpenAI is None or not OPENAI_API_KEY:
+        return {"error": "openai_not_configured", "detail": "OPENAI_API_KEY is not set in environment"}
     try:
-        from config import OPENAI_API_KEY
-        from openai import OpenAI
-
-        client = OpenAI(api_key=OPENAI_API_KEY)
+        client = _get_openai_client()
 
-        resp = client.chat.completions.create(
-            model="gpt-4.1-mini",
-            response_format={"type": "json_object"},
-            temperature=0.1,
-            messages=_get_shape_completion_initial_message(canvas_state),
-            max_tokens=220,
+        return _create_json_completion(
+            client,
+            **_completion_request(canvas_state),
+            extra_body=_prompt_cache_extra(SHAPE_COMPLETION_PROMPT_CACHE_KEY, LLM_MESSAGE_FORMAT),
         )
-        return json.loads(resp.choices[0].message.content)
     except Exception as e:
         return {"error": "openai_completion_failed", "detail": str(e)}
 
@@ -717,20 +1497,50 @@ def ollama_complete_shape(canvas_state: dict) -> dict:
         dict: { complete, confidence, object{ color, lineWidth, pathData{...} } } or error payload.
     """
     try:
-        import ollama
-
-        response = ollama.chat(
-            model="llama3:8b",
-            messages=_get_shape_completion_initial_message(canvas_state),
-        )
-        return json.loads(response["message"]["content"])
+        response = _ollama_chat(_get_shape_completion_initial_message(canvas_state))
+        return fast_json.loads(response["message"]["content"])
     except Exception as e:
         return {"error": "ollama_completion_failed", "detail": str(e)}
 
 
+# === Completion semantic cache ================================================
+# Completion runs after every finished stroke, and consecutive canvases often
+# differ by a handful of points. The canvas JSON is embedded once and a prior
+# completion is reused when its canvas is nearly identical (cosine >= 0.95).
+# Entries live in a SemanticCache ring buffer; all share one scope key since
+# the canvas itself is the lookup text.
+_COMPLETION_CACHE_SCOPE = "complete_shape"
+_completion_cache = None
+_completion_cache_lock = threading.Lock()
+
+
+def _openai_embed(text: str) -> typing.List[float]:
+    client = _get_openai_client()
+    resp = client.embeddings.create(model=LLM_COMPLETION_EMBEDDING_MODEL, input=text)
+    return resp.data[0].embedding
+
+
+def _get_completion_cache() -> typing.Optional[SemanticCache]:
+    """The process-wide completion cache, or None when disabled or unusable."""
+    global _completion_cache
+    if not LLM_COMPLETION_CACHE_ENABLED:
+        return None
+    if _completion_cache is None:
+        with _completion_cache_lock:
+            if _completion_cache is None:
+                _completion_cache = SemanticCache(
+                    embed=_openai_embed,
+                    threshold=LLM_COMPLETION_CACHE_THRESHOLD,
+                    max_entries=LLM_COMPLETION_CACHE_SIZE,
+                    ttl=LLM_COMPLETION_CACHE_TTL_SECS,
+                )
+    return _completion_cache if _completion_cache.available else None
+
+
 def complete_shape_from_canvas(canvas_state: dict) -> dict:
     """
-    Perform AI-based shape completion using OpenAI first, then Ollama.
+    Perform AI-based shape completion using OpenAI first, then Ollama
+    (hedged, see _hedged). A completion for a near-identical earlier canvas is returned without a model call.
 
     Args:
         canvas_state (dict): Current canvas (drawings + bounds).
@@ -738,10 +1548,19 @@ def complete_shape_from_canvas(canvas_state: dict) -> dict:
     Returns:
         dict: Inferred shape completion result.
     """
-    model_output = openai_complete_shape(canvas_state)
-    if "error" not in model_output:
-        return model_output
-    return ollama_complete_shape(canvas_state)
+    canvas_state = compact_canvas(canvas_state, simplify=True)
+    cache = _get_completion_cache() if OPENAI_API_KEY else None
+    # One embedding per request, shared by the lookup and the store
+    vec = cache.encode(fast_json.dumps(canvas_state)) if cache is not None else None
+    if vec is not None:
+        cached = cache.get_vector(vec, _COMPLETION_CACHE_SCOPE)
+        if cached is not None:
+            return cached
+
+    model_output = _hedged(openai_complete_shape, ollama_complete_shape, canvas_state, valid=_is_completion_reply)
+    if vec is not None and "error" not in model_output:
+        cache.add_vector(vec, _COMPLETION_CACHE_SCOPE, model_output)
+    return model_output
 
 
 # === Canvas Beautification (canvas-state) ======================
@@ -931,23 +1750,37 @@ BEAUTIFY_FEWSHOT_ASSISTANT_JSON_2 = {
 }
 
 
+_BEAUTIFY_FEWSHOT_ASSISTANT_STR_1 = fast_json.dumps(BEAUTIFY_FEWSHOT_ASSISTANT_JSON_1)
+_BEAUTIFY_FEWSHOT_ASSISTANT_STR_2 = fast_json.dumps(BEAUTIFY_FEWSHOT_ASSISTANT_JSON_2)
+
 def _get_beautify_canvas_initial_message(
     canvas_state: dict[str, typing.Any]
 ) -> list[dict]:
     """
     Build few-shot seeded messages for beautification.
     """
-    canvas_json = json.dumps(canvas_state, ensure_ascii=False)
+    canvas_json = fast_json.dumps(canvas_state)
     
     return [
         {"role": "system", "content": BEAUTIFY_SYSTEM_PROMPT},
         {"role": "user", "content": BEAUTIFY_FEWSHOT_USER_1},
-        {"role": "assistant", "content": json.dumps(BEAUTIFY_FEWSHOT_ASSISTANT_JSON_1)},
+        {"role": "assistant", "content": _BEAUTIFY_FEWSHOT_ASSISTANT_STR_1},
         {"role": "user", "content": BEAUTIFY_FEWSHOT_USER_2},
-        {"role": "assistant", "content": json.dumps(BEAUTIFY_FEWSHOT_ASSISTANT_JSON_2)},
+        {"role": "assistant", "content": _BEAUTIFY_FEWSHOT_ASSISTANT_STR_2},
         {"role": "user", "content": f"CanvasState:\n{canvas_json}"},
     ]
 
+def _beautify_request(canvas_state: dict[str, typing.Any]) -> dict:
+    """Chat request body for beautification (shared by the sync and batch paths)."""
+    return dict(
+        model="gpt-4.1-mini",
+        response_format={"type": "json_object"},  # forces JSON
+        temperature=0.1,
+        messages=_get_beautify_canvas_initial_message(canvas_state),
+        max_tokens=10000,
+    )
+
+
 def openai_beautify_canvas(
     canvas_state: dict[str, typing.Any],
 ) -> dict:
@@ -958,23 +1791,9 @@ def openai_beautify_canvas(
       { "error": "...", "detail": "..." }
     """
     try:
-        from config import OPENAI_API_KEY
-        from openai import OpenAI
+        client = _get_openai_client()
 
-        client = OpenAI(api_key=OPENAI_API_KEY)
-
-        resp = client.chat.completions.create(
-            model="gpt-4.1-mini",
-            response_format={"type": "json_object"},  # forces JSON
-            temperature=0.1,
-            messages=_get_beautify_canvas_initial_message(canvas_state),
-            max_tokens=10000,
-        )
-
-        content = resp.choices[0].message.content
-
-        print(f"\n\n{content}\n\n")
-        parsed = json.loads(content)
+        parsed = _create_json_completion(client, **_beautify_request(canvas_state))
         print(f"\n\n{parsed}\n\n")
 
         return parsed
@@ -991,14 +1810,9 @@ def ollama_beautify_canvas(
     openai_beautify_canvas: either { "objects": [...] } or { "error": ... }.
     """
     try:
-        import ollama
-
-        response = ollama.chat(
-            model="llama3:8b",
-            messages=_get_beautify_canvas_initial_message(canvas_state),
-        )
+        response = _ollama_chat(_get_beautify_canvas_initial_message(canvas_state), num_predict=-1)
 
-        parsed = json.loads(response["message"]["content"])
+        parsed = fast_json.loads(response["message"]["content"])
 
         if not isinstance(parsed, dict) or "objects" not in parsed:
             return {
@@ -1029,27 +1843,124 @@ def beautify_canvas_state(
       1) Try OpenAI.
       2) If that fails or returns invalid output, try Ollama.
       3) If both fail, ROLLBACK to the ORIGINAL drawings and return:
-         { "objects": canvas_state.drawings }
+         { "objects": canvas_state.drawings, "rolledBack": true }
 
     Returns:
         dict with at least:
           { "objects": [...] }
     """
+    # The model sees a compacted copy; rollback returns the caller's originals
+    model_input = compact_canvas(canvas_state, keep_ids=True)
+
     # Primary: OpenAI
-    model_output = openai_beautify_canvas(canvas_state)
+    model_output = openai_beautify_canvas(model_input)
     if "error" not in model_output and "objects" in model_output:
         return model_output
 
     print(f"\n\nFAILED OPENAI API!: {model_output} \n\n")
 
     # Fallback: Ollama
-    fallback_output = ollama_beautify_canvas(canvas_state)
+    fallback_output = ollama_beautify_canvas(model_input)
     if "error" not in fallback_output and "objects" in fallback_output:
         return fallback_output
 
-    # Rollback: both failed => return original drawings as objects
-    original_drawings = canvas_state.get("objects", [])
-    return {"objects": original_drawings}
+    # Rollback: both failed => return original drawings as objects, flagged
+    # so callers never cache them
+    original_drawings = canvas_state.get("objects", canvas_state.get("drawings", []))
+    return {"objects": original_drawings, "rolledBack": True}
+
+
+# === Batch API (offline bulk jobs) ============================================
+# Bulk work such as re-beautifying every saved canvas does not need an answer
+# within seconds. The OpenAI Batch API runs the same chat requests
+# asynchronously (completion window 24h) at half the token price. Interactive
+# routes keep using the synchronous functions above.
+BATCH_POLL_SECS = 30.0
+_BATCH_FINAL_STATES = ("completed", "failed", "expired", "cancelled")
+
+
+def _run_openai_batch(
+    bodies: list[dict], poll_interval: float = BATCH_POLL_SECS, timeout: typing.Optional[float] = None
+) -> list[typing.Optional[dict]]:
+    """
+    Submit chat request bodies as one batch job, wait for it to finish and
+    return the parsed JSON reply per body, in input order (None where the
+    request failed or the reply was not valid JSON).
+
+    Raises TimeoutError if the job is still running after ``timeout`` seconds.
+    """
+    client = _get_openai_client()
+    jsonl = "\n".join(
+        fast_json.dumps({"custom_id": str(i), "method": "POST", "url": "/v1/chat/completions", "body": body})
+        for i, body in enumerate(bodies)
+    )
+    uploaded = client.files.create(file=("batch.jsonl", jsonl.encode("utf-8")), purpose="batch")
+    batch = client.batches.create(
+        input_file_id=uploaded.id, endpoint="/v1/chat/completions", completion_window="24h"
+    )
+
+    deadline = None if timeout is None else time.monotonic() + timeout
+    while batch.status not in _BATCH_FINAL_STATES:
+        if deadline is not None and time.monotonic() >= deadline:
+            raise TimeoutError(f"Batch {batch.id} still {batch.status} after {timeout}s")
+        time.sleep(poll_interval)
+        batch = client.batches.retrieve(batch.id)
+
+    results: list[typing.Optional[dict]] = [None] * len(bodies)
+    if batch.status != "completed" or not batch.output_file_id:
+        logger.warning(f"Batch {batch.id} ended as {batch.status}")
+        return results
+
+    for line in client.files.content(batch.output_file_id).text.splitlines():
+        if not line.strip():
+            continue
+        try:
+            item = fast_json.loads(line)
+            response = item.get("response") or {}
+            if response.get("status_code") != 200:
+                continue
+            parsed = fast_json.loads(response["body"]["choices"][0]["message"]["content"])
+            results[int(item["custom_id"])] = parsed if isinstance(parsed, dict) else None
+        except (KeyError, IndexError, TypeError, ValueError):
+            continue
+    return results
+
+
+def batch_beautify(
+    canvas_states: list[dict], poll_interval: float = BATCH_POLL_SECS, timeout: typing.Optional[float] = None
+) -> list[dict]:
+    """
+    Beautify many canvases with one Batch API job. Same contract as
+    beautify_canvas_state per canvas: a canvas whose result is missing or
+    invalid rolls back to its original objects.
+    """
+    if not canvas_states:
+        return []
+    bodies = [_beautify_request(compact_canvas(state, keep_ids=True)) for state in canvas_states]
+    results = _run_openai_batch(bodies, poll_interval, timeout)
+    return [
+        result if result is not None and isinstance(result.get("objects"), list)
+        else {"objects": state.get("objects", state.get("drawings", [])), "rolledBack": True}
+        for state, result in zip(canvas_states, results)
+    ]
+
+
+def batch_complete_shapes(
+    canvas_states: list[dict], poll_interval: float = BATCH_POLL_SECS, timeout: typing.Optional[float] = None
+) -> list[dict]:
+    """
+    Shape completion for many canvases with one Batch API job. Each entry is
+    the completion result or an {"error": "openai_batch_failed"} payload.
+    """
+    if not canvas_states:
+        return []
+    bodies = [_completion_request(compact_canvas(state, simplify=True)) for state in canvas_states]
+    results = _run_openai_batch(bodies, poll_interval, timeout)
+    return [
+        result if result is not None
+        else {"error": "openai_batch_failed", "detail": "No valid result for this canvas in the batch output."}
+        for result in results
+    ]
 # === Style Transfer (apply an artistic style to an existing canvas) ==========
 STYLE_TRANSFER_SYSTEM = """
 You are an artistic style transfer engine for a canvas app.
@@ -1208,23 +2119,22 @@ FEWSHOT_STYLE_ASSISTANT_JSON_3 = {
 }
 
 
+_FEWSHOT_STYLE_ASSISTANT_STR_1 = fast_json.dumps(FEWSHOT_STYLE_ASSISTANT_JSON_1)
+
 def _get_style_transfer_message(canvas_state: dict, style_prompt: str) -> list[dict]:
-    canvas_json = json.dumps(canvas_state, ensure_ascii=False)
+    canvas_json = fast_json.dumps(canvas_state)
     user_msg = f"CanvasState:\n{canvas_json}\nStylePrompt:\n{style_prompt}"
     return [
         {"role": "system", "content": STYLE_TRANSFER_SYSTEM},
         {"role": "user", "content": FEWSHOT_STYLE_USER_1},
-        {"role": "assistant", "content": json.dumps(FEWSHOT_STYLE_ASSISTANT_JSON_1)},
+        {"role": "assistant", "content": _FEWSHOT_STYLE_ASSISTANT_STR_1},
         {"role": "user", "content": user_msg},
     ]
 
 
 def openai_style_transfer(canvas_state: dict, style_prompt: str) -> dict:
     try:
-        from config import OPENAI_API_KEY
-        from openai import OpenAI
-
-        client = OpenAI(api_key=OPENAI_API_KEY)
+        client = _get_openai_client()
 
         resp = client.chat.completions.create(
             model="gpt-4.1-mini",
@@ -1235,21 +2145,16 @@ def openai_style_transfer(canvas_state: dict, style_prompt: str) -> dict:
         )
 
         content = resp.choices[0].message.content
-        return json.loads(content)
+        return fast_json.loads(content)
     except Exception as e:
         return {"error": "openai_style_failed", "detail": str(e)}
 
 
 def ollama_style_transfer(canvas_state: dict, style_prompt: str) -> dict:
     try:
-        import ollama
+        response = _ollama_chat(_get_style_transfer_message(canvas_state, style_prompt), num_predict=-1)
 
-        response = ollama.chat(
-            model="llama3:8b",
-            messages=_get_style_transfer_message(canvas_state, style_prompt),
-        )
-
-        return json.loads(response["message"]["content"])
+        return fast_json.loads(response["message"]["content"])
     except Exception as e:
         return {"error": "ollama_style_failed", "detail": str(e)}
 
@@ -1440,19 +2345,23 @@ def _create_impasto_overlays(obj: dict, bbox: dict, default_params: dict, idx: i
 
 
 def style_transfer_canvas(canvas_state: dict, style_prompt: str) -> dict:
-    """Apply style transfer to canvas using OpenAI or Ollama."""
-    model_output = openai_style_transfer(canvas_state, style_prompt)
+    """
+    Apply style transfer to canvas using OpenAI or Ollama; if both fail, the
+    original objects come back flagged "rolledBack": true.
+    """
+    model_input = compact_canvas(canvas_state, keep_ids=True)
+    model_output = openai_style_transfer(model_input, style_prompt)
     if isinstance(model_output, dict) and "error" not in model_output and "objects" in model_output:
         model_output["objects"] = _postprocess_style_objects(model_output.get("objects", []), style_prompt)
         return model_output
 
-    fallback_output = ollama_style_transfer(canvas_state, style_prompt)
+    fallback_output = ollama_style_transfer(model_input, style_prompt)
     if isinstance(fallback_output, dict) and "error" not in fallback_output and "objects" in fallback_output:
         fallback_output["objects"] = _postprocess_style_objects(fallback_output.get("objects", []), style_prompt)
         return fallback_output
 
-    original_objects = canvas_state.get("objects", [])
-    return {"objects": original_objects}
+    original_objects = canvas_state.get("objects", canvas_state.get("drawings", []))
+    return {"objects": original_objects, "rolledBack": True}
 
 
 # === Simple Vector-based Object Recognition =================================
@@ -1535,122 +2444,429 @@ CanvasObjects:
 
 FEWSHOT_RECO_ASSISTANT_5 = {"label": "text: 'Hello'", "confidence": 0.98, "explanation": "A text primitive with the exact string 'Hello' present in the selection."}
 
-def _get_recognition_message(canvas_objects: list, box: dict, bounds: dict) -> list[dict]:
-    objs_json = json.dumps({"objects": canvas_objects, "bounds": bounds}, ensure_ascii=False)
-    user_msg = f"SelectionBox:\n{json.dumps(box)}\nCanvasObjects:\n{objs_json}\n\nPlease identify the primary object or scene contained within the selection box and return JSON as specified."
+
+# Value of every two-character hex pair in any letter case ("8b", "8B", "aF", ...)
+_HEX_PAIRS = {a + b: int(a + b, 16) for a in "0123456789abcdefABCDEF" for b in "0123456789abcdefABCDEF"}
+
+
+@functools.lru_cache(maxsize=512)
+def _hex_to_packed(h: str) -> int:
+    """
+    "#RRGGBB" (or shorthand "#RGB") -> 0xRRGGBB with three table lookups;
+    malformed input maps to black. Canvases reuse a few palette colors, so
+    this is cached.
+    """
+    h = h.lstrip("#")
+    if len(h) == 3:
+        h = h[0] * 2 + h[1] * 2 + h[2] * 2
+    try:
+        return (_HEX_PAIRS[h[0:2]] << 16) | (_HEX_PAIRS[h[2:4]] << 8) | _HEX_PAIRS[h[4:6]]
+    except KeyError:
+        return 0
+
+
+# Basic color terms used by the recognition rules. Every RGB bin (4 bits per
+# channel) is named after the nearest prototype in CIELAB, which follows
+# perceived color much more closely than RGB distance did: the old "within 120
+# of (139, 69, 19)" test also accepted clear reds, and its green test accepted teal.
+BASIC_COLOR_NAMES = ("black", "white", "red", "green", "yellow", "blue", "brown", "purple", "pink", "orange", "grey")
+_BASIC_COLOR_PROTOTYPES = (
+    (0, 0, 0), (255, 255, 255), (220, 20, 30), (30, 150, 40), (250, 230, 30), (30, 60, 220),
+    (130, 70, 25), (120, 40, 150), (250, 160, 190), (250, 140, 0), (128, 128, 128),
+)
+_BROWN = BASIC_COLOR_NAMES.index("brown")
+_GREEN = BASIC_COLOR_NAMES.index("green")
+# Linear sRGB -> XYZ rows, each pre-divided by the D65 white point
+_RGB_TO_XYZ = (
+    (0.4124 / 0.95047, 0.3576 / 0.95047, 0.1805 / 0.95047),
+    (0.2126, 0.7152, 0.0722),
+    (0.0193 / 1.08883, 0.1192 / 1.08883, 0.9505 / 1.08883),
+)
+# CIELAB transfer function constants, folded once here rather than per channel
+_LAB_EPSILON = 0.008856
+_LAB_KAPPA = 7.787
+_LAB_OFFSET = 16 / 116
+_ONE_THIRD = 1 / 3
+
+
+def _srgb_linear(c: float) -> float:
+    c /= 255
+    return c / 12.92 if c <= 0.04045 else ((c + 0.055) / 1.055) ** 2.4
+
+
+def _lab_f(t: float) -> float:
+    return t ** _ONE_THIRD if t > _LAB_EPSILON else _LAB_KAPPA * t + _LAB_OFFSET
+
+
+def _srgb_to_lab(rgb: tuple) -> tuple:
+    """sRGB (0-255) -> CIELAB under D65."""
+    lin = [_srgb_linear(c) for c in rgb]
+    fx, fy, fz = (_lab_f(sum(m * c for m, c in zip(row, lin))) for row in _RGB_TO_XYZ)
+    return (116 * fy - 16, 500 * (fx - fy), 200 * (fy - fz))
+
+
+def _lab_distance2(lab: tuple, other: tuple) -> float:
+    dl, da, db = lab[0] - other[0], lab[1] - other[1], lab[2] - other[2]
+    return dl * dl + da * da + db * db
+
+
+def _srgb_to_lab_array(rgb):
+    """_srgb_to_lab over an (N, 3) array."""
+    c = np.asarray(rgb, dtype=np.float64) / 255
+    lin = np.where(c <= 0.04045, c / 12.92, ((c + 0.055) / 1.055) ** 2.4)
+    t = lin @ np.array(_RGB_TO_XYZ).T
+    f = np.where(t > _LAB_EPSILON, np.cbrt(t), _LAB_KAPPA * t + _LAB_OFFSET)
+    return np.stack([116 * f[:, 1] - 16, 500 * (f[:, 0] - f[:, 1]), 200 * (f[:, 1] - f[:, 2])], axis=1)
+
+
+@functools.lru_cache(maxsize=1)
+def _color_name_lut() -> bytes:
+    """BASIC_COLOR_NAMES index for each of the 4096 RGB bins (see _color_bin), built on first use."""
+    if np is not None:
+        # All 4096 x 11 squared Lab distances in one broadcast, then argmin per bin
+        i = np.arange(4096)
+        centers = np.stack([((i >> 8) << 4) + 8, (((i >> 4) & 15) << 4) + 8, ((i & 15) << 4) + 8], axis=1)
+        lab = _srgb_to_lab_array(centers)
+        prototypes = _srgb_to_lab_array(_BASIC_COLOR_PROTOTYPES)
+        d = lab[:, None, :] - prototypes[None, :, :]
+        d2 = (d * d).sum(axis=2)
+        return d2.argmin(axis=1).astype(np.uint8).tobytes()
+
+    prototypes = [_srgb_to_lab(p) for p in _BASIC_COLOR_PROTOTYPES]
+    lut = bytearray(4096)
+    for i in range(4096):
+        lab = _srgb_to_lab((((i >> 8) << 4) + 8, (((i >> 4) & 15) << 4) + 8, ((i & 15) << 4) + 8))
+        lut[i] = min(range(len(prototypes)), key=lambda k: _lab_distance2(lab, prototypes[k]))
+    return bytes(lut)
+
+
+def _color_bin(packed):
+    """Top nibble of each channel of 0xRRGGBB -> 0xRGB table index; works on ints and numpy arrays alike."""
+    return ((packed >> 12) & 0xF00) | ((packed >> 8) & 0xF0) | ((packed >> 4) & 0xF)
+
+
+# Stand-in for a missing or non-dict pathData; shared, never mutated
+_NO_PATH = {}
+
+
+def _extract_features(canvas_objects: list) -> dict:
+    """
+    Single pass over the selection collecting what the recognition rules look
+    at, one entry per object: path "type" and "tool", polygon "n_points",
+    "text", "rgb" packed as 0xRRGGBB, "color_name" (BASIC_COLOR_NAMES index)
+    and a "freehand" mask. With numpy the last three are arrays (uint32 for
+    "rgb"); otherwise lists.
+    """
+    lut = _color_name_lut()
+    n = len(canvas_objects)
+    # Flatten pathData once, then pull each column with a C-level map(dict.get)
+    paths = [pd if pd.__class__ is dict else _NO_PATH
+             for pd in map(dict.get, canvas_objects, itertools.repeat("pathData", n))]
+    types = list(map(dict.get, paths, itertools.repeat("type", n)))
+    tools = list(map(dict.get, paths, itertools.repeat("tool", n)))
+    texts = list(map(dict.get, paths, itertools.repeat("text", n)))
+    n_points = [len(pts) if pts.__class__ is list else 0
+                for pts in map(dict.get, paths, itertools.repeat("points", n))]
+    rgb = [_hex_to_packed(c) if c.__class__ is str else 0
+           for c in map(dict.get, canvas_objects, itertools.repeat("color", n), itertools.repeat("#000000", n))]
+
+    freehand = [t == "freehand" for t in tools]
+    if np is not None:
+        rgb = np.array(rgb, dtype=np.uint32)
+        color_names = np.frombuffer(lut, dtype=np.uint8)[_color_bin(rgb)]
+        freehand = np.array(freehand, dtype=bool)
+    else:
+        color_names = [lut[_color_bin(c)] for c in rgb]
+    return {
+        "type": types, "tool": tools, "n_points": n_points, "text": texts,
+        "rgb": rgb, "color_name": color_names, "freehand": freehand,
+    }
+
+
+def _has_freehand_color(features: dict, color: int) -> bool:
+    """
+    Whether any freehand stroke is named ``color`` (a BASIC_COLOR_NAMES index).
+    With numpy this is one fused byte-array predicate reduced by .any(), so no
+    index array or histogram is materialized; otherwise it stops at the first match.
+    """
+    names, freehand = features["color_name"], features["freehand"]
+    if np is not None and isinstance(names, np.ndarray):
+        return bool(((names == color) & freehand).any())
+    return color in itertools.compress(names, freehand)
+
+
+def _rule_based_recognize(canvas_objects: list, box: dict) -> typing.Optional[dict]:
+    """Lightweight rule-based recognizer for obvious geometric cases."""
+    try:
+        features = _extract_features(canvas_objects)
+        types = features["type"]
+
+        circle_count = types.count("circle")
+        if circle_count == 1 and len(canvas_objects) == 1:
+            return {"label": "circle", "confidence": 0.95, "explanation": "Single circular shape primitive within selection."}
+
+        for t, txt in zip(types, features["text"]):
+            if t == "text" and isinstance(txt, str):
+                return {"label": f"text: '{txt}'", "confidence": 0.98, "explanation": "A text primitive with an explicit string was found."}
+
+        rect_count = types.count("rectangle")
+        poly_count = types.count("polygon")
+        wheel_count = circle_count
+        if (rect_count + poly_count) >= 1 and wheel_count >= 2:
+            return {"label": "car", "confidence": 0.9, "explanation": "Rectangular/polygonal body plus multiple circular wheel primitives."}
+
+        tri_count = sum(1 for t, k in zip(types, features["n_points"]) if t == "polygon" and k == 3)
+        if rect_count >= 1 and tri_count >= 1:
+            return {"label": "house", "confidence": 0.9, "explanation": "Rectangular base plus triangular roof polygon detected."}
+
+        if _has_freehand_color(features, _BROWN) and _has_freehand_color(features, _GREEN):
+            return {"label": "tree", "confidence": 0.88, "explanation": "Brown trunk-like stroke plus clustered green freehand strokes resembling foliage."}
+
+    except Exception:
+        pass
+
+    return None
+
+
+# Recognition results per (canvas content, box, bounds). Dragging a selection
+# back and forth or undo/redo re-asks the same question; the key is the same
+# canonical canvas digest the route cache uses, so ids and float noise do not
+# matter. Unlike the route cache this also works without Redis, and it keeps
+# whichever provider answered (the raw-reply memo only covers OpenAI).
+_recognition_cache = TTLCache(maxsize=LLM_RESPONSE_CACHE_SIZE, ttl=LLM_CACHE_TTL_SECS)
+
+
+def _empty_selection() -> dict:
+    return {"label": "empty", "confidence": 1.0, "explanation": "No objects in the selection."}
+
+
+# === Batched recognition (several selection boxes, one model call) ============
+RECOGNITION_BATCH_MAX = 16
+# Rough prompt budget per call (~4 characters per token); larger batches are split.
+RECOGNITION_BATCH_MAX_CHARS = 200_000
+
+RECOGNITION_BATCH_INSTRUCTIONS = """
+BATCH MODE: you will receive several numbered selection boxes over the same
+CanvasObjects. Label each box independently, using only the objects that
+intersect that box.
+
+OUTPUT (JSON ONLY):
+{
+    "results": [
+        {"index": number, "label": "string", "confidence": number, "explanation": "string (optional)"}
+    ]
+}
+
+Return exactly one result per box, in the same order as the boxes.
+"""
+
+
+def _get_recognition_batch_message(canvas_objects: list, boxes: list, bounds: dict) -> list[dict]:
+    objs_json = fast_json.dumps({"objects": canvas_objects, "bounds": bounds})
+    boxes_json = fast_json.dumps([{"index": i, **box} for i, box in enumerate(boxes)])
+    user_msg = f"SelectionBoxes:\n{boxes_json}\nCanvasObjects:\n{objs_json}\n\nPlease identify the primary object or scene contained within each selection box and return JSON as specified."
     return [
-        {"role": "system", "content": RECOGNITION_SYSTEM},
+        {"role": "system", "content": RECOGNITION_SYSTEM + RECOGNITION_BATCH_INSTRUCTIONS},
         {"role": "user", "content": user_msg},
     ]
 
 
-def openai_recognize_objects(canvas_objects: list, box: dict, bounds: dict) -> dict:
-    try:
-        from config import OPENAI_API_KEY
-        from openai import OpenAI
+def _parse_batch_results(parsed: dict, count: int) -> list:
+    """Order model results by index; boxes the model skipped come back as 'unknown'."""
+    results = [{"label": "unknown", "confidence": 0.0} for _ in range(count)]
+    items = parsed.get("results") if isinstance(parsed, dict) else None
+    if not isinstance(items, list):
+        raise ValueError("Missing 'results' list in model response.")
+    for pos, item in enumerate(items):
+        if not isinstance(item, dict):
+            continue
+        idx = item.get("index", pos)
+        if isinstance(idx, int) and 0 <= idx < count:
+            results[idx] = {k: v for k, v in item.items() if k != "index"}
+    return results
+
 
-        client = OpenAI(api_key=OPENAI_API_KEY)
+def openai_recognize_objects_batch(canvas_objects: list, boxes: list, bounds: dict) -> typing.Union[list, dict]:
+    try:
+        client = _get_openai_client()
 
         resp = client.chat.completions.create(
             model="gpt-4.1-mini",
             response_format={"type": "json_object"},
             temperature=0.0,
-            messages=_get_recognition_message(canvas_objects, box, bounds),
-            max_tokens=300,
+            messages=_get_recognition_batch_message(canvas_objects, boxes, bounds),
+            max_tokens=100 + 120 * len(boxes),
         )
         content = resp.choices[0].message.content
-        return json.loads(content)
+        return _parse_batch_results(fast_json.loads(content), len(boxes))
     except Exception as e:
         return {"error": "openai_recognition_failed", "detail": str(e)}
 
 
-def ollama_recognize_objects(canvas_objects: list, box: dict, bounds: dict) -> dict:
+def ollama_recognize_objects_batch(canvas_objects: list, boxes: list, bounds: dict) -> typing.Union[list, dict]:
     try:
-        import ollama
-
-        response = ollama.chat(
-            model="llama3:8b",
-            messages=_get_recognition_message(canvas_objects, box, bounds),
-        )
+        response = _ollama_chat(_get_recognition_batch_message(canvas_objects, boxes, bounds))
 
-        return json.loads(response["message"]["content"])
+        return _parse_batch_results(fast_json.loads(response["message"]["content"]), len(boxes))
     except Exception as e:
         return {"error": "ollama_recognition_failed", "detail": str(e)}
 
 
-def _rule_based_recognize(canvas_objects: list, box: dict) -> typing.Optional[dict]:
-    """Lightweight rule-based recognizer for obvious geometric cases."""
-    try:
-        def is_circle(obj):
-            pd = obj.get("pathData", {})
-            return pd.get("type") == "circle"
+# Extent of an object without usable coordinates: overlaps every selection,
+# so such objects are never dropped from a box they might be in.
+_UNBOUNDED = (-(1 << 62), -(1 << 62), 1 << 62, 1 << 62)
 
-        def is_text(obj):
-            pd = obj.get("pathData", {})
-            return pd.get("type") == "text" and isinstance(pd.get("text"), str)
 
-        def count_type(t):
-            return sum(1 for o in canvas_objects if isinstance(o.get("pathData"), dict) and o.get("pathData", {}).get("type") == t)
-
-        circle_count = count_type("circle")
-        if circle_count == 1 and len(canvas_objects) == 1:
-            return {"label": "circle", "confidence": 0.95, "explanation": "Single circular shape primitive within selection."}
+def _object_bboxes(canvas_objects: list):
+    """
+    Integer [min_x, min_y, max_x, max_y] per object over every point in its
+    pathData (mins floored, maxes ceiled, so the box never shrinks). An
+    (N, 4) int64 array with numpy, otherwise a list of tuples.
+    """
+    bboxes = []
+    for o in canvas_objects:
+        points = []
+        _collect_points(o.get("pathData"), points)
+        xs = [p["x"] for p in points if math.isfinite(p["x"]) and math.isfinite(p["y"])]
+        ys = [p["y"] for p in points if math.isfinite(p["x"]) and math.isfinite(p["y"])]
+        if xs:
+            bboxes.append((math.floor(min(xs)), math.floor(min(ys)), math.ceil(max(xs)), math.ceil(max(ys))))
+        else:
+            bboxes.append(_UNBOUNDED)
+    if np is not None:
+        return np.array(bboxes, dtype=np.int64).reshape(-1, 4)
+    return bboxes
 
-        for o in canvas_objects:
-            if is_text(o):
-                txt = o.get("pathData", {}).get("text", "")
-                return {"label": f"text: '{txt}'", "confidence": 0.98, "explanation": "A text primitive with an explicit string was found."}
 
-        rect_count = count_type("rectangle")
-        poly_count = count_type("polygon")
-        wheel_count = circle_count
-        if (rect_count + poly_count) >= 1 and wheel_count >= 2:
-            return {"label": "car", "confidence": 0.9, "explanation": "Rectangular/polygonal body plus multiple circular wheel primitives."}
+def _box_edges(box: typing.Any) -> typing.Optional[tuple]:
+    """
+    Integer (x0, y0, x1, y1) of a selection box (floored left/top, ceiled
+    right/bottom), or None unless x, y, width and height are all finite numbers.
+    """
+    if not isinstance(box, dict):
+        return None
+    values = [box.get(k) for k in ("x", "y", "width", "height")]
+    if not all(isinstance(v, (int, float)) and not isinstance(v, bool) and math.isfinite(v) for v in values):
+        return None
+    x, y, w, h = values
+    return math.floor(x), math.floor(y), math.ceil(x + w), math.ceil(y + h)
 
-        def is_triangle(o):
-            pd = o.get("pathData", {})
-            pts = pd.get("points") if isinstance(pd.get("points"), list) else []
-            return pd.get("type") == "polygon" and len(pts) == 3
 
-        tri_count = sum(1 for o in canvas_objects if is_triangle(o))
-        if rect_count >= 1 and tri_count >= 1:
-            return {"label": "house", "confidence": 0.9, "explanation": "Rectangular base plus triangular roof polygon detected."}
+def _box_overlap_mask(bboxes, edges: tuple):
+    """
+    Which objects touch the selection box edges (the canvas selection tool's
+    overlap test), as four integer comparisons per object: a bool array with
+    numpy, else a list.
+    """
+    x0, y0, x1, y1 = edges
+    if np is not None and isinstance(bboxes, np.ndarray):
+        return (bboxes[:, 2] >= x0) & (bboxes[:, 0] <= x1) & (bboxes[:, 3] >= y0) & (bboxes[:, 1] <= y1)
+    return [b[2] >= x0 and b[0] <= x1 and b[3] >= y0 and b[1] <= y1 for b in bboxes]
 
-        def hex_to_rgb(h):
-            try:
-                h = h.lstrip("#")
-                return tuple(int(h[i:i+2], 16) for i in (0, 2, 4))
-            except Exception:
-                return (0, 0, 0)
-
-        def color_close(hexcolor, target_rgb, tol=100):
-            r, g, b = hex_to_rgb(hexcolor or "#000000")
-            tr, tg, tb = target_rgb
-            return ((r-tr)**2 + (g-tg)**2 + (b-tb)**2) <= (tol**2)
-
-        brown_rgb = (139, 69, 19)
-        green_rgb = (34, 139, 34)
-        trunk = any(o for o in canvas_objects if o.get("pathData", {}).get("tool") == "freehand" and color_close(o.get("color", "#000000"), brown_rgb, tol=120))
-        foliage = any(o for o in canvas_objects if o.get("pathData", {}).get("tool") == "freehand" and color_close(o.get("color", "#000000"), green_rgb, tol=120))
-        if trunk and foliage:
-            return {"label": "tree", "confidence": 0.88, "explanation": "Brown trunk-like stroke plus clustered green freehand strokes resembling foliage."}
 
+def _rule_based_recognize_boxes(canvas_objects: list, boxes: list) -> list:
+    """
+    Rule-based label per box from the objects that overlap it ("empty" when
+    none do), or None where the rules have no answer or the box lacks finite
+    x/y/width/height (nothing is filtered then; the model sees every object).
+    """
+    try:
+        bboxes = _object_bboxes(canvas_objects)
     except Exception:
-        pass
+        return [None] * len(boxes)
 
-    return None
+    results = []
+    for box in boxes:
+        edges = _box_edges(box)
+        if edges is None:
+            results.append(None)
+            continue
+        try:
+            selected = list(itertools.compress(canvas_objects, _box_overlap_mask(bboxes, edges)))
+        except Exception:
+            results.append(None)
+            continue
+        results.append(_rule_based_recognize(selected, box) if selected else _empty_selection())
+    return results
 
 
-def recognize_objects_in_box(canvas_objects: list, box: dict, bounds: dict) -> dict:
-    """Lightweight recognition using OpenAI with Ollama fallback."""
-    try:
-        rule_out = _rule_based_recognize(canvas_objects, box)
-        if isinstance(rule_out, dict):
-            return rule_out
-    except Exception:
-        pass
+def _recognize_boxes_with_model(canvas_objects: list, boxes: list, bounds: dict) -> typing.Union[list, dict]:
+    """One batched model call for ``boxes`` (OpenAI, then Ollama), split in half while the prompt is too large."""
+    if len(boxes) > 1:
+        prompt_chars = sum(len(m["content"]) for m in _get_recognition_batch_message(canvas_objects, boxes, bounds))
+        if prompt_chars > RECOGNITION_BATCH_MAX_CHARS:
+            mid = len(boxes) // 2
+            head = _recognize_boxes_with_model(canvas_objects, boxes[:mid], bounds)
+            if isinstance(head, dict):
+                return head
+            tail = _recognize_boxes_with_model(canvas_objects, boxes[mid:], bounds)
+            if isinstance(tail, dict):
+                return tail
+            return head + tail
+
+    return _hedged(openai_recognize_objects_batch, ollama_recognize_objects_batch, canvas_objects, boxes, bounds)
 
-    model_output = openai_recognize_objects(canvas_objects, box, bounds)
-    if isinstance(model_output, dict) and "error" not in model_output:
+
+def _positive_confidence(result: dict) -> bool:
+    confidence = result.get("confidence")
+    return not isinstance(confidence, (int, float)) or confidence > 0
+
+
+def recognize_objects_in_boxes(canvas_objects: list, boxes: list, bounds: dict) -> typing.Union[list, dict]:
+    """
+    Label several selection boxes with a single model call (OpenAI hedged with
+    Ollama, see _hedged). Boxes the rules can label from the objects
+    overlapping them, or that were recognized before, are answered locally
+    and left out of the model call.
+
+    Returns a list of { label, confidence, explanation } in box order, or an
+    error payload. Batches whose prompt would exceed RECOGNITION_BATCH_MAX_CHARS
+    are split in half and recognized separately.
+    """
+    if not boxes:
+        return []
+    if not canvas_objects:
+        return [_empty_selection() for _ in boxes]
+
+    results = _rule_based_recognize_boxes(canvas_objects, boxes)
+    keys = [None] * len(boxes)
+    if LLM_CACHE_ENABLED:
+        canvas = canvas_digest({"objects": canvas_objects, "bounds": bounds})
+        for i, r in enumerate(results):
+            if r is None:
+                keys[i] = cache_key("recognize", {"canvas": canvas, "box": boxes[i]})
+                cached = _recognition_cache.get(keys[i])
+                if cached is not None:
+                    results[i] = dict(cached)
+
+    pending = [i for i, r in enumerate(results) if r is None]
+    if not pending:
+        return results
+
+    model_output = _recognize_boxes_with_model(canvas_objects, [boxes[i] for i in pending], bounds)
+    if isinstance(model_output, dict):
         return model_output
-    return ollama_recognize_objects(canvas_objects, box, bounds)
+    for i, r in zip(pending, model_output):
+        results[i] = r
+        # Zero confidence includes _parse_batch_results' placeholder for a box
+        # the model skipped; only real answers are remembered.
+        if keys[i] is not None and isinstance(r, dict) and _positive_confidence(r):
+            _recognition_cache.set(keys[i], dict(r))
+    return results
+
+
+def recognize_objects_in_box(canvas_objects: list, box: dict, bounds: dict) -> dict:
+    """
+    Label one selection box: recognize_objects_in_boxes with a single box.
+    Without a usable box (the route's default is {}) the caller has already
+    narrowed canvas_objects, so the rules look at all of them, as the model does.
+    """
+    if canvas_objects and _box_edges(box) is None:
+        try:
+            rule_out = _rule_based_recognize(canvas_objects, box)
+            if isinstance(rule_out, dict):
+                return rule_out
+        except Exception:
+            pass
+    result = recognize_objects_in_boxes(canvas_objects, [box], bounds)
+    return result if isinstance(result, dict) else result[0]
@@ -88,6 +88,9 @@ class FakeRedis:
     def get(self, key):
         return self.kv.get(key)
     
+    def setex(self, key, seconds, value):
+        return self.set(key, value, ex=seconds)
+    
     def delete(self, *keys):
         count = 0
         for key in keys:
@@ -0,0 +1,323 @@
+import pytest
+from unittest.mock import patch
+
+
+@pytest.fixture
+def ai_cache(app, mock_redis):
+    from services.llm_cache import LLMCache
+    with patch('routes.ai_assistant.llm_cache', LLMCache(mock_redis, ttl=60)) as cache:
+        yield cache
+
+
+@pytest.mark.integration
+class TestAIAssistantAPI:
+
+    def test_drawing_requires_prompt(self, client, ai_cache):
+        response = client.post('/api/ai_assistant/drawing', json={})
+
+        assert response.status_code == 400
+        assert response.get_json()['error'] == 'bad_request'
+
+    def test_drawing_second_identical_request_is_cached(self, client, ai_cache):
+        body = {'prompt': 'draw a red circle', 'canvasState': {'drawings': [], 'bounds': {'width': 800, 'height': 600}}}
+        model_output = {'objects': [{'color': '#FF0000', 'lineWidth': 2, 'pathData': {'tool': 'shape', 'type': 'circle'}}]}
+
+        with patch('routes.ai_assistant.prompt_to_drawings', return_value=model_output) as mock_model:
+            first = client.post('/api/ai_assistant/drawing', json=body)
+            second = client.post('/api/ai_assistant/drawing', json=body)
+
+        assert first.status_code == 200
+        assert second.status_code == 200
+        assert second.get_json() == model_output
+        assert mock_model.call_count == 1
+
+    def test_drawing_upstream_error_is_not_cached(self, client, ai_cache):
+        body = {'prompt': 'draw a tree'}
+
+        with patch('routes.ai_assistant.prompt_to_drawings', return_value={'error': 'openai_failed'}) as mock_model:
+            first = client.post('/api/ai_assistant/drawing', json=body)
+            second = client.post('/api/ai_assistant/drawing', json=body)
+
+        assert first.status_code == 502
+        assert second.status_code == 502
+        assert mock_model.call_count == 2
+
+    def test_beautify_rollback_is_not_cached(self, client, ai_cache):
+        body = {'canvasState': {'objects': [{'id': 'a', 'color': '#000000'}]}}
+
+        def rollback(canvas_state):
+            return {'objects': canvas_state['objects'], 'rolledBack': True}
+
+        with patch('routes.ai_assistant.beautify_canvas_state', side_effect=rollback) as mock_model:
+            first = client.post('/api/ai_assistant/beautify', json=body)
+            client.post('/api/ai_assistant/beautify', json=body)
+
+        assert first.get_json() == {'objects': body['canvasState']['objects']}
+        assert mock_model.call_count == 2
+
+    def test_beautify_drawings_rollback_is_not_cached(self, client, ai_cache):
+        body = {'canvasState': {'drawings': [{'id': 'a', 'color': '#000000', 'pathData': {'tool': 'freehand'}}]}}
+        failed = {'error': 'down'}
+
+        with patch('services.llm_service.openai_beautify_canvas', return_value=failed), \
+             patch('services.llm_service.ollama_beautify_canvas', return_value=failed) as mock_ollama:
+            first = client.post('/api/ai_assistant/beautify', json=body)
+            client.post('/api/ai_assistant/beautify', json=body)
+
+        assert first.status_code == 200
+        assert first.get_json() == {'objects': body['canvasState']['drawings']}
+        assert 'ETag' not in first.headers
+        assert mock_ollama.call_count == 2
+
+    @pytest.mark.parametrize('route, target, body', [
+        ('beautify', 'beautify_canvas_state', {'canvasState': {'objects': [{'id': 'a', 'color': '#000000'}]}}),
+        ('style', 'style_transfer_canvas', {'canvasState': {'objects': [{'id': 'a', 'color': '#000000'}]},
+                                            'stylePrompt': 'watercolor'}),
+    ])
+    def test_coalesced_rollback_is_not_cached(self, app, client, ai_cache, route, target, body):
+        import threading
+        import time
+
+        release = threading.Event()
+        responses = []
+
+        def slow_rollback(canvas_state, *args):
+            release.wait(5)
+            return {'objects': canvas_state['objects'], 'rolledBack': True}
+
+        def post():
+            with app.test_client() as c:
+                responses.append(c.post(f'/api/ai_assistant/{route}', json=body))
+
+        with patch(f'routes.ai_assistant.{target}', side_effect=slow_rollback) as mock_model:
+            threads = [threading.Thread(target=post) for _ in range(2)]
+            for t in threads:
+                t.start()
+            time.sleep(0.3)  # let the second request join the first one's upstream call
+            release.set()
+            for t in threads:
+                t.join(10)
+            retry = client.post(f'/api/ai_assistant/{route}', json=body)
+
+        assert [r.status_code for r in responses] == [200, 200]
+        assert all(r.get_json() == {'objects': body['canvasState']['objects']} for r in responses)
+        assert 'ETag' not in retry.headers
+        assert mock_model.call_count == 2
+
+    def test_cache_stats_endpoint(self, client, ai_cache):
+        response = client.get('/api/ai_assistant/cache/stats')
+
+        assert response.status_code == 200
+        data = response.get_json()
+        assert 'hits' in data and 'misses' in data
+
+    def test_slow_upstream_returns_504(self, client, ai_cache):
+        import time
+
+        def slow_model(prompt, canvas_state):
+            time.sleep(0.5)
+            return {'objects': []}
+
+        with patch('routes.ai_assistant.AI_REQUEST_TIMEOUT_SECS', 0.05), \
+             patch('routes.ai_assistant.prompt_to_drawings', side_effect=slow_model):
+            response = client.post('/api/ai_assistant/drawing', json={'prompt': 'draw a slow cat'})
+
+        assert response.status_code == 504
+        assert response.get_json()['error'] == 'upstream_timeout'
+
+    def test_recognize_batches_boxes(self, client, ai_cache):
+        body = {'canvasObjects': [], 'boxes': [{'x': 0, 'y': 0, 'width': 5, 'height': 5}] * 2, 'bounds': {}}
+        labels = [{'label': 'circle'}, {'label': 'car'}]
+
+        with patch('routes.ai_assistant.recognize_objects_in_boxes', return_value=labels) as mock_batch:
+            response = client.post('/api/ai_assistant/recognize', json=body)
+
+        assert response.status_code == 200
+        assert response.get_json() == labels
+        mock_batch.assert_called_once()
+
+    def test_recognize_without_box_looks_at_every_object(self, client, ai_cache):
+        from services import llm_service
+
+        llm_service.clear_cache()
+        stroke = {'color': '#000000', 'pathData': {'tool': 'freehand', 'points': [{'x': 100, 'y': 100}, {'x': 120, 'y': 90}]}}
+        circle = {'color': '#000000', 'pathData': {'tool': 'shape', 'type': 'circle', 'start': {'x': 100, 'y': 100}}}
+
+        with patch.object(llm_service, 'openai_recognize_objects_batch', return_value=[{'label': 'wave'}]) as mock_openai:
+            stroke_response = client.post('/api/ai_assistant/recognize', json={'canvasObjects': [stroke]})
+            circle_response = client.post('/api/ai_assistant/recognize', json={'canvasObjects': [circle]})
+
+        assert stroke_response.status_code == 200
+        assert stroke_response.get_json() == {'label': 'wave'}
+        assert mock_openai.call_args[0][0] == [stroke]
+        assert circle_response.get_json()['label'] == 'circle'
+        mock_openai.assert_called_once()
+        llm_service.clear_cache()
+
+    def test_recognize_rejects_too_many_boxes(self, client, ai_cache):
+        body = {'canvasObjects': [], 'boxes': [{'x': 0, 'y': 0}] * 17}
+
+        response = client.post('/api/ai_assistant/recognize', json=body)
+
+        assert response.status_code == 400
+
+    def test_trivial_requests_skip_the_model(self, client, ai_cache):
+        with patch('routes.ai_assistant.prompt_to_drawings') as mock_draw, \
+             patch('routes.ai_assistant.beautify_canvas_state') as mock_beautify:
+            short = client.post('/api/ai_assistant/drawing', json={'prompt': 'a'})
+            empty = client.post('/api/ai_assistant/beautify', json={'canvasState': {'objects': []}})
+            too_long = client.post('/api/ai_assistant/drawing', json={'prompt': 'x' * 4001})
+
+        assert short.status_code == 200 and short.get_json() == {'objects': []}
+        assert empty.status_code == 200 and empty.get_json() == {'objects': []}
+        assert too_long.status_code == 413
+        mock_draw.assert_not_called()
+        mock_beautify.assert_not_called()
+
+    def test_blocklisted_prompt_is_rejected(self, client, ai_cache):
+        import re
+
+        blocklist = re.compile(r"\b(?:forbidden)\b", re.IGNORECASE)
+        with patch('routes.ai_assistant._blocked_prompt_re', blocklist), \
+             patch('routes.ai_assistant.prompt_to_drawings') as mock_draw:
+            response = client.post('/api/ai_assistant/drawing', json={'prompt': 'draw a Forbidden thing'})
+
+        assert response.status_code == 400
+        mock_draw.assert_not_called()
+
+    def test_drawing_stream_emits_objects_then_done(self, client, ai_cache):
+        objects = [{'color': '#FF0000'}, {'color': '#00FF00'}]
+        body = {'prompt': 'draw two dots'}
+
+        with patch('routes.ai_assistant.prompt_to_drawings_stream', return_value=iter(objects)) as mock_stream:
+            first = client.post('/api/ai_assistant/drawing/stream', json=body)
+            text = first.get_data(as_text=True)
+            second = client.post('/api/ai_assistant/drawing/stream', json=body).get_data(as_text=True)
+
+        assert first.mimetype == 'text/event-stream'
+        assert text == ('data: {"color":"#FF0000"}\n\n'
+                        'data: {"color":"#00FF00"}\n\n'
+                        'event: done\ndata: {"count":2}\n\n')
+        assert second == text
+        mock_stream.assert_called_once()
+
+    def test_drawing_stream_reports_upstream_error(self, client, ai_cache):
+        with patch('routes.ai_assistant.prompt_to_drawings_stream', return_value=iter([{'error': 'stream_failed'}])):
+            text = client.post('/api/ai_assistant/drawing/stream', json={'prompt': 'draw a cat'}).get_data(as_text=True)
+
+        assert text.startswith('event: error\n')
+
+    def test_image_returns_data_url(self, client):
+        png = b'\x89PNG\r\n\x1a\n' + b'\x00' * 16
+
+        with patch('services.image_generation_service.text_to_image', return_value=(png, 'image/png')):
+            response = client.post('/api/ai_assistant/image', json={'prompt': 'a sunset'})
+            binary = client.post('/api/ai_assistant/image?format=binary', json={'prompt': 'a sunset'})
+
+        assert response.status_code == 200
+        assert response.get_json()['imageDataUrl'].startswith('data:image/png;base64,iVBORw0KGgo')
+        assert binary.status_code == 200
+        assert binary.mimetype == 'image/png'
+        assert binary.data == png
+
+    def test_image_requires_prompt(self, client):
+        response = client.post('/api/ai_assistant/image', json={'prompt': ' '})
+
+        assert response.status_code == 400
+
+    def test_saturated_upstream_returns_429(self, client, ai_cache):
+        import threading
+
+        no_slots = threading.BoundedSemaphore(1)
+        no_slots.acquire()
+        with patch('routes.ai_assistant._upstream_slots', no_slots), \
+             patch('routes.ai_assistant.AI_QUEUE_WAIT_SECS', 0.01), \
+             patch('routes.ai_assistant.prompt_to_drawings') as mock_model:
+            response = client.post('/api/ai_assistant/drawing', json={'prompt': 'draw a busy cat'})
+            stream = client.post('/api/ai_assistant/drawing/stream', json={'prompt': 'draw a busy cat'})
+
+        assert response.status_code == 429
+        assert response.get_json()['error'] == 'upstream_busy'
+        assert response.headers['Retry-After'] == '1'
+        assert stream.status_code == 429
+        mock_model.assert_not_called()
+
+    def test_upstream_slot_is_released(self, client, ai_cache):
+        import threading
+
+        slots = threading.BoundedSemaphore(1)
+        with patch('routes.ai_assistant._upstream_slots', slots), \
+             patch('routes.ai_assistant.prompt_to_drawings', return_value={'objects': []}), \
+             patch('routes.ai_assistant.prompt_to_drawings_stream', return_value=iter([{'c': 1}])):
+            client.post('/api/ai_assistant/drawing', json={'prompt': 'draw a first cat'})
+            stream = client.post('/api/ai_assistant/drawing/stream', json={'prompt': 'draw a second cat'})
+            stream.get_data()
+            stream.close()  # the WSGI server does this once the body is sent
+
+            assert slots.acquire(timeout=1)
+
+    def test_concurrent_identical_completions_share_one_call(self, app, ai_cache):
+        import threading
+        import time
+
+        def slow_completion(canvas_state):
+            time.sleep(0.3)
+            return {'complete': True, 'confidence': 0.9}
+
+        # Same strokes, different ids/timestamps: one canonical canvas
+        bodies = [
+            {'canvasState': {'drawings': [{'id': f'd{i}', 'timestamp': i, 'color': '#000000', 'pathData': [{'x': 1, 'y': 2}]}]}}
+            for i in range(3)
+        ]
+        responses = []
+
+        def post(body):
+            responses.append(app.test_client().post('/api/ai_assistant/complete', json=body))
+
+        with patch('routes.ai_assistant.complete_shape_from_canvas', side_effect=slow_completion) as mock_model:
+            threads = [threading.Thread(target=post, args=(body,)) for body in bodies]
+            for t in threads:
+                t.start()
+            for t in threads:
+                t.join()
+
+        assert [r.status_code for r in responses] == [200, 200, 200]
+        assert all(r.get_json() == {'complete': True, 'confidence': 0.9} for r in responses)
+        assert mock_model.call_count == 1
+
+    def test_request_bodies_are_validated(self, client):
+        cases = [
+            ('/api/ai_assistant/drawing', {'prompt': 'draw a cat', 'canvasState': []}, "Invalid 'canvasState'"),
+            ('/api/ai_assistant/image', {'prompt': 'a sunset', 'width': 100000}, "Invalid 'width'"),
+            ('/api/ai_assistant/style', {'canvasState': {}}, "Missing 'stylePrompt'"),
+            ('/api/ai_assistant/complete', {}, "Missing 'canvasState'"),
+            ('/api/ai_assistant/recognize', {'canvasObjects': [1, 2]}, "Invalid 'canvasObjects'"),
+        ]
+
+        for url, body, detail in cases:
+            response = client.post(url, json=body)
+
+            assert response.status_code == 400, url
+            assert response.get_json()['detail'].startswith(detail), url
+
+    def test_responses_carry_etag_and_revalidate(self, client, ai_cache):
+        body = {'prompt': 'draw a red circle'}
+
+        with patch('routes.ai_assistant.prompt_to_drawings', return_value={'objects': [{'color': '#FF0000'}]}) as mock_model:
+            first = client.post('/api/ai_assistant/drawing', json=body)
+            etag = first.headers['ETag']
+            revalidated = client.post('/api/ai_assistant/drawing', json=body, headers={'If-None-Match': etag})
+            other = client.post('/api/ai_assistant/drawing', json={'prompt': 'draw a blue square'},
+                                headers={'If-None-Match': etag})
+
+        assert first.headers['Cache-Control'].startswith('private, max-age=')
+        assert revalidated.status_code == 304
+        assert revalidated.headers['ETag'] == etag
+        assert other.status_code == 200
+        assert mock_model.call_count == 2
+
+    def test_error_responses_have_no_etag(self, client, ai_cache):
+        with patch('routes.ai_assistant.prompt_to_drawings', return_value={'error': 'openai_failed'}):
+            response = client.post('/api/ai_assistant/drawing', json={'prompt': 'draw a tree'})
+
+        assert 'ETag' not in response.headers
@@ -0,0 +1,64 @@
+import datetime
+import json
+
+import pytest
+from flask import Flask
+
+
+@pytest.fixture
+def json_app():
+    from utils.fast_json import OrjsonProvider
+
+    app = Flask(__name__)
+    app.json = OrjsonProvider(app)
+    return app
+
+
+@pytest.mark.unit
+class TestOrjsonProvider:
+
+    def test_dumps_matches_stdlib_semantics(self, json_app):
+        payload = {"b": 1, "a": [1.5, None, "x"], 3: True}
+
+        out = json_app.json.dumps(payload)
+
+        assert json.loads(out) == {"a": [1.5, None, "x"], "b": 1, "3": True}
+        assert out.index('"a"') < out.index('"b"')
+
+    def test_datetimes_use_flask_http_date(self, json_app):
+        when = datetime.datetime(2024, 1, 2, 3, 4, 5, tzinfo=datetime.timezone.utc)
+
+        out = json_app.json.loads(json_app.json.dumps({"when": when}))
+
+        assert out["when"] == "Tue, 02 Jan 2024 03:04:05 GMT"
+
+    def test_unsupported_kwargs_fall_back_to_stdlib(self, json_app):
+        out = json_app.json.dumps({"a": 1}, separators=(", ", ": "))
+
+        assert out == '{"a": 1}'
+
+    def test_jsonify_and_get_json_round_trip(self, json_app):
+        from flask import jsonify, request
+
+        @json_app.route("/echo", methods=["POST"])
+        def echo():
+            return jsonify(request.get_json(silent=True) or {})
+
+        client = json_app.test_client()
+        body = {"objects": [{"pathData": [[1, 2], [3.25, 4]], "color": "#ff0000"}]}
+
+        resp = client.post("/echo", json=body)
+        bad = client.post("/echo", data="{not json", content_type="application/json")
+
+        assert resp.get_json() == body
+        assert bad.get_json() == {}
+
+    def test_helpers_round_trip(self):
+        from utils import fast_json
+
+        text = fast_json.dumps({"a": [1, 2.5]})
+
+        assert fast_json.loads(text) == {"a": [1, 2.5]}
+        assert fast_json.loads(text.encode()) == {"a": [1, 2.5]}
+        with pytest.raises(ValueError):
+            fast_json.loads("{")
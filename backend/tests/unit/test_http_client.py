@@ -0,0 +1,45 @@
+import pytest
+
+
+@pytest.mark.unit
+class TestHttpClient:
+
+    def test_client_is_shared(self):
+        from services.http_client import get_http_client
+
+        assert get_http_client() is get_http_client()
+
+    def test_openai_clients_reuse_pool(self):
+        pytest.importorskip("openai")
+        from unittest.mock import patch
+        import services.image_generation_service as image_service
+        from services.http_client import get_http_client
+
+        with patch.object(image_service, 'OPENAI_API_KEY', 'test-key'), \
+             patch.object(image_service, '_client', None):
+            client = image_service._get_client()
+
+        assert client._client is get_http_client()
+
+    def test_llm_service_client_is_built_once(self):
+        pytest.importorskip("openai")
+        from unittest.mock import patch
+        import services.llm_service as llm_service
+        from services.http_client import get_http_client
+
+        with patch('services.llm_service.OPENAI_API_KEY', 'test-key'), \
+             patch.object(llm_service, '_openai_client', None):
+            client = llm_service._get_openai_client()
+            assert llm_service._get_openai_client() is client
+
+        assert client._client is get_http_client()
+        assert client.max_retries == llm_service.OPENAI_MAX_RETRIES
+
+    def test_llm_service_client_requires_key(self):
+        from unittest.mock import patch
+        import services.llm_service as llm_service
+
+        with patch('services.llm_service.OPENAI_API_KEY', None), \
+             patch.object(llm_service, '_openai_client', None), \
+             pytest.raises(RuntimeError):
+            llm_service._get_openai_client()
@@ -0,0 +1,80 @@
+import base64
+import io
+
+import pytest
+from unittest.mock import MagicMock, patch
+
+
+def _png(width, height):
+    Image = pytest.importorskip("PIL.Image")
+    with io.BytesIO() as buf:
+        Image.new("RGB", (width, height), (255, 0, 0)).save(buf, format="PNG")
+        return buf.getvalue()
+
+
+def _client_returning(png_bytes):
+    client = MagicMock()
+    item = MagicMock(b64_json=base64.b64encode(png_bytes).decode("ascii"))
+    client.images.generate.return_value = MagicMock(data=[item])
+    return client
+
+
+@pytest.mark.unit
+class TestTextToImage:
+
+    def test_png_of_requested_size_is_passed_through(self):
+        import services.image_generation_service as service
+
+        png = _png(64, 32)
+        with patch.object(service, "_get_client", return_value=_client_returning(png)), \
+             patch.object(service.Image, "open") as mock_open:
+            img_bytes, mime = service.text_to_image("a red square", width=64, height=32)
+
+        assert img_bytes == png
+        assert mime == "image/png"
+        mock_open.assert_not_called()
+
+    def test_png_of_other_size_is_resized(self):
+        import services.image_generation_service as service
+
+        with patch.object(service, "_get_client", return_value=_client_returning(_png(64, 64))):
+            img_bytes, mime = service.text_to_image("a red square", width=32, height=16)
+
+        assert service._png_size(img_bytes) == (32, 16)
+
+    def test_placeholder_when_unconfigured(self):
+        import services.image_generation_service as service
+        pytest.importorskip("PIL")
+
+        with patch.object(service, "_get_client", return_value=None):
+            img_bytes, mime = service.text_to_image("anything", width=40, height=20)
+
+        assert mime == "image/png"
+        assert service._png_size(img_bytes) == (40, 20)
+
+    def test_placeholder_is_rendered_once_per_size(self):
+        import services.image_generation_service as service
+        pytest.importorskip("PIL")
+
+        with patch.object(service, "_get_client", return_value=None), \
+             patch.object(service, "_placeholder_cache", {}), \
+             patch.object(service, "_encode_png", wraps=service._encode_png) as mock_encode:
+            first, _ = service.text_to_image("one", width=40, height=20)
+            second, _ = service.text_to_image("two", width=40, height=20)
+            service.text_to_image("three", width=20, height=40)
+
+        assert first == second
+        assert mock_encode.call_count == 2
+
+    def test_placeholder_draws_centered_label(self):
+        import services.image_generation_service as service
+        Image = pytest.importorskip("PIL.Image")
+
+        with patch.object(service, "_placeholder_cache", {}):
+            png = service._placeholder_png(120, 80)
+
+        img = Image.open(io.BytesIO(png)).convert("L")
+        # Some label pixels are darker than the white background, and they sit in the middle
+        xs = [x for x in range(120) for y in range(80) if img.getpixel((x, y)) < 250]
+        assert xs
+        assert 20 < min(xs) and max(xs) < 100
@@ -0,0 +1,307 @@
+import pytest
+from unittest.mock import MagicMock, patch
+
+
+class DictBackend:
+    def __init__(self):
+        self.kv = {}
+        self.ttls = {}
+
+    def get(self, key):
+        return self.kv.get(key)
+
+    def setex(self, key, seconds, value):
+        self.kv[key] = value.encode() if isinstance(value, str) else value
+        self.ttls[key] = seconds
+        return True
+
+
+@pytest.mark.unit
+class TestLLMCache:
+
+    def test_cache_key_is_order_independent(self):
+        from services.llm_cache import cache_key
+
+        a = cache_key("drawing", {"prompt": "cat", "canvasState": {"a": 1, "b": 2}})
+        b = cache_key("drawing", {"canvasState": {"b": 2, "a": 1}, "prompt": "cat"})
+
+        assert a == b
+        assert len(a) == 64
+
+    def test_cache_key_separates_routes(self):
+        from services.llm_cache import cache_key
+
+        payload = {"canvasState": {"objects": []}}
+        assert cache_key("beautify", payload) != cache_key("style", payload)
+
+    def test_get_miss_then_hit(self):
+        from services.llm_cache import LLMCache
+
+        cache = LLMCache(DictBackend(), ttl=60)
+        assert cache.get("k") is None
+
+        assert cache.set("k", {"objects": [{"color": "#FF0000"}]}) is True
+        assert cache.get("k") == {"objects": [{"color": "#FF0000"}]}
+
+        stats = cache.stats()
+        assert stats["hits"] == 1
+        assert stats["misses"] == 1
+        assert stats["hit_rate"] == 0.5
+
+    def test_set_uses_ttl(self):
+        from services.llm_cache import LLMCache, CACHE_KEY_PREFIX
+
+        backend = DictBackend()
+        LLMCache(backend, ttl=123).set("k", {"ok": True})
+
+        assert backend.ttls[f"{CACHE_KEY_PREFIX}:k"] == 123
+
+    def test_error_payloads_are_not_cached(self):
+        from services.llm_cache import LLMCache
+
+        backend = DictBackend()
+        cache = LLMCache(backend)
+
+        assert cache.set("k", {"error": "openai_failed"}) is False
+        assert backend.kv == {}
+
+    def test_backend_failure_degrades_to_miss(self):
+        from services.llm_cache import LLMCache
+
+        backend = MagicMock()
+        backend.get.side_effect = ConnectionError("redis down")
+        backend.setex.side_effect = ConnectionError("redis down")
+        cache = LLMCache(backend)
+
+        assert cache.get("k") is None
+        assert cache.set("k", {"objects": []}) is False
+        assert cache.stats()["errors"] == 2
+
+
+@pytest.mark.unit
+class TestCanonicalizeCanvas:
+
+    def test_ignores_ids_timestamps_and_order(self):
+        from services.llm_cache import canonicalize_canvas
+
+        a = {"drawings": [
+            {"drawingId": "d1", "timestamp": 1, "color": "#FF0000", "lineWidth": 2, "pathData": {"type": "circle"}},
+            {"drawingId": "d2", "timestamp": 2, "color": "#0000FF", "lineWidth": 3, "pathData": {"type": "line"}},
+        ], "bounds": {"width": 800, "height": 600}}
+        b = {"bounds": {"height": 600, "width": 800}, "drawings": [
+            {"drawingId": "x9", "timestamp": 99, "color": "#0000FF", "lineWidth": 3, "pathData": {"type": "line"}},
+            {"drawingId": "x8", "timestamp": 98, "color": "#FF0000", "lineWidth": 2, "pathData": {"type": "circle"}},
+        ]}
+
+        assert canonicalize_canvas(a) == canonicalize_canvas(b)
+
+    def test_rounds_coordinate_noise(self):
+        from services.llm_cache import canonicalize_canvas
+
+        a = {"objects": [{"pathData": {"points": [{"x": 10.001, "y": 20.0}]}}]}
+        b = {"objects": [{"pathData": {"points": [{"x": 10, "y": 19.999}]}}]}
+
+        assert canonicalize_canvas(a) == canonicalize_canvas(b)
+
+    def test_different_geometry_differs(self):
+        from services.llm_cache import canvas_digest
+
+        a = {"objects": [{"color": "#FF0000", "pathData": {"start": {"x": 1, "y": 1}}}]}
+        b = {"objects": [{"color": "#FF0000", "pathData": {"start": {"x": 5, "y": 1}}}]}
+
+        assert canvas_digest(a) != canvas_digest(b)
+
+    def test_fields_shown_to_the_model_differ(self):
+        from services.llm_cache import canvas_digest
+
+        a = {"objects": [{"color": "#FF0000", "brushStyle": "round", "pathData": {"tool": "freehand"}}]}
+        b = {"objects": [{"color": "#FF0000", "brushStyle": "square", "pathData": {"tool": "freehand"}}]}
+
+        assert canvas_digest(a) != canvas_digest(b)
+
+    def test_non_dict_state(self):
+        from services.llm_cache import canonicalize_canvas
+
+        assert canonicalize_canvas(None) == b"{}"
+
+
+def _bag_of_words(text):
+    import numpy as np
+    vocab = ["draw", "make", "red", "blue", "circle", "square", "a"]
+    words = text.lower().split()
+    return np.array([1.0 if w in words else 0.0 for w in vocab] + [0.1], dtype=np.float32)
+
+
+@pytest.mark.unit
+class TestSemanticCache:
+
+    def test_paraphrase_hits_on_same_canvas(self):
+        pytest.importorskip("numpy")
+        from services.llm_cache import SemanticCache
+
+        cache = SemanticCache(embed=_bag_of_words, threshold=0.7)
+        cache.add("draw a red circle", "canvas-1", {"objects": [1]})
+
+        assert cache.get("make a red circle", "canvas-1") == {"objects": [1]}
+
+    def test_never_crosses_canvases(self):
+        pytest.importorskip("numpy")
+        from services.llm_cache import SemanticCache
+
+        cache = SemanticCache(embed=_bag_of_words, threshold=0.7)
+        cache.add("draw a red circle", "canvas-1", {"objects": [1]})
+
+        assert cache.get("draw a red circle", "canvas-2") is None
+
+    def test_dissimilar_prompt_misses(self):
+        pytest.importorskip("numpy")
+        from services.llm_cache import SemanticCache
+
+        cache = SemanticCache(embed=_bag_of_words, threshold=0.92)
+        cache.add("draw a red circle", "canvas-1", {"objects": [1]})
+
+        assert cache.get("draw a blue square", "canvas-1") is None
+
+    def test_ring_buffer_evicts_oldest(self):
+        pytest.importorskip("numpy")
+        from services.llm_cache import SemanticCache
+
+        cache = SemanticCache(embed=_bag_of_words, threshold=0.99, max_entries=2)
+        cache.add("draw a red circle", "c", {"n": 1})
+        cache.add("draw a blue circle", "c", {"n": 2})
+        cache.add("draw a red square", "c", {"n": 3})
+
+        assert cache.get("draw a red circle", "c") is None
+        assert cache.get("draw a red square", "c") == {"n": 3}
+        assert cache.stats()["entries"] == 2
+
+    def test_expired_entries_miss(self):
+        pytest.importorskip("numpy")
+        from services.llm_cache import SemanticCache
+
+        cache = SemanticCache(embed=_bag_of_words, threshold=0.7, ttl=60)
+        cache.add("draw a red circle", "c", {"objects": [1]})
+
+        assert cache.get("draw a red circle", "c") == {"objects": [1]}
+        with patch("services.llm_cache.time.time", return_value=10**12):
+            assert cache.get("draw a red circle", "c") is None
+
+    def test_save_and_load_roundtrip(self, tmp_path):
+        pytest.importorskip("numpy")
+        from services.llm_cache import SemanticCache
+
+        path = str(tmp_path / "semantic")
+        cache = SemanticCache(embed=_bag_of_words, threshold=0.7, index_path=path)
+        cache.add("draw a red circle", "c", {"objects": [1]})
+        cache.save()
+
+        restored = SemanticCache(embed=_bag_of_words, threshold=0.7, index_path=path)
+        assert restored.get("make a red circle", "c") == {"objects": [1]}
+
+    def test_unavailable_without_embedder(self):
+        from services.llm_cache import SemanticCache
+
+        cache = SemanticCache(embed=None)
+        cache._embed_loaded = True
+
+        assert cache.available is False
+        assert cache.get("draw a red circle", "c") is None
+        assert cache.add("draw a red circle", "c", {"objects": []}) is False
+
+    def test_embedder_loads_once_for_concurrent_callers(self):
+        pytest.importorskip("numpy")
+        import threading
+        import time
+        from services.llm_cache import SemanticCache
+
+        loads = []
+
+        def slow_load(model_name):
+            loads.append(model_name)
+            time.sleep(0.2)
+            return _bag_of_words
+
+        cache = SemanticCache(embed=None)
+        seen = []
+        with patch("services.llm_cache._sentence_transformer_embedder", side_effect=slow_load):
+            threads = [threading.Thread(target=lambda: seen.append(cache.available)) for _ in range(4)]
+            for t in threads:
+                t.start()
+            for t in threads:
+                t.join(5)
+
+        assert seen == [True] * 4
+        assert len(loads) == 1
+
+
+@pytest.mark.unit
+class TestRunOrJoin:
+
+    def test_concurrent_callers_share_one_call(self):
+        import threading
+        import time
+        from services.llm_cache import run_or_join, _inflight
+
+        started = threading.Event()
+        release = threading.Event()
+        calls = []
+
+        def slow_model(prompt):
+            calls.append(prompt)
+            started.set()
+            release.wait(5)
+            return {"objects": [prompt]}
+
+        results = []
+        leader = threading.Thread(target=lambda: results.append(run_or_join("k", slow_model, "cat")))
+        leader.start()
+        started.wait(5)
+        followers = [threading.Thread(target=lambda: results.append(run_or_join("k", slow_model, "cat"))) for _ in range(3)]
+        for t in followers:
+            t.start()
+        time.sleep(0.2)  # let the followers reach run_or_join while the leader is blocked
+        release.set()
+        for t in [leader] + followers:
+            t.join(5)
+
+        assert calls == ["cat"]
+        assert results == [{"objects": ["cat"]}] * 4
+        assert "k" not in _inflight
+
+    def test_exception_is_shared_and_entry_cleared(self):
+        from services.llm_cache import run_or_join, _inflight
+
+        def boom():
+            raise RuntimeError("upstream down")
+
+        with pytest.raises(RuntimeError):
+            run_or_join("k", boom)
+
+        assert "k" not in _inflight
+        assert run_or_join("k", lambda: 42) == 42
+
+
+@pytest.mark.unit
+class TestTTLCache:
+
+    def test_lru_eviction(self):
+        from services.llm_cache import TTLCache
+
+        cache = TTLCache(maxsize=2, ttl=60)
+        cache.set("a", 1)
+        cache.set("b", 2)
+        cache.get("a")
+        cache.set("c", 3)
+
+        assert cache.get("a") == 1
+        assert cache.get("b") is None
+        assert cache.get("c") == 3
+
+    def test_entries_expire(self):
+        from services.llm_cache import TTLCache
+
+        cache = TTLCache(maxsize=2, ttl=60)
+        cache.set("a", 1)
+        with patch("services.llm_cache.time.monotonic", return_value=10**9):
+            assert cache.get("a") is None
+        assert len(cache) == 0
@@ -0,0 +1,980 @@
+import pytest
+from unittest.mock import patch
+
+
+@pytest.fixture(autouse=True)
+def clear_llm_caches():
+    """Recognition results are memoized per canvas and box; start every test cold."""
+    from services import llm_service
+    llm_service.clear_cache()
+    yield
+    llm_service.clear_cache()
+
+
+@pytest.mark.unit
+class TestBatchRecognition:
+
+    OBJECTS = [{"id": "s1", "color": "#000000", "pathData": {"tool": "freehand"}}]
+
+    def test_parse_batch_results_orders_by_index(self):
+        from services.llm_service import _parse_batch_results
+
+        parsed = {"results": [
+            {"index": 1, "label": "car", "confidence": 0.9},
+            {"index": 0, "label": "tree", "confidence": 0.8},
+        ]}
+
+        results = _parse_batch_results(parsed, 3)
+
+        assert results[0]["label"] == "tree"
+        assert results[1]["label"] == "car"
+        assert results[2] == {"label": "unknown", "confidence": 0.0}
+
+    def test_parse_batch_results_requires_results_list(self):
+        from services.llm_service import _parse_batch_results
+
+        with pytest.raises(ValueError):
+            _parse_batch_results({"label": "tree"}, 1)
+
+    def test_empty_selection_skips_the_models(self):
+        from services import llm_service
+
+        box = {"x": 0, "y": 0, "width": 10, "height": 10}
+
+        with patch.object(llm_service, 'openai_recognize_objects_batch') as mock_batch:
+            single = llm_service.recognize_objects_in_box([], box, {})
+            batch = llm_service.recognize_objects_in_boxes([], [box, box], {})
+
+        mock_batch.assert_not_called()
+        assert single["label"] == "empty"
+        assert [r["label"] for r in batch] == ["empty", "empty"]
+
+    def test_single_box_uses_the_batch_prompt(self):
+        from services import llm_service
+
+        box = {"x": 0, "y": 0, "width": 10, "height": 10}
+
+        with patch.object(llm_service, 'openai_recognize_objects_batch', return_value=[{"label": "boat"}]) as mock_batch:
+            result = llm_service.recognize_objects_in_box(self.OBJECTS, box, {})
+
+        assert result == {"label": "boat"}
+        assert mock_batch.call_args[0][1] == [box]
+
+    @pytest.mark.parametrize("use_numpy", [True, False])
+    def test_boxes_the_rules_can_label_skip_the_model(self, use_numpy):
+        from services import llm_service
+
+        objects = [
+            {"color": "#000000", "pathData": {"tool": "shape", "type": "circle",
+                                              "start": {"x": 20.5, "y": 20}, "end": {"x": 30, "y": 20}}},
+            {"color": "#000000", "pathData": {"tool": "freehand", "points": [{"x": 200, "y": 200}, {"x": 240, "y": 260}]}},
+        ]
+        boxes = [
+            {"x": 0, "y": 0, "width": 40, "height": 40},
+            {"x": 220.5, "y": 250, "width": 100, "height": 100},
+            {"x": 500, "y": 500, "width": 10, "height": 10},
+        ]
+
+        with patch.object(llm_service, "np", llm_service.np if use_numpy else None), \
+             patch.object(llm_service, 'openai_recognize_objects_batch', return_value=[{"label": "line"}]) as mock_openai:
+            result = llm_service.recognize_objects_in_boxes(objects, boxes, {})
+
+        assert [r["label"] for r in result] == ["circle", "line", "empty"]
+        assert mock_openai.call_args[0][1] == [boxes[1]]
+
+    def test_box_without_coordinates_goes_to_the_model(self):
+        from services import llm_service
+
+        objects = [{"color": "#000000", "pathData": {"tool": "freehand", "points": [{"x": 100, "y": 100}]}}]
+        boxes = [{}, {"x": 0, "y": 0}, {"x": "0", "y": 0, "width": 10, "height": 10},
+                 {"x": 0, "y": 0, "width": float("nan"), "height": 10}]
+
+        with patch.object(llm_service, 'openai_recognize_objects_batch',
+                          return_value=[{"label": "dot"}] * len(boxes)) as mock_openai:
+            result = llm_service.recognize_objects_in_boxes(objects, boxes, {})
+
+        assert [r["label"] for r in result] == ["dot"] * len(boxes)
+        assert mock_openai.call_args[0][1] == boxes
+
+    def test_single_call_for_all_boxes(self):
+        from services import llm_service
+
+        boxes = [{"x": 0, "y": 0, "width": 10, "height": 10}, {"x": 20, "y": 0, "width": 10, "height": 10}]
+        labels = [{"label": "circle"}, {"label": "house"}]
+
+        with patch.object(llm_service, 'openai_recognize_objects_batch', return_value=labels) as mock_openai, \
+             patch.object(llm_service, 'ollama_recognize_objects_batch') as mock_ollama:
+            result = llm_service.recognize_objects_in_boxes(self.OBJECTS, boxes, {"width": 100, "height": 100})
+
+        assert result == labels
+        mock_openai.assert_called_once()
+        mock_ollama.assert_not_called()
+
+    def test_oversized_batch_is_split(self):
+        from services import llm_service
+
+        boxes = [{"x": i, "y": 0, "width": 1, "height": 1} for i in range(4)]
+
+        def fake_batch(objects, chunk, bounds):
+            return [{"label": f"box-{b['x']}"} for b in chunk]
+
+        with patch.object(llm_service, 'RECOGNITION_BATCH_MAX_CHARS', 1), \
+             patch.object(llm_service, 'openai_recognize_objects_batch', side_effect=fake_batch) as mock_openai:
+            result = llm_service.recognize_objects_in_boxes(self.OBJECTS, boxes, {})
+
+        assert [r["label"] for r in result] == ["box-0", "box-1", "box-2", "box-3"]
+        assert mock_openai.call_count == 4
+
+    def test_falls_back_to_ollama(self):
+        from services import llm_service
+
+        with patch.object(llm_service, 'openai_recognize_objects_batch', return_value={"error": "openai_recognition_failed"}), \
+             patch.object(llm_service, 'ollama_recognize_objects_batch', return_value=[{"label": "tree"}]):
+            result = llm_service.recognize_objects_in_boxes(self.OBJECTS, [{"x": 0, "y": 0}], {})
+
+        assert result == [{"label": "tree"}]
+
+
+def _canvas_obj(color="#000000", **path):
+    return {"color": color, "pathData": path}
+
+
+@pytest.mark.unit
+class TestRuleBasedRecognize:
+
+    BOX = {"x": 0, "y": 0, "width": 100, "height": 100}
+
+    @pytest.mark.parametrize("objects,label", [
+        ([_canvas_obj(tool="shape", type="circle")], "circle"),
+        ([_canvas_obj(tool="shape", type="text", text="hi")], "text: 'hi'"),
+        ([_canvas_obj(tool="shape", type="rectangle"), _canvas_obj(tool="shape", type="circle"),
+          _canvas_obj(tool="shape", type="circle")], "car"),
+        ([_canvas_obj(tool="shape", type="rectangle"),
+          _canvas_obj(tool="shape", type="polygon", points=[{}, {}, {}])], "house"),
+        ([_canvas_obj("#8B4513", tool="freehand"), _canvas_obj("#228B22", tool="freehand")], "tree"),
+    ])
+    def test_obvious_scenes(self, objects, label):
+        from services.llm_service import _rule_based_recognize
+
+        assert _rule_based_recognize(objects, self.BOX)["label"] == label
+
+    @pytest.mark.parametrize("use_numpy", [True, False])
+    def test_tree_colors_with_and_without_numpy(self, use_numpy):
+        from services import llm_service
+
+        tree = [_canvas_obj("#000000", tool="shape", type="line"),
+                _canvas_obj("#A0522D", tool="freehand"), _canvas_obj("#2E8B57", tool="freehand")]
+        not_tree = [_canvas_obj("#A0522D", tool="freehand"), _canvas_obj("#2E8B57", tool="shape", type="line")]
+
+        with patch.object(llm_service, "np", llm_service.np if use_numpy else None):
+            assert llm_service._rule_based_recognize(tree, self.BOX)["label"] == "tree"
+            assert llm_service._rule_based_recognize(not_tree, self.BOX) is None
+
+    @pytest.mark.parametrize("use_numpy", [True, False])
+    def test_freehand_color_filter(self, use_numpy):
+        from services import llm_service
+
+        objects = [_canvas_obj("#8B4513", tool="freehand"), _canvas_obj("#0000FF", tool="freehand"),
+                   _canvas_obj("#228B22", tool="shape", type="line"), _canvas_obj("#FFA500")]
+
+        with patch.object(llm_service, "np", llm_service.np if use_numpy else None):
+            features = llm_service._extract_features(objects)
+            present = [name for i, name in enumerate(llm_service.BASIC_COLOR_NAMES)
+                       if llm_service._has_freehand_color(features, i)]
+
+        assert present == ["blue", "brown"]
+
+    def test_features_are_extracted_once(self):
+        from services import llm_service
+
+        objects = [_canvas_obj("#8B4513", tool="freehand"), _canvas_obj("#228B22", tool="freehand"),
+                   _canvas_obj(tool="shape", type="polygon", points=[{}, {}])]
+
+        with patch.object(llm_service, "_extract_features", wraps=llm_service._extract_features) as extract:
+            assert llm_service._rule_based_recognize(objects, self.BOX)["label"] == "tree"
+
+        assert extract.call_count == 1
+        features = llm_service._extract_features(objects)
+        assert features["type"] == [None, None, "polygon"]
+        assert features["n_points"] == [0, 0, 2]
+        assert list(features["freehand"]) == [True, True, False]
+
+    def test_missing_or_non_dict_path_data(self):
+        from services.llm_service import _extract_features
+
+        features = _extract_features([{"color": "#000000"}, {"pathData": [{"x": 1, "y": 2}]}, {"pathData": None}])
+
+        assert features["type"] == features["tool"] == features["text"] == [None, None, None]
+        assert features["n_points"] == [0, 0, 0]
+
+    @pytest.mark.parametrize("use_numpy", [True, False])
+    def test_colors_are_packed(self, use_numpy):
+        from services import llm_service
+
+        objects = [_canvas_obj("#8B4513"), _canvas_obj("#fff"), _canvas_obj("0x1234"),
+                   _canvas_obj("#228b22ff"), _canvas_obj(None), {"pathData": {}}]
+
+        with patch.object(llm_service, "np", llm_service.np if use_numpy else None):
+            features = llm_service._extract_features(objects)
+
+        assert [int(c) for c in features["rgb"]] == [0x8B4513, 0xFFFFFF, 0, 0x228B22, 0, 0]
+        names = [llm_service.BASIC_COLOR_NAMES[int(n)] for n in features["color_name"]]
+        assert names == ["brown", "white", "black", "green", "black", "black"]
+
+    def test_color_table_matches_without_numpy(self):
+        from services import llm_service
+
+        if llm_service.np is None:
+            pytest.skip("numpy not installed")
+        vectorized = llm_service._color_name_lut.__wrapped__()
+        with patch.object(llm_service, "np", None):
+            scalar = llm_service._color_name_lut.__wrapped__()
+
+        assert len(vectorized) == 4096
+        assert vectorized == scalar
+
+    @pytest.mark.parametrize("color,name", [
+        ("#8B4513", "brown"), ("#A0522D", "brown"), ("#654321", "brown"),
+        ("#228B22", "green"), ("#90EE90", "green"), ("#006400", "green"),
+        ("#C82828", "red"), ("#008080", "grey"), ("#FFA500", "orange"),
+    ])
+    def test_colors_are_named_perceptually(self, color, name):
+        from services.llm_service import BASIC_COLOR_NAMES, _extract_features
+
+        features = _extract_features([_canvas_obj(color, tool="freehand")])
+
+        assert BASIC_COLOR_NAMES[int(features["color_name"][0])] == name
+
+    @pytest.mark.parametrize("objects", [
+        [_canvas_obj("#8B4513", tool="freehand")],
+        [_canvas_obj("#8B4513", tool="freehand"), _canvas_obj("#0000FF", tool="freehand")],
+        [_canvas_obj("#C82828", tool="freehand"), _canvas_obj("#008080", tool="freehand")],
+        [_canvas_obj("#8B4513", tool="freehand"), _canvas_obj("#228B22", tool="shape", type="line")],
+        [_canvas_obj(None, tool="freehand"), _canvas_obj(["bad"], tool="freehand")],
+        [],
+    ])
+    def test_anything_else_is_left_to_the_model(self, objects):
+        from services.llm_service import _rule_based_recognize
+
+        assert _rule_based_recognize(objects, self.BOX) is None
+
+
+@pytest.mark.unit
+class TestDrawingStream:
+
+    def test_objects_are_emitted_as_they_complete(self):
+        import json
+        from services.llm_service import _iter_stream_objects
+
+        doc = json.dumps({"objects": [
+            {"color": "#FF0000", "pathData": {"type": "text", "text": "a}\"{b"}},
+            {"color": "#0000FF", "pathData": {"points": [{"x": 1, "y": 2}]}},
+        ]})
+        chunks = [doc[i:i + 5] for i in range(0, len(doc), 5)]
+
+        objects = list(_iter_stream_objects(chunks))
+
+        assert [o["color"] for o in objects] == ["#FF0000", "#0000FF"]
+        assert objects[0]["pathData"]["text"] == "a}\"{b"
+
+    def test_falls_back_to_ollama_before_first_object(self):
+        from services.llm_service import prompt_to_drawings_stream
+
+        def broken(prompt, canvas_state):
+            raise RuntimeError("no key")
+            yield  # pragma: no cover
+
+        with patch('services.llm_service._openai_drawing_chunks', side_effect=broken), \
+             patch('services.llm_service._ollama_drawing_chunks', return_value=iter(['{"objects":[{"c":1}', ']}'])):
+            items = list(prompt_to_drawings_stream("draw", {}))
+
+        assert items == [{"c": 1}]
+
+    def test_error_after_partial_output_is_final_item(self):
+        from services.llm_service import prompt_to_drawings_stream
+
+        def partial(prompt, canvas_state):
+            yield '{"objects":[{"c":1},'
+            raise RuntimeError("connection reset")
+
+        with patch('services.llm_service._openai_drawing_chunks', side_effect=partial), \
+             patch('services.llm_service._ollama_drawing_chunks') as mock_ollama:
+            items = list(prompt_to_drawings_stream("draw", {}))
+
+        assert items[0] == {"c": 1}
+        assert items[1]["error"] == "openai_stream_failed"
+        mock_ollama.assert_not_called()
+
+
+@pytest.mark.unit
+class TestCompactCanvas:
+
+    def test_drops_metadata_and_rounds_path(self):
+        from services.llm_service import compact_canvas
+
+        state = {
+            "drawings": [{
+                "drawingId": "d1", "timestamp": 123, "user": "alice", "order": 123,
+                "color": "#000000", "lineWidth": 2.5, "opacity": 0.5, "stampData": None,
+                "pathData": [{"x": 1.2, "y": 2.4}, {"x": 0.9, "y": 2.1}, {"x": 5.6, "y": 2.0}],
+            }],
+            "bounds": {"width": 800, "height": 600},
+        }
+
+        compact = compact_canvas(state)
+
+        assert compact["drawings"] == [{
+            "color": "#000000", "lineWidth": 2.5, "opacity": 0.5,
+            "pathData": [{"x": 1, "y": 2}, {"x": 6, "y": 2}],
+        }]
+        assert compact["bounds"] == {"width": 800, "height": 600}
+        assert state["drawings"][0]["drawingId"] == "d1"
+
+    def test_keep_ids_for_echoing_routes(self):
+        from services.llm_service import compact_canvas
+
+        state = {"objects": [{"id": "a", "pathData": {"start": {"x": 0.4, "y": 0}, "end": {"x": 9.6, "y": 1}}}]}
+
+        compact = compact_canvas(state, keep_ids=True)
+
+        assert compact["objects"] == [{"id": "a", "pathData": {"start": {"x": 0, "y": 0}, "end": {"x": 10, "y": 1}}}]
+
+    @pytest.mark.parametrize("use_numpy", [True, False])
+    def test_simplify_thins_long_strokes(self, use_numpy):
+        import math
+        from services import llm_service
+
+        line = [{"x": i, "y": 2 * i} for i in range(200)]
+        circle = [{"x": 500 + 300 * math.cos(t / 100), "y": 500 + 300 * math.sin(t / 100)} for t in range(600)]
+        zigzag = [{"x": i, "y": 10 * (i % 2)} for i in range(300)]
+        short = [{"x": i, "y": i * i} for i in range(10)]
+        state = {"drawings": [
+            {"pathData": line}, {"pathData": {"points": circle}}, {"pathData": zigzag}, {"pathData": short},
+        ]}
+
+        with patch.object(llm_service, "np", llm_service.np if use_numpy else None):
+            compact = llm_service.compact_canvas(state, simplify=True)
+
+        drawings = compact["drawings"]
+        assert drawings[0]["pathData"] == [{"x": 0, "y": 0}, {"x": 199, "y": 398}]
+        assert 8 < len(drawings[1]["pathData"]["points"]) < 64
+        assert drawings[1]["pathData"]["points"][0] == {"x": 800, "y": 500}
+        assert len(drawings[2]["pathData"]) == llm_service.SIMPLIFY_MAX_POINTS
+        assert drawings[2]["pathData"][-1] == {"x": 299, "y": 10}
+        assert drawings[3]["pathData"] == short
+        assert len(llm_service.compact_canvas(state)["drawings"][0]["pathData"]) == 200
+
+    def test_beautify_rollback_returns_original_objects(self):
+        from services.llm_service import beautify_canvas_state
+
+        state = {"objects": [{"id": "a", "pathData": [{"x": 0.5, "y": 0.5}]}]}
+        failed = {"error": "down"}
+
+        with patch('services.llm_service.openai_beautify_canvas', return_value=failed) as mock_openai, \
+             patch('services.llm_service.ollama_beautify_canvas', return_value=failed):
+            result = beautify_canvas_state(state)
+
+        assert result["objects"] is state["objects"]
+        assert result["rolledBack"] is True
+        assert mock_openai.call_args[0][0]["objects"][0]["pathData"] == [{"x": 0, "y": 0}]
+
+    def test_rollback_of_drawings_only_canvas(self):
+        from services.llm_service import beautify_canvas_state, style_transfer_canvas
+
+        state = {"drawings": [{"id": "a", "color": "#000000"}]}
+        failed = {"error": "down"}
+
+        with patch('services.llm_service.openai_beautify_canvas', return_value=failed), \
+             patch('services.llm_service.ollama_beautify_canvas', return_value=failed), \
+             patch('services.llm_service.openai_style_transfer', return_value=failed), \
+             patch('services.llm_service.ollama_style_transfer', return_value=failed):
+            beautified = beautify_canvas_state(state)
+            styled = style_transfer_canvas(state, "watercolor")
+
+        assert beautified == styled == {"objects": state["drawings"], "rolledBack": True}
+
+
+@pytest.mark.unit
+class TestResponseMemo:
+
+    def _client(self, content):
+        from unittest.mock import MagicMock
+
+        client = MagicMock()
+        client.chat.completions.create.return_value.choices = [MagicMock(message=MagicMock(content=content))]
+        return client
+
+    def test_identical_requests_hit_the_api_once(self):
+        from services.llm_service import _create_json_completion, clear_cache
+
+        clear_cache()
+        client = self._client('{"objects": [1]}')
+        request = {"model": "m", "temperature": 0.1, "messages": [{"role": "user", "content": "x"}]}
+
+        first = _create_json_completion(client, **request)
+        first["objects"].append(2)
+        second = _create_json_completion(client, **request)
+
+        assert second == {"objects": [1]}
+        assert client.chat.completions.create.call_count == 1
+        clear_cache()
+
+    def test_sampled_requests_are_not_memoized(self):
+        from services.llm_service import _create_json_completion, clear_cache
+
+        clear_cache()
+        client = self._client('{"objects": []}')
+        request = {"model": "m", "temperature": 0.9, "messages": []}
+
+        _create_json_completion(client, **request)
+        _create_json_completion(client, **request)
+
+        assert client.chat.completions.create.call_count == 2
+
+    def test_recognition_results_are_memoized(self):
+        from services import llm_service
+
+        llm_service.clear_cache()
+        box = {"x": 0, "y": 0, "width": 10, "height": 10}
+        first = [{"id": "a", "color": "#000000", "pathData": {"tool": "freehand", "points": [{"x": 1.0, "y": 2.0}]}}]
+        same = [{"id": "b", "color": "#000000", "pathData": {"tool": "freehand", "points": [{"x": 1.001, "y": 2.0}]}}]
+
+        with patch.object(llm_service, "openai_recognize_objects_batch", side_effect=[
+            {"error": "openai_failed"}, [{"label": "dot"}], [{"label": "dot"}],
+        ]) as mock_openai, patch.object(llm_service, "ollama_recognize_objects_batch", return_value={"error": "down"}), \
+             patch.object(llm_service, "LLM_HEDGE_DELAY_SECS", -1):
+            assert "error" in llm_service.recognize_objects_in_box(first, box, {})
+            assert llm_service.recognize_objects_in_box(first, box, {}) == {"label": "dot"}
+            assert llm_service.recognize_objects_in_box(same, box, {}) == {"label": "dot"}
+            assert llm_service.recognize_objects_in_boxes(same, [box], {}) == [{"label": "dot"}]
+            llm_service.recognize_objects_in_box(first, {**box, "width": 5}, {})
+
+        assert mock_openai.call_count == 3
+        llm_service.clear_cache()
+
+    def test_skipped_boxes_are_not_memoized(self):
+        from services import llm_service
+
+        objects = [{"color": "#000000", "pathData": {"tool": "freehand", "points": [{"x": 1, "y": 1}, {"x": 30, "y": 1}]}}]
+        boxes = [{"x": 0, "y": 0, "width": 10, "height": 10}, {"x": 20, "y": 0, "width": 10, "height": 10}]
+        replies = [{"results": [{"index": 0, "label": "dot", "confidence": 0.8}]},
+                   {"results": [{"index": 0, "label": "line", "confidence": 0.7}]}]
+
+        with patch.object(llm_service, "openai_recognize_objects_batch",
+                          side_effect=lambda o, chunk, b: llm_service._parse_batch_results(replies.pop(0), len(chunk))) as mock_openai:
+            first = llm_service.recognize_objects_in_boxes(objects, boxes, {})
+            second = llm_service.recognize_objects_in_boxes(objects, boxes, {})
+
+        assert first[1] == {"label": "unknown", "confidence": 0.0}
+        assert second == [{"label": "dot", "confidence": 0.8}, {"label": "line", "confidence": 0.7}]
+        assert mock_openai.call_args[0][1] == [boxes[1]]
+
+    def test_concurrent_calls_are_capped(self):
+        import threading
+        import time
+        from services import llm_service
+
+        active, peak = [0], [0]
+        lock = threading.Lock()
+
+        def create(**request):
+            with lock:
+                active[0] += 1
+                peak[0] = max(peak[0], active[0])
+            time.sleep(0.02)
+            with lock:
+                active[0] -= 1
+            return self._client('{"objects": []}').chat.completions.create()
+
+        client = self._client("")
+        client.chat.completions.create.side_effect = create
+        with patch.object(llm_service, "_openai_slots", threading.BoundedSemaphore(2)):
+            threads = [
+                threading.Thread(target=llm_service._create_json_completion,
+                                 args=(client,), kwargs={"model": "m", "temperature": 0.9, "messages": []})
+                for _ in range(6)
+            ]
+            for t in threads:
+                t.start()
+            for t in threads:
+                t.join()
+
+        assert client.chat.completions.create.call_count == 6
+        assert peak[0] == 2
+
+    def test_disk_tier_survives_a_cleared_memo(self):
+        from services import llm_service
+
+        class FakeDisk(dict):
+            def set(self, key, value, expire=None):
+                self[key] = value
+
+        disk = FakeDisk()
+        client = self._client('{"objects": [1]}')
+        request = {"model": "m", "temperature": 0.1, "messages": [{"role": "user", "content": "x"}]}
+
+        with patch.object(llm_service, "_get_disk_cache", return_value=disk):
+            llm_service._create_json_completion(client, **request)
+            llm_service._response_cache.clear()  # simulate a restart
+            result = llm_service._create_json_completion(client, **request)
+            llm_service.clear_cache()
+
+        assert result == {"objects": [1]}
+        assert client.chat.completions.create.call_count == 1
+        assert not disk
+
+
+@pytest.mark.unit
+class TestOutputBudget:
+
+    def test_budget_scales_with_prompt_and_canvas(self):
+        from services.llm_service import _estimate_output_tokens, DRAWING_MAX_TOKENS
+
+        short = _estimate_output_tokens("a red circle", {"drawings": []})
+        longer = _estimate_output_tokens("a red circle next to a tall house with two windows", {"drawings": [{}] * 20})
+
+        assert short < longer < DRAWING_MAX_TOKENS
+        assert _estimate_output_tokens("word " * 500, {}) == DRAWING_MAX_TOKENS
+
+    def test_truncated_reply_is_retried_with_full_cap(self):
+        pytest.importorskip("openai")
+        from services.llm_service import openai_prompt_to_json, DRAWING_MAX_TOKENS
+
+        calls = []
+
+        def fake_create(client, **request):
+            calls.append(request["max_tokens"])
+            if len(calls) == 1:
+                raise ValueError("unterminated string")
+            return {"objects": []}
+
+        with patch('services.llm_service._create_json_completion', side_effect=fake_create), \
+             patch('services.llm_service.OPENAI_API_KEY', 'test-key'):
+            result = openai_prompt_to_json("a cat", {})
+
+        assert result == {"objects": []}
+        assert calls[0] < DRAWING_MAX_TOKENS and calls[1] == DRAWING_MAX_TOKENS
+
+
+@pytest.mark.unit
+class TestOllamaFallback:
+
+    def test_requests_json_mode_and_keep_alive(self):
+        pytest.importorskip("ollama")
+        from services.llm_service import ollama_complete_shape
+
+        reply = {"message": {"content": '{"complete": false}'}}
+        with patch('ollama.chat', return_value=reply) as mock_chat:
+            result = ollama_complete_shape({"drawings": []})
+
+        kwargs = mock_chat.call_args.kwargs
+        assert result == {"complete": False}
+        assert kwargs["format"] == "json"
+        assert kwargs["keep_alive"]
+        assert kwargs["options"]["temperature"] == 0.1
+
+
+@pytest.mark.unit
+class TestStructuredOutputs:
+
+    def _object_nodes(self, schema):
+        if isinstance(schema, dict):
+            if schema.get("type") == "object":
+                yield schema
+            for value in schema.values():
+                yield from self._object_nodes(value)
+        elif isinstance(schema, list):
+            for value in schema:
+                yield from self._object_nodes(value)
+
+    def test_schemas_meet_strict_mode_rules(self):
+        from services.llm_service import DRAW_SCHEMA, COMPLETION_SCHEMA
+
+        for schema in (DRAW_SCHEMA, COMPLETION_SCHEMA):
+            for node in self._object_nodes(schema):
+                assert node["additionalProperties"] is False
+                assert sorted(node["required"]) == sorted(node["properties"])
+
+    def test_fewshot_replies_match_schemas(self):
+        jsonschema = pytest.importorskip("jsonschema")
+        from services import llm_service
+
+        for i in (1, 2, 3):
+            jsonschema.validate(getattr(llm_service, f"FEWSHOT_ASSISTANT_JSON_{i}"), llm_service.DRAW_SCHEMA)
+            jsonschema.validate(
+                getattr(llm_service, f"SHAPE_COMPLETION_FEWSHOT_ASSISTANT_JSON_{i}"), llm_service.COMPLETION_SCHEMA
+            )
+
+    def test_requests_use_json_schema_format(self):
+        pytest.importorskip("openai")
+        from services.llm_service import openai_complete_shape, COMPLETION_RESPONSE_FORMAT
+
+        with patch('services.llm_service._create_json_completion', return_value={"complete": False}) as mock_create, \
+             patch('services.llm_service._get_openai_client'), \
+             patch('services.llm_service.OPENAI_API_KEY', 'test-key'):
+            openai_complete_shape({"drawings": []})
+
+        assert mock_create.call_args.kwargs["response_format"] == COMPLETION_RESPONSE_FORMAT
+
+
+@pytest.mark.unit
+class TestLocalDraw:
+
+    BOUNDS = {"drawings": [], "bounds": {"width": 1800, "height": 800}}
+
+    def test_single_primitive_prompt_skips_the_model(self):
+        from services import llm_service
+
+        with patch.object(llm_service, "openai_prompt_to_json") as mock_openai:
+            result = llm_service.prompt_to_drawings("draw a small blue circle at the top-right", self.BOUNDS)
+
+        mock_openai.assert_not_called()
+        assert result == {"objects": [{
+            "color": "#0000FF", "lineWidth": 2,
+            "pathData": {"tool": "shape", "type": "circle", "start": {"x": 1760, "y": 40}, "end": {"x": 1800, "y": 40}},
+        }]}
+
+    def test_shapes_stay_inside_bounds(self):
+        from services.llm_service import _try_local_draw
+
+        result = _try_local_draw("Add a large green square in the bottom left corner", self.BOUNDS)
+
+        path = result["objects"][0]["pathData"]
+        assert result["objects"][0]["color"] == "#008000"
+        assert path["start"] == {"x": 0, "y": 520} and path["end"] == {"x": 280, "y": 800}
+
+    @pytest.mark.parametrize("prompt", [
+        "draw a red car",
+        "draw a red circle and a blue square",
+        "draw a circle",
+    ])
+    def test_anything_else_goes_to_the_model(self, prompt):
+        from services.llm_service import _try_local_draw
+
+        assert _try_local_draw(prompt, self.BOUNDS) is None
+
+    def test_needs_canvas_bounds(self):
+        from services.llm_service import _try_local_draw
+
+        assert _try_local_draw("draw a red circle", {}) is None
+
+    def test_stream_yields_the_template(self):
+        from services.llm_service import prompt_to_drawings_stream
+
+        with patch('services.llm_service._openai_drawing_chunks') as mock_chunks:
+            items = list(prompt_to_drawings_stream("draw a red triangle", self.BOUNDS))
+
+        mock_chunks.assert_not_called()
+        assert [o["pathData"]["type"] for o in items] == ["polygon"]
+
+
+@pytest.mark.unit
+class TestClipToBounds:
+
+    BOUNDS = {"width": 1000, "height": 800}
+
+    @pytest.mark.parametrize("use_numpy", [True, False])
+    def test_points_are_clamped_into_the_canvas(self, use_numpy):
+        from services import llm_service
+
+        parsed = {"objects": [
+            {"pathData": {"tool": "shape", "start": {"x": -5, "y": 10}, "end": {"x": 2000, "y": float("nan")}}},
+            {"pathData": [{"x": 1, "y": 2}, {"x": 5, "y": 900}]},
+            {"pathData": {"points": [{"x": float("inf"), "y": 3}]}},
+        ]}
+
+        with patch.object(llm_service, "np", llm_service.np if use_numpy else None):
+            result = llm_service._validate_and_clip(parsed, self.BOUNDS)
+
+        objects = result["objects"]
+        assert objects[0]["pathData"]["start"] == {"x": 0, "y": 10}
+        assert objects[0]["pathData"]["end"] == {"x": 1000, "y": 0}
+        assert objects[1]["pathData"] == [{"x": 1, "y": 2}, {"x": 5, "y": 800}]
+        assert type(objects[1]["pathData"][0]["x"]) is int
+        assert objects[2]["pathData"]["points"] == [{"x": 1000, "y": 3}]
+
+    def test_errors_and_missing_bounds_pass_through(self):
+        from services.llm_service import _validate_and_clip
+
+        error = {"error": "down"}
+        parsed = {"objects": [{"pathData": {"start": {"x": -5, "y": -5}}}]}
+
+        assert _validate_and_clip(error, self.BOUNDS) is error
+        assert _validate_and_clip(parsed, None)["objects"][0]["pathData"]["start"] == {"x": -5, "y": -5}
+
+    def test_model_output_is_clipped(self):
+        from services.llm_service import prompt_to_drawings
+
+        reply = {"objects": [{"pathData": {"tool": "shape", "type": "line",
+                                           "start": {"x": -20, "y": 50}, "end": {"x": 1500, "y": 50}}}]}
+        state = {"drawings": [], "bounds": self.BOUNDS}
+
+        with patch('services.llm_service.openai_prompt_to_json', return_value=reply):
+            result = prompt_to_drawings("draw a horizon line", state)
+
+        assert result["objects"][0]["pathData"]["start"] == {"x": 0, "y": 50}
+        assert result["objects"][0]["pathData"]["end"] == {"x": 1000, "y": 50}
+
+
+@pytest.mark.unit
+class TestHedging:
+
+    def test_fast_primary_never_starts_fallback(self):
+        from services import llm_service
+
+        reply = {"objects": [{"color": "#000000", "pathData": {"tool": "shape", "type": "circle"}}]}
+
+        with patch.object(llm_service, "openai_prompt_to_json", return_value=reply), \
+             patch.object(llm_service, "ollama_prompt_to_json") as fallback:
+            result = llm_service.prompt_to_drawings("draw", {})
+
+        assert result == reply
+        fallback.assert_not_called()
+
+    def test_slow_primary_loses_to_fallback(self):
+        import threading
+        from services import llm_service
+
+        release = threading.Event()
+
+        def slow(*args):
+            release.wait(5)
+            return {"objects": ["openai"]}
+
+        with patch.object(llm_service, "LLM_HEDGE_DELAY_SECS", 0.05):
+            result = llm_service._hedged(slow, lambda *a: {"objects": ["ollama"]}, "draw")
+        release.set()
+
+        assert result == {"objects": ["ollama"]}
+
+    def test_fallback_error_waits_for_primary(self):
+        import time
+        from services import llm_service
+
+        def slow(*args):
+            time.sleep(0.2)
+            return {"objects": ["openai"]}
+
+        with patch.object(llm_service, "LLM_HEDGE_DELAY_SECS", 0.05):
+            result = llm_service._hedged(slow, lambda *a: {"error": "ollama_failed"}, "draw")
+
+        assert result == {"objects": ["openai"]}
+
+    @pytest.mark.parametrize("route, primary, fallback, args, good, bad", [
+        ("prompt_to_drawings", "openai_prompt_to_json", "ollama_prompt_to_json", ("draw a cat", {}),
+         {"objects": [{"color": "#000000", "pathData": {"tool": "shape", "type": "circle"}}]}, {}),
+        ("prompt_to_drawings", "openai_prompt_to_json", "ollama_prompt_to_json", ("draw a cat", {}),
+         {"objects": [{"color": "#000000", "pathData": {"tool": "shape", "type": "circle"}}]}, {"shapes": [{}]}),
+        ("complete_shape_from_canvas", "openai_complete_shape", "ollama_complete_shape", ({"drawings": []},),
+         {"complete": True, "confidence": 0.8, "object": {"pathData": {"tool": "shape", "type": "line"}}}, {}),
+    ])
+    def test_malformed_fast_fallback_waits_for_primary(self, route, primary, fallback, args, good, bad):
+        import time
+        from services import llm_service
+
+        def slow(*a):
+            time.sleep(0.2)
+            return good
+
+        with patch.object(llm_service, "LLM_HEDGE_DELAY_SECS", 0.05), \
+             patch.object(llm_service, primary, side_effect=slow), \
+             patch.object(llm_service, fallback, return_value=bad) as mock_fallback:
+            result = getattr(llm_service, route)(*args)
+
+        assert result == good
+        mock_fallback.assert_called_once()
+
+    def test_primary_error_falls_back(self):
+        from services import llm_service
+
+        with patch.object(llm_service, "LLM_HEDGE_DELAY_SECS", -1):
+            result = llm_service._hedged(lambda *a: {"error": "openai_failed"}, lambda *a: {"objects": []}, "draw")
+
+        assert result == {"objects": []}
+
+    def test_recognition_is_hedged(self):
+        import threading
+        from services import llm_service
+
+        release = threading.Event()
+        objects = [{"color": "#000000", "pathData": {"tool": "freehand"}}]
+
+        def slow(*args):
+            release.wait(5)
+            return [{"label": "openai"}]
+
+        llm_service.clear_cache()
+        with patch.object(llm_service, "LLM_HEDGE_DELAY_SECS", 0.05), \
+             patch.object(llm_service, "openai_recognize_objects_batch", side_effect=slow), \
+             patch.object(llm_service, "ollama_recognize_objects_batch", return_value=[{"label": "boat"}]):
+            result = llm_service.recognize_objects_in_box(objects, {"x": 0, "y": 0}, {})
+        release.set()
+
+        assert result == {"label": "boat"}
+
+
+@pytest.mark.unit
+class TestBatchAPI:
+
+    def _client(self, output_lines, status="completed"):
+        import json
+        from unittest.mock import MagicMock
+
+        client = MagicMock()
+        client.batches.create.return_value = MagicMock(id="batch_1", status="in_progress")
+        client.batches.retrieve.return_value = MagicMock(id="batch_1", status=status, output_file_id="file_out")
+        client.files.content.return_value.text = "\n".join(json.dumps(line) for line in output_lines)
+        return client
+
+    @staticmethod
+    def _line(custom_id, content, status_code=200):
+        return {"custom_id": custom_id, "response": {
+            "status_code": status_code, "body": {"choices": [{"message": {"content": content}}]},
+        }}
+
+    def test_results_come_back_in_input_order_with_rollback(self):
+        import json
+        from services import llm_service
+
+        states = [{"objects": [{"id": str(i)}]} for i in range(3)]
+        client = self._client([
+            self._line("2", '{"objects": ["two"]}'),
+            self._line("0", '{"objects": ["zero"]}'),
+            self._line("1", "not json"),
+        ])
+
+        with patch.object(llm_service, "_get_openai_client", return_value=client):
+            results = llm_service.batch_beautify(states, poll_interval=0)
+
+        assert results == [{"objects": ["zero"]}, {**states[1], "rolledBack": True}, {"objects": ["two"]}]
+        uploaded = client.files.create.call_args.kwargs["file"][1].decode().splitlines()
+        assert [json.loads(line)["custom_id"] for line in uploaded] == ["0", "1", "2"]
+        assert json.loads(uploaded[0])["url"] == "/v1/chat/completions"
+        assert client.batches.create.call_args.kwargs["completion_window"] == "24h"
+
+    def test_failed_batch_marks_every_completion_failed(self):
+        from services import llm_service
+
+        client = self._client([], status="expired")
+
+        with patch.object(llm_service, "_get_openai_client", return_value=client):
+            results = llm_service.batch_complete_shapes([{"drawings": []}, {"drawings": []}], poll_interval=0)
+
+        assert [r["error"] for r in results] == ["openai_batch_failed"] * 2
+
+    def test_timeout_raises(self):
+        from services import llm_service
+
+        client = self._client([], status="in_progress")
+
+        with patch.object(llm_service, "_get_openai_client", return_value=client), \
+             pytest.raises(TimeoutError):
+            llm_service.batch_beautify([{"objects": []}], poll_interval=0, timeout=0)
+
+
+@pytest.mark.unit
+class TestCompletionCache:
+
+    REPLY = {"complete": True, "confidence": 0.9, "object": {"pathData": {"tool": "shape", "type": "circle"}}}
+
+    def _cache(self):
+        np = pytest.importorskip("numpy")
+        from services.llm_cache import SemanticCache
+
+        # Embeds by stroke count along one axis, so canvases with the same
+        # number of strokes are identical and others are orthogonal.
+        def embed(text):
+            self.embeds += 1
+            vec = np.zeros(8, dtype=np.float32)
+            vec[text.count('"pathData"') % 8] = 1.0
+            return vec
+
+        self.embeds = 0
+        return SemanticCache(embed=embed, threshold=0.95, max_entries=4, ttl=60)
+
+    def _canvas(self, strokes):
+        return {"objects": [{"id": str(i), "pathData": {"points": [{"x": i, "y": i}]}} for i in range(strokes)]}
+
+    def test_near_identical_canvas_reuses_completion(self):
+        import services.llm_service as llm_service
+
+        cache = self._cache()
+        with patch.object(llm_service, "_get_completion_cache", return_value=cache), \
+             patch("services.llm_service.OPENAI_API_KEY", "sk-test"), \
+             patch.object(llm_service, "openai_complete_shape", return_value=self.REPLY) as upstream:
+            first = llm_service.complete_shape_from_canvas(self._canvas(2))
+            second = llm_service.complete_shape_from_canvas(self._canvas(2))
+            other = llm_service.complete_shape_from_canvas(self._canvas(3))
+
+        assert first == second == other == self.REPLY
+        assert upstream.call_count == 2
+        assert self.embeds == 3
+        assert cache.stats()["entries"] == 2
+
+    def test_errors_are_not_cached(self):
+        import services.llm_service as llm_service
+
+        cache = self._cache()
+        with patch.object(llm_service, "_get_completion_cache", return_value=cache), \
+             patch("services.llm_service.OPENAI_API_KEY", "sk-test"), \
+             patch.object(llm_service, "openai_complete_shape", return_value={"error": "openai_failed"}), \
+             patch.object(llm_service, "ollama_complete_shape", return_value={"error": "ollama_failed"}) as fallback:
+            llm_service.complete_shape_from_canvas(self._canvas(1))
+            llm_service.complete_shape_from_canvas(self._canvas(1))
+
+        assert fallback.call_count == 2
+        assert cache.stats()["entries"] == 0
+
+
+@pytest.mark.unit
+class TestPromptPrefix:
+
+    def test_only_the_last_message_varies(self):
+        from services.llm_service import _get_text_to_drawings_initial_message, _get_shape_completion_initial_message
+
+        a = _get_text_to_drawings_initial_message("a cat", {"drawings": []})
+        b = _get_text_to_drawings_initial_message("a dog", {"drawings": [{"color": "#000000"}]})
+        c = _get_shape_completion_initial_message({"drawings": []})
+        d = _get_shape_completion_initial_message({"drawings": [{"color": "#000000"}]})
+
+        assert a[:-1] == b[:-1] and a[-1] != b[-1]
+        assert c[:-1] == d[:-1] and c[-1] != d[-1]
+
+    def test_anthropic_format_marks_cache_breakpoints(self):
+        from services.llm_service import _get_shape_completion_initial_message, SHAPE_COMPLETION_SYSTEM
+
+        plain = _get_shape_completion_initial_message({"drawings": []})
+        marked = _get_shape_completion_initial_message({"drawings": []}, provider="anthropic")
+
+        breakpoints = [i for i, m in enumerate(marked) if isinstance(m["content"], list)]
+        assert breakpoints == [0, len(marked) - 2]
+        assert marked[0]["content"][0] == {
+            "type": "text", "text": SHAPE_COMPLETION_SYSTEM, "cache_control": {"type": "ephemeral"},
+        }
+        assert marked[-1] == plain[-1]
+        assert all(isinstance(m["content"], str) for m in plain)
+
+    def test_finetuned_model_gets_no_fewshots(self):
+        pytest.importorskip("openai")
+        from services.llm_service import openai_complete_shape
+
+        with patch('services.llm_service._create_json_completion', return_value={"complete": False}) as mock_create, \
+             patch('services.llm_service._get_openai_client'), \
+             patch('services.llm_service.OPENAI_API_KEY', 'test-key'), \
+             patch('services.llm_service.LLM_COMPLETION_FINETUNED_MODEL', 'ft:gpt-4o-mini:rescanvas:complete'):
+            openai_complete_shape({"drawings": []})
+
+        request = mock_create.call_args.kwargs
+        assert request["model"] == 'ft:gpt-4o-mini:rescanvas:complete'
+        assert [m["role"] for m in request["messages"]] == ["system", "user"]
+
+    def test_openai_request_carries_prompt_cache_key(self):
+        pytest.importorskip("openai")
+        from services.llm_service import openai_prompt_to_json, clear_cache, DRAWING_PROMPT_CACHE_KEY
+
+        clear_cache()
+        with patch('services.llm_service._create_json_completion', return_value={"objects": []}) as mock_create, \
+             patch('services.llm_service.OPENAI_API_KEY', 'test-key'):
+            openai_prompt_to_json("a cat", {})
+
+        assert mock_create.call_args.kwargs["extra_body"] == {"prompt_cache_key": DRAWING_PROMPT_CACHE_KEY}
@@ -0,0 +1,73 @@
+"""
+Fast JSON encoding/decoding.
+
+Canvas payloads (full drawing lists, beautify/style round-trips) are the
+largest JSON documents the backend handles, and the stdlib json module spends
+a noticeable share of each request walking them. orjson is several times
+faster, so it is used when installed; everything falls back to the stdlib
+otherwise.
+
+OrjsonProvider plugs into Flask (app.json) so that jsonify() responses and
+request.get_json() parsing both go through orjson. It keeps Flask's output
+semantics (sorted keys, HTTP-date datetimes, the app's default() hook) and
+defers to the stdlib provider for any call it cannot reproduce exactly.
+"""
+
+import json
+from typing import Any
+
+from flask.json.provider import DefaultJSONProvider
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# Keyword arguments OrjsonProvider.dumps knows how to translate; anything
+# else (cls=, allow_nan=, custom separators, ...) goes to the stdlib.
+_SUPPORTED_DUMPS_KWARGS = {"default", "ensure_ascii", "sort_keys", "indent", "separators"}
+
+
+def dumps(obj: Any) -> str:
+    """Compact JSON string for ``obj``."""
+    if orjson is not None:
+        return orjson.dumps(obj).decode("utf-8")
+    return json.dumps(obj, separators=(",", ":"))
+
+
+def loads(data: Any) -> Any:
+    """Parse JSON from str/bytes; raises ValueError on malformed input."""
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+class OrjsonProvider(DefaultJSONProvider):
+    """Flask JSON provider backed by orjson, falling back to DefaultJSONProvider."""
+
+    def dumps(self, obj: Any, **kwargs: Any) -> str:
+        if orjson is None or not set(kwargs) <= _SUPPORTED_DUMPS_KWARGS:
+            return super().dumps(obj, **kwargs)
+
+        indent = kwargs.get("indent")
+        separators = kwargs.get("separators")
+        if indent not in (None, 2) or separators not in (None, (",", ":")):
+            return super().dumps(obj, **kwargs)
+
+        option = orjson.OPT_NON_STR_KEYS | orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_SERIALIZE_NUMPY
+        if kwargs.get("sort_keys", self.sort_keys):
+            option |= orjson.OPT_SORT_KEYS
+        if indent == 2:
+            option |= orjson.OPT_INDENT_2
+
+        try:
+            return orjson.dumps(obj, default=kwargs.get("default", self.default), option=option).decode("utf-8")
+        except (TypeError, orjson.JSONEncodeError):
+            # e.g. ints beyond 64 bits or mixed-type keys under sort_keys;
+            # the stdlib handles these (or raises the familiar error).
+            return super().dumps(obj, **kwargs)
+
+    def loads(self, s: Any, **kwargs: Any) -> Any:
+        if orjson is None or kwargs:
+            return super().loads(s, **kwargs)
+        return orjson.loads(s)
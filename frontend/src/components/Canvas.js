@@ -2619,7 +2619,7 @@ function Canvas({
 
   // AI Assist functions
   const { 
-    textToDrawing, 
+    textToDrawingStream, 
     generateImage, 
     shapeCompletion, 
     beautifySketch, 
@@ -4168,15 +4168,14 @@ function Canvas({
           },
         };
 
-        const resp = await textToDrawing(prompt, canvasState);
-        const payload = typeof resp === 'string' ? JSON.parse(resp) : resp;
+        // Objects are added to the canvas one by one as the model emits them
+        const payload = await textToDrawingStream(prompt, canvasState, (obj) => addAIGeneratedObjects([obj]));
 
         if (payload && payload.error) {
           // Backend returned an error
           const errorMsg = extractAIErrorMessage(payload);
           showLocalSnack(`AI sketch generation failed: ${errorMsg}`);
         } else if (payload && Array.isArray(payload.objects)) {
-          await addAIGeneratedObjects(payload.objects);
           showLocalSnack("AI objects rendered to canvas.");
         } else {
           showLocalSnack(`An error occurred while generating the sketch. Response: ${JSON.stringify(payload).substring(0, 100)}`);
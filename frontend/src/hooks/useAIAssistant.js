@@ -1,5 +1,34 @@
 import { useState } from "react";
 
+// During local development the React dev server serves the UI on a
+// different port (usually 3000) which will return 404 for backend
+// API routes. Use an explicit backend base URL when running locally.
+function getBackendBase() {
+  const isLocalhost = typeof window !== 'undefined' && (
+    window.location.hostname === 'localhost' || window.location.hostname === '127.0.0.1'
+  );
+  return process.env.REACT_APP_API_URL || (isLocalhost ? 'http://localhost:10010' : '');
+}
+
+// Split complete server-sent events off the front of `buffer`.
+// Returns [events, rest]; each event is { event, data } with data still a string.
+function takeSSEEvents(buffer) {
+  const events = [];
+  let sep;
+  while ((sep = buffer.indexOf("\n\n")) !== -1) {
+    const message = buffer.slice(0, sep);
+    buffer = buffer.slice(sep + 2);
+    let event = "message";
+    let data = "";
+    for (const line of message.split("\n")) {
+      if (line.startsWith("event:")) event = line.slice(6).trim();
+      else if (line.startsWith("data:")) data += line.slice(5).trim();
+    }
+    if (data) events.push({ event, data });
+  }
+  return [events, buffer];
+}
+
 export function useAIAssistant() {
   const [loading, setLoading] = useState(false);
   const [error, setError] = useState(null);
@@ -10,15 +39,7 @@ export function useAIAssistant() {
     setError(null);
 
     try {
-      // During local development the React dev server serves the UI on a
-      // different port (usually 3000) which will return 404 for backend
-      // API routes. Use an explicit backend base URL when running locally.
-      const isLocalhost = typeof window !== 'undefined' && (
-        window.location.hostname === 'localhost' || window.location.hostname === '127.0.0.1'
-      );
-      const BACKEND_BASE = process.env.REACT_APP_API_URL || (isLocalhost ? 'http://localhost:10010' : '');
-
-      const res = await fetch(`${BACKEND_BASE}/api/ai_assistant/${endpoint}`, {
+      const res = await fetch(`${getBackendBase()}/api/ai_assistant/${endpoint}`, {
         method: "POST",
         headers: { "Content-Type": "application/json" },
         body: JSON.stringify(body),
@@ -41,6 +62,61 @@ export function useAIAssistant() {
     }
   };
 
+  // Streaming variant of textToDrawing: reads /drawing/stream and calls
+  // onObject(obj) for each drawing object as soon as the model emits it, so
+  // the canvas fills in progressively. Resolves like textToDrawing.
+  const textToDrawingStream = async (prompt, canvasState, onObject) => {
+    setLoading(true);
+    setError(null);
+
+    try {
+      const res = await fetch(`${getBackendBase()}/api/ai_assistant/drawing/stream`, {
+        method: "POST",
+        headers: { "Content-Type": "application/json" },
+        body: JSON.stringify({ prompt, canvasState }),
+      });
+
+      const isStream = (res.headers.get("Content-Type") || "").startsWith("text/event-stream");
+      if (!res.ok || !isStream || !res.body) {
+        const data = await res.json().catch(() => null);
+        throw data || new Error(`Request failed: ${res.status}`);
+      }
+
+      const objects = [];
+      const reader = res.body.getReader();
+      const decoder = new TextDecoder();
+      let buffer = "";
+      let failure = null;
+
+      for (;;) {
+        const { value, done } = await reader.read();
+        if (done) break;
+        let events;
+        [events, buffer] = takeSSEEvents(buffer + decoder.decode(value, { stream: true }));
+        for (const { event, data } of events) {
+          if (event === "error") {
+            failure = JSON.parse(data);
+          } else if (event === "message") {
+            const obj = JSON.parse(data);
+            objects.push(obj);
+            if (onObject) onObject(obj);
+          }
+        }
+      }
+
+      if (failure) throw failure;
+      const data = { objects };
+      setResult(data);
+      return data;
+    } catch (err) {
+      setError(err?.message || err);
+      console.error("AI assistant error:", err);
+      return { error: err };
+    } finally {
+      setLoading(false);
+    }
+  };
+
   // Wrapper methods for each route
   const textToDrawing = (prompt, canvasState) => callAIAssistant("drawing", { prompt, canvasState });
   const shapeCompletion = (canvasState) => callAIAssistant("complete", { canvasState });
@@ -54,6 +130,7 @@ export function useAIAssistant() {
     aiAssistError: error,
     aiAssistResult: result,
     textToDrawing,
+    textToDrawingStream,
     shapeCompletion,
     generateImage,
     beautifySketch,